@@ -1,16 +1,287 @@
+import datetime as dt
+
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ERROR_FLAG, PAGE_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from core.admin import admin_site
-from .models import Audit
+from secret.fields import encrypted_field_names
+from secret.models import Secret
+from .export import CONTENT_TYPES, EXPORT_FORMATS, export_lines
+from .models import Audit, AuditRollup
+from .pagination import EstimatedCountPaginator
+from .partitions import add_months, is_partitioned, list_partitions, month_start
+from .rollups import untouched_secrets
+
+
+class MonthListFilter(admin.SimpleListFilter):
+    """
+    Limits the list to a calendar month, which on Postgres means a single partition of the audit
+    table. Offers the attached partitions, or the last year when the table is not partitioned.
+    """
+
+    title = "month"
+    parameter_name = "month"
+
+    def lookups(self, request, model_admin):
+        if is_partitioned():
+            months = list_partitions()
+        else:
+            this_month = month_start(timezone.now().date())
+            months = [add_months(this_month, -offset) for offset in range(11, -1, -1)]
+
+        return [(month.strftime("%Y-%m"), month.strftime("%B %Y")) for month in reversed(months)]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+
+        try:
+            year, month = map(int, self.value().split("-"))
+            start = dt.date(year, month, 1)
+        except ValueError:
+            return queryset.none()
+
+        return queryset.filter(
+            timestamp__gte=timezone.make_aware(dt.datetime.combine(start, dt.time())),
+            timestamp__lt=timezone.make_aware(dt.datetime.combine(add_months(start, 1), dt.time())),
+        )
+
+
+class AuditAutocompleteSelect(AutocompleteSelect):
+    """Loads its options from `AuditAdmin.autocomplete_view`, as secrets are not in the admin"""
+
+    def get_url(self):
+        return reverse(f"{self.admin_site.name}:audit_audit_autocomplete")
+
+
+class AutocompleteListFilter(admin.SimpleListFilter):
+    """
+    Filters by a foreign key picked from an autocomplete box, instead of listing every related
+    object in the sidebar. Only the selected object is loaded when the page is rendered.
+    """
+
+    template = "admin/audit/autocomplete_filter.html"
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.field = model._meta.get_field(self.field_name)
+        self.title = self.field.verbose_name
+        self.admin_site = model_admin.admin_site
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+
+        try:
+            return queryset.filter(**{self.field_name: self.value()})
+        except (ValidationError, ValueError) as e:
+            raise IncorrectLookupParameters(e)
+
+    def choices(self, changelist):
+        choice_field = forms.ModelChoiceField(
+            queryset=self.field.remote_field.model._default_manager.all(),
+            required=False,
+            widget=AuditAutocompleteSelect(self.field, self.admin_site),
+        )
+
+        yield {
+            "widget": choice_field.widget.render(
+                self.parameter_name,
+                self.value(),
+                attrs={"id": f"id_{self.parameter_name}", "onchange": "this.form.submit()"},
+            ),
+            # the other filters, search and ordering, kept when this one changes
+            "hidden_params": [
+                (name, value)
+                for name, value in changelist.params.items()
+                if name not in (self.parameter_name, PAGE_VAR, ERROR_FLAG)
+            ],
+            "selected": self.value() is not None,
+            "clear_query_string": changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+
+class UserListFilter(AutocompleteListFilter):
+    field_name = "user"
+    parameter_name = "user__id__exact"
+
+
+class SecretListFilter(AutocompleteListFilter):
+    field_name = "secret"
+    parameter_name = "secret__id__exact"
 
 
 class AuditAdmin(admin.ModelAdmin):
 
     list_display = ("timestamp", "user", "secret", "action")
-    list_filter = ("user", "secret", "action")
+    list_filter = (MonthListFilter, UserListFilter, SecretListFilter, "action")
+    list_select_related = ("user", "secret")
 
     ordering = ("timestamp",)
 
+    paginator = EstimatedCountPaginator
+    # skip the second count of the unfiltered table that "Show all" needs
+    show_full_result_count = False
+
+    # field name: the related model's field searched by, and ordered by, in the autocomplete
+    autocomplete_search_fields = {"user": "email", "secret": "name"}
+    autocomplete_page_size = 20
+
+    @property
+    def media(self):
+        return super().media + AuditAutocompleteSelect(None, self.admin_site).media
+
+    def get_queryset(self, request):
+        # the secret is only shown by name; leave its ciphertext in the database
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("user", "secret")
+            .defer(*(f"secret__{name}" for name in encrypted_field_names(Secret)))
+        )
+
+    def get_urls(self):
+        return [
+            path(
+                "autocomplete/",
+                self.admin_site.admin_view(self.autocomplete_view),
+                name="audit_audit_autocomplete",
+            ),
+            path(
+                "export/",
+                self.admin_site.admin_view(self.export_view),
+                name="audit_audit_export",
+            ),
+        ] + super().get_urls()
+
+    def autocomplete_view(self, request):
+        """The users or secrets matching `term`, in the format the admin's select2 widget expects"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        field_name = request.GET.get("field_name")
+        if field_name not in self.autocomplete_search_fields:
+            raise Http404
+
+        search_field = self.autocomplete_search_fields[field_name]
+        model = Audit._meta.get_field(field_name).remote_field.model
+
+        queryset = model._default_manager.filter(
+            **{f"{search_field}__icontains": request.GET.get("term", "")}
+        ).order_by(search_field, "pk")
+        page = Paginator(queryset, self.autocomplete_page_size).get_page(request.GET.get("page"))
+
+        return JsonResponse(
+            {
+                "results": [{"id": str(obj.pk), "text": str(obj)} for obj in page.object_list],
+                "pagination": {"more": page.has_next()},
+            }
+        )
+
+    def export_view(self, request):
+        """
+        Stream audit events as CSV or NDJSON, e.g. `?format=ndjson&after_id=1234`; see
+        `audit.export` and the `export_audit` command
+        """
+        if not request.user.is_superuser:
+            raise PermissionDenied
+
+        export_format = request.GET.get("format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            export_format = "ndjson"
+
+        try:
+            after_id = int(request.GET["after_id"]) if request.GET.get("after_id") else None
+            since = parse_datetime(request.GET.get("since", ""))
+        except ValueError:
+            after_id = since = None
+
+        response = StreamingHttpResponse(
+            export_lines(export_format, after_id=after_id, since=since),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="audit.{export_format}"'
+
+        return response
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class AuditRollupAdmin(admin.ModelAdmin):
+    """Daily audit counts per secret and user; see `audit.rollups`"""
+
+    list_display = ("day", "secret", "user", "action", "count")
+    list_filter = (UserListFilter, SecretListFilter, "action")
+    list_select_related = ("user", "secret")
+    date_hierarchy = "day"
+
+    ordering = ("-day",)
+
+    change_list_template = "admin/audit/auditrollup/change_list.html"
+
+    def get_urls(self):
+        return [
+            path(
+                "untouched/",
+                self.admin_site.admin_view(self.untouched_view),
+                name="audit_auditrollup_untouched",
+            ),
+        ] + super().get_urls()
+
+    def untouched_view(self, request):
+        """Secrets with no activity in the last `?days=` days, a year by default"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        try:
+            days = max(int(request.GET.get("days", 365)), 1)
+        except ValueError:
+            days = 365
+
+        page = Paginator(untouched_secrets(days).order_by("name", "pk"), 100).get_page(
+            request.GET.get("page")
+        )
+
+        return TemplateResponse(
+            request,
+            "admin/audit/auditrollup/untouched.html",
+            {
+                **self.admin_site.each_context(request),
+                "title": f"Secrets untouched for {days} days",
+                "opts": self.model._meta,
+                "days": days,
+                "page_obj": page,
+            },
+        )
+
+    @property
+    def media(self):
+        return super().media + AuditAutocompleteSelect(None, self.admin_site).media
+
     def has_add_permission(self, request, obj=None):
         return False
 
@@ -22,3 +293,4 @@ class AuditAdmin(admin.ModelAdmin):
 
 
 admin_site.register(Audit, AuditAdmin)
+admin_site.register(AuditRollup, AuditRollupAdmin)
@@ -0,0 +1,25 @@
+import django_filters
+
+from user.models import User
+from .models import Actions, Audit, AuditRollup
+
+
+class AuditFilter(django_filters.FilterSet):
+    action = django_filters.ChoiceFilter(choices=Actions.list(), empty_label="All actions")
+    user = django_filters.ModelChoiceFilter(queryset=User.objects.none(), empty_label="All users")
+
+    def __init__(self, *args, secret=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # only offer the users who appear in this secret's history, going by its rollups, which
+        # hold a row per user per day rather than per event
+        users = User.objects.all()
+
+        if secret:
+            users = users.filter(pk__in=AuditRollup.objects.filter(secret=secret).values("user_id"))
+
+        self.filters["user"].queryset = users.order_by("email")
+
+    class Meta:
+        model = Audit
+        fields = ["action", "user"]
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from audit.partitions import (
+    add_months,
+    archive_partition,
+    create_partitions,
+    is_partitioned,
+    list_partitions,
+    month_start,
+    partition_name,
+    restore_partition,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the monthly partitions of the audit table: create upcoming partitions and, "
+        "optionally, archive partitions past the retention period or restore archived ones"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=settings.AUDIT_PARTITIONS_MONTHS_AHEAD,
+            help="Create partitions for this many months after the current one",
+        )
+        parser.add_argument(
+            "--archive",
+            action="store_true",
+            help="Detach partitions older than the retention period and archive them to files",
+        )
+        parser.add_argument(
+            "--retention-months",
+            type=int,
+            default=settings.AUDIT_RETENTION_MONTHS,
+            help="Months of audit history to keep in the database (AUDIT_RETENTION_MONTHS)",
+        )
+        parser.add_argument("--archive-dir", default=settings.AUDIT_ARCHIVE_DIR)
+        parser.add_argument(
+            "--restore",
+            nargs="+",
+            metavar="ARCHIVE",
+            help="Attach the partitions in these archive files again",
+        )
+        parser.add_argument("--list", action="store_true", help="List the attached partitions")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            self.stdout.write("The audit table is not partitioned; nothing to do.")
+            return
+
+        if options["list"]:
+            for month in list_partitions():
+                self.stdout.write(partition_name(month))
+            return
+
+        if options["restore"]:
+            for path in options["restore"]:
+                try:
+                    name = restore_partition(path)
+                except ValueError as e:
+                    raise CommandError(str(e))
+
+                self.stdout.write(f"Restored {name} from {path}")
+            return
+
+        this_month = month_start(timezone.now().date())
+
+        created = create_partitions(this_month, add_months(this_month, options["months_ahead"]))
+        for name in created:
+            self.stdout.write(f"Created {name}")
+
+        if options["archive"]:
+            self.archive(this_month, options["retention_months"], options["archive_dir"])
+
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def archive(self, this_month, retention_months, archive_dir):
+        if not retention_months:
+            raise CommandError("Set AUDIT_RETENTION_MONTHS or --retention-months to archive")
+
+        cutoff = add_months(this_month, -retention_months)
+
+        for month in list_partitions():
+            if month < cutoff:
+                path = archive_partition(month, archive_dir)
+                self.stdout.write(f"Archived {partition_name(month)} to {path}")
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from audit.export import (
+    DEFAULT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    csv_lines,
+    ecs_events,
+    export_queryset,
+    ndjson_lines,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream audit events as ECS-named CSV or NDJSON. Pass the high-water mark printed at the "
+        "end as --after-id to carry on from where the previous export stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+        parser.add_argument("--after-id", type=int, help="Only export events with a greater id")
+        parser.add_argument("--since", help="Only export events at or after this ISO 8601 time")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument("--output", help="File to write to, instead of stdout")
+
+    def handle(self, *args, **options):
+        since = None
+
+        if options["since"]:
+            since = parse_datetime(options["since"])
+
+            if since is None:
+                raise CommandError(f"Cannot parse --since {options['since']!r}")
+
+        self.last_id = options["after_id"]
+        self.exported = 0
+
+        events = self.track(
+            ecs_events(export_queryset(options["after_id"], since), options["chunk_size"])
+        )
+        lines = csv_lines(events) if options["format"] == "csv" else ndjson_lines(events)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
+
+        self.stderr.write(
+            f"Exported {self.exported} events. High-water mark: --after-id {self.last_id}"
+        )
+
+    def track(self, events):
+        for event in events:
+            self.last_id = event["event.id"]
+            self.exported += 1
+            yield event
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from audit.writer import AuditWriter
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the audit events spooled by processes that died before writing them. Run it as the "
+        "web processes start; spools of processes that are still running are left alone."
+    )
+
+    def handle(self, *args, **options):
+        writer = AuditWriter(
+            batch_size=settings.AUDIT_WRITER_BATCH_SIZE,
+            flush_interval_ms=settings.AUDIT_WRITER_FLUSH_INTERVAL_MS,
+            spool_dir=settings.AUDIT_WRITER_SPOOL_DIR,
+        )
+        replayed = writer.replay_spools()
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {replayed} spooled audit events were written."))
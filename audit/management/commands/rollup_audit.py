@@ -0,0 +1,61 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from audit.models import Audit, AuditRollup
+from audit.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the per-secret, per-day audit rollups from the audit table. By default this "
+        "catches up from the latest day already rolled up, or the first audit event, to today."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Rebuild from this day (YYYY-MM-DD) onwards")
+        parser.add_argument(
+            "--full", action="store_true", help="Rebuild from the first audit event onwards"
+        )
+        parser.add_argument(
+            "--days-per-batch",
+            type=int,
+            default=7,
+            help="Days rebuilt in each transaction",
+        )
+
+    def handle(self, *args, **options):
+        if options["since"]:
+            start = parse_date(options["since"])
+
+            if start is None:
+                raise CommandError(f"Cannot parse --since {options['since']!r}")
+        else:
+            # the latest day may only be partly rolled up, so it is rebuilt too
+            start = (
+                None if options["full"] else AuditRollup.objects.aggregate(Max("day"))["day__max"]
+            )
+
+            if start is None:
+                first = Audit.objects.aggregate(Min("timestamp"))["timestamp__min"]
+
+                if first is None:
+                    self.stdout.write("There are no audit events to roll up.")
+                    return
+
+                start = timezone.localdate(first)
+
+        today = timezone.localdate()
+        batch = dt.timedelta(days=options["days_per_batch"])
+        day = start
+        rollups = 0
+
+        while day <= today:
+            end = min(day + batch - dt.timedelta(days=1), today)
+            rollups += rebuild_rollups(day, end)
+            day = end + dt.timedelta(days=1)
+
+        self.stdout.write(f"Rebuilt {rollups} rollups from {start} to {today}.")
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0006_auto_20211112_1451"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="audit",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
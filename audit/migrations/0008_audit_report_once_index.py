@@ -0,0 +1,20 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0007_audit_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="audit",
+            index=models.Index(
+                fields=["user", "action", "secret", "-timestamp"],
+                name="audit_audit_user_id_b7ecb5_idx",
+            ),
+        ),
+    ]
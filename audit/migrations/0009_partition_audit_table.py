@@ -0,0 +1,130 @@
+import datetime as dt
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# copied from `audit.partitions` as it was when this migration was written, so that later changes
+# there do not change what the migration does
+TABLE = "audit_audit"
+DEFAULT_PARTITION = f"{TABLE}_default"
+OLD_TABLE = f"{TABLE}_unpartitioned"
+
+# partitions created beyond the current month; `audit_partitions` keeps this topped up
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return dt.date(index // 12, index % 12 + 1, 1)
+
+
+def _create_partitions(cursor, start, end):
+    """
+    Create a partition for each month from `start` to `end` inclusive, while the new table is
+    still empty, named and bounded as `audit.partitions` does
+    """
+    month = dt.date(start.year, start.month, 1)
+
+    while month <= end:
+        name = f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+        next_month = _add_months(month, 1)
+
+        cursor.execute(
+            f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+            [month.isoformat(), next_month.isoformat()],
+        )
+
+        month = next_month
+
+
+def _definitions(cursor):
+    """The table's secondary indexes and foreign keys, to be recreated on the new table"""
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+        "(SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p')",
+        [TABLE, TABLE],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+
+    return indexes, foreign_keys
+
+
+def _rebuild(schema_editor, partitioned):
+    """
+    Recreate the audit table, partitioned or not, copying its rows across. Postgres requires the
+    partition key in the primary key, so the partitioned table's is (id, timestamp).
+    """
+    with schema_editor.connection.cursor() as cursor:
+        indexes, foreign_keys = _definitions(cursor)
+
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}")
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0), MIN("timestamp") FROM {OLD_TABLE}')
+        max_id, oldest = cursor.fetchone()
+
+        if partitioned:
+            cursor.execute(
+                f'CREATE TABLE {TABLE} (LIKE {OLD_TABLE}) PARTITION BY RANGE ("timestamp")'
+            )
+            cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+
+            this_month = timezone.now().date()
+            _create_partitions(cursor, oldest or this_month, _add_months(this_month, MONTHS_AHEAD))
+            primary_key = 'id, "timestamp"'
+        else:
+            cursor.execute(f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE})")
+            primary_key = "id"
+
+        cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}")
+        # also drops the old table's indexes, foreign keys and id sequence
+        cursor.execute(f"DROP TABLE {OLD_TABLE} CASCADE")
+
+        cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY ({primary_key})")
+        cursor.execute(f"CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id")
+        cursor.execute(f"SELECT setval('{TABLE}_id_seq', %s + 1, false)", [max_id])
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+
+        for index in indexes:
+            cursor.execute(index)
+
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+
+
+def partition_audit_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    _rebuild(schema_editor, partitioned=True)
+
+
+def unpartition_audit_table(apps, schema_editor):
+    # rows in partitions archived by `audit_partitions` are not brought back
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    _rebuild(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0008_audit_report_once_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_audit_table, unpartition_audit_table),
+        migrations.AddIndex(
+            model_name="audit",
+            index=models.Index(fields=["timestamp"], name="audit_audit_timesta_787318_idx"),
+        ),
+    ]
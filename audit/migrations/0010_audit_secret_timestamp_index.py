@@ -0,0 +1,19 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0009_partition_audit_table"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="audit",
+            index=models.Index(
+                fields=["secret", "-timestamp"], name="audit_audit_secret__09ab7e_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("secret", "0013_lazy_encrypted_fields"),
+        ("audit", "0010_audit_secret_timestamp_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuditRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("imported", "Imported"),
+                            ("create_secret", "Created"),
+                            ("update_secret", "Updated"),
+                            ("delete_secret", "Deleted"),
+                            ("view_secret", "Viewed"),
+                            ("add_permission", "Added permission"),
+                            ("remove_permission", "Removed permission"),
+                            ("setup_mfa", "Set up MFA client"),
+                            ("delete_mfa", "Delete MFA client"),
+                            ("generate_mfa_token", "Generate MFA token"),
+                            ("download_file", "Download file"),
+                            ("upload_file", "Upload file"),
+                            ("delete_file", "Delete file"),
+                        ],
+                        max_length=255,
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "secret",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="secret.secret",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "audit rollup",
+                "indexes": [
+                    models.Index(
+                        fields=["secret", "action", "day"], name="audit_audit_secret__356f8a_idx"
+                    ),
+                    models.Index(fields=["-day"], name="audit_audit_day_1f6570_idx"),
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="auditrollup",
+            constraint=models.UniqueConstraint(
+                fields=("secret", "user", "action", "day"), name="audit_rollup_unique"
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import datetime as dt
-from django.db import models
+from django.core.cache import caches
+from django.db import models, transaction
 
 from django.utils import timezone
 from django.conf import settings
@@ -24,7 +25,8 @@ class Actions(StrEnum):
 
 
 class Audit(models.Model):
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set when the event happens rather than when the audit writer gets round to inserting it
+    timestamp = models.DateTimeField(default=timezone.now)
     user = models.ForeignKey("user.User", on_delete=models.PROTECT)
     secret = models.ForeignKey("secret.Secret", on_delete=models.PROTECT, null=True, blank=True)
     action = models.CharField(choices=Actions.list(), max_length=255)
@@ -32,31 +34,159 @@ class Audit(models.Model):
 
     class Meta:
         verbose_name_plural = "audit"
+        indexes = [
+            # the `report_once` lookup in `create_audit_event`
+            models.Index(fields=["user", "action", "secret", "-timestamp"]),
+            # ordered scans across partitions, e.g. the admin list
+            models.Index(fields=["timestamp"]),
+            # a secret's history, newest first
+            models.Index(fields=["secret", "-timestamp"]),
+        ]
 
 
-def create_audit_event(user, action: Actions, description=None, secret=None, report_once=False):
+class AuditRollup(models.Model):
+    """
+    The number of times a user took an action on a secret in a day, kept up to date by
+    `create_audit_event` and the audit writer, or rebuilt from the audit table by the
+    `rollup_audit` command. See `audit.rollups`.
+    """
+
+    secret = models.ForeignKey("secret.Secret", on_delete=models.CASCADE, related_name="+")
+    user = models.ForeignKey("user.User", on_delete=models.CASCADE, related_name="+")
+    action = models.CharField(choices=Actions.list(), max_length=255)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "audit rollup"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["secret", "user", "action", "day"], name="audit_rollup_unique"
+            ),
+        ]
+        indexes = [
+            # a secret's activity over a period, e.g. `secret_activity`
+            models.Index(fields=["secret", "action", "day"]),
+            # the rollup admin, newest first
+            models.Index(fields=["-day"]),
+        ]
+
+
+def _already_reported(user, action, secret, extra_key=None):
+    """
+    Whether an event with the same user, action and secret was recorded within the
+    `settings.AUDIT_EVENT_REPEAT_AFTER_MINUTES` window, noting this one if not.
+
+    A key in the audit cache marks each reported event for the length of the window, so repeat
+    views are turned away without touching the database. The table is only read when the key is
+    missing, e.g. after a restart or an eviction.
+
+    `extra_key` tells apart events that the table does not, e.g. downloads of different files.
+    Such events are only looked for in the cache, so after an eviction one is reported again.
+    """
+    window = dt.timedelta(minutes=settings.AUDIT_EVENT_REPEAT_AFTER_MINUTES)
+    key = f"audit:report-once:{user.pk}:{action.name}:{secret.pk if secret else ''}"
+    cache = caches["audit"]
+
+    if extra_key:
+        key += f":{extra_key}"
+
+    # add() only succeeds for the first of any concurrent requests
+    if not cache.add(key, True, timeout=window.total_seconds()):
+        return True
+
+    if extra_key:
+        return False
+
+    query = {"user": user, "action": action.name}
+
+    if secret:
+        query["secret"] = secret
+
+    last_reported = (
+        Audit.objects.filter(**query)
+        .order_by("-timestamp")
+        .values_list("timestamp", flat=True)
+        .first()
+    )
+
+    if last_reported and last_reported >= timezone.now() - window:
+        cache.set(key, True, timeout=(last_reported + window - timezone.now()).total_seconds())
+        return True
+
+    return False
+
+
+def create_audit_event(
+    user, action: Actions, description=None, secret=None, report_once=False, report_once_key=None
+):
     """
     Create an audit event
 
     If `report_once` is True, then the event will not be created if an event with the same user & action exists
-    within the `settings.AUDIT_EVENT_REPEAT_AFTER_MINUTES` period.
+    within the `settings.AUDIT_EVENT_REPEAT_AFTER_MINUTES` period. `report_once_key` narrows "the same"
+    further, see `_already_reported`.
     """
-    if report_once:
-        report_window_start = timezone.now() - dt.timedelta(
-            minutes=settings.AUDIT_EVENT_REPEAT_AFTER_MINUTES
+    if report_once and _already_reported(user, action, secret, extra_key=report_once_key):
+        return
+
+    if settings.AUDIT_WRITER_MODE == "sync":
+        from .rollups import record_rollups
+
+        with transaction.atomic():
+            audit = Audit.objects.create(
+                user=user,
+                action=action.name,
+                description=description or "",
+                secret=secret,
+            )
+            record_rollups([audit])
+        return
+
+    from .writer import get_writer, serialise_event
+
+    get_writer().submit(
+        serialise_event(
+            timezone.now(),
+            user.pk,
+            action.name,
+            description=description or "",
+            secret_id=secret.pk if secret else None,
         )
+    )
+
+
+def create_audit_events(user, action: Actions, descriptions, secret=None):
+    """
+    Create an event for each of `descriptions` at once, e.g. one per file in a download of several.
+    In "sync" mode they are inserted in one query, and in "async" mode spooled and queued together.
+    """
+    if not descriptions:
+        return
 
-        query = {"user": user, "action": action.name, "timestamp__gte": report_window_start}
+    if settings.AUDIT_WRITER_MODE == "sync":
+        from .rollups import record_rollups
 
-        if secret:
-            query["secret"] = secret
+        with transaction.atomic():
+            audits = Audit.objects.bulk_create(
+                Audit(user=user, action=action.name, description=description, secret=secret)
+                for description in descriptions
+            )
+            record_rollups(audits)
+        return
 
-        if Audit.objects.filter(**query).exists():
-            return
+    from .writer import get_writer, serialise_event
 
-    Audit.objects.create(
-        user=user,
-        action=action.name,
-        description=description or "",
-        secret=secret,
+    now = timezone.now()
+    get_writer().submit_many(
+        [
+            serialise_event(
+                now,
+                user.pk,
+                action.name,
+                description=description,
+                secret_id=secret.pk if secret else None,
+            )
+            for description in descriptions
+        ]
     )
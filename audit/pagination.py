@@ -0,0 +1,64 @@
+"""
+A paginator for the audit admin that does not count millions of rows.
+
+Up to `exact_count_limit` rows are counted exactly with a bounded `COUNT(*)` over a `LIMIT`ed
+subquery. Past that, Postgres' own estimate is used: `pg_class.reltuples` (summed over the
+partitions, see `audit.partitions`) for the whole table, or the planner's row estimate for a
+filtered list. Other databases fall back to an exact count.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_table_rows(table, connection):
+    """The rows in `table` according to the last ANALYZE, summing its partitions if it has any"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE("
+            "(SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)), "
+            "(SELECT GREATEST(reltuples, 0) FROM pg_class WHERE oid = to_regclass(%s)), 0)",
+            [table, table],
+        )
+        return int(cursor.fetchone()[0])
+
+
+def estimated_query_rows(queryset):
+    """The planner's estimate of the rows `queryset` returns"""
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    def __init__(self, *args, exact_count_limit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if exact_count_limit is None:
+            exact_count_limit = settings.AUDIT_ADMIN_EXACT_COUNT_LIMIT
+        self.exact_count_limit = exact_count_limit
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        end = self.exact_count_limit + 1
+
+        counted = queryset[:end].count()
+        if counted <= self.exact_count_limit:
+            return counted
+
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return queryset.count()
+
+        if queryset.query.where:
+            estimate = estimated_query_rows(queryset)
+        else:
+            estimate = estimated_table_rows(queryset.model._meta.db_table, connection)
+
+        # the estimate can lag behind; there are at least as many rows as were counted
+        return max(estimate, counted)
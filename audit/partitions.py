@@ -0,0 +1,203 @@
+"""
+Monthly range partitioning of the audit table on Postgres.
+
+Migration 0009 turns `audit_audit` into a table partitioned by `timestamp`, one partition per
+calendar month named `audit_audit_pYYYY_MM`, plus a default partition catching anything outside
+them. The `audit_partitions` management command keeps partitions created ahead of time and moves
+partitions past the retention period out of the database into gzipped CSV archives, which can be
+attached again when needed.
+
+An archived partition is no longer covered by the audit table's foreign keys, so the users and
+secrets its rows refer to can be deleted in the meantime. Attaching it again would then fail the
+foreign keys, and `restore_partition` refuses such an archive, saying how many rows refer to what
+is gone. Its rows can still be read from the archive itself, e.g. with `zcat`.
+
+The model is unchanged; Postgres prunes partitions for queries with a `timestamp` condition and
+reads them in order for `ORDER BY timestamp ... LIMIT`. Other databases keep a plain table and every
+function here is a no-op for them.
+"""
+
+import datetime as dt
+import gzip
+import os
+import re
+
+from django.db import connection as default_connection, transaction
+
+from .models import Audit
+
+TABLE = "audit_audit"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+PARTITION_RE = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+
+def month_start(date):
+    return dt.date(date.year, date.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return dt.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name):
+    """The month a partition (or its archive file) holds, or None if `name` is not a partition"""
+    match = PARTITION_RE.match(name.split(".")[0])
+
+    if match:
+        return dt.date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def _bounds(month):
+    return month.isoformat(), add_months(month, 1).isoformat()
+
+
+def is_partitioned(connection=default_connection):
+    if connection.vendor != "postgresql":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(connection=default_connection):
+    """The months with a partition attached, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    return sorted(month for month in map(partition_month, names) if month)
+
+
+def _attach(cursor, name, month):
+    start, end = _bounds(month)
+
+    # rows for the month may already have landed in the default partition, which would stop the
+    # new partition from attaching
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+        f"INSERT INTO {name} SELECT * FROM moved",
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+        [start, end],
+    )
+
+
+@transaction.atomic
+def create_partition(month, connection=default_connection):
+    name = partition_name(month)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        _attach(cursor, name, month)
+
+    return name
+
+
+def create_partitions(start, end, connection=default_connection):
+    """Create any missing partitions for the months from `start` to `end` inclusive"""
+    existing = set(list_partitions(connection))
+    created = []
+
+    month = month_start(start)
+    while month <= end:
+        if month not in existing:
+            created.append(create_partition(month, connection))
+        month = add_months(month, 1)
+
+    return created
+
+
+def archive_partition(month, archive_dir, connection=default_connection):
+    """
+    Detach the partition for `month`, write its rows to `<archive_dir>/<partition>.csv.gz` and drop
+    it. Returns the archive's path.
+    """
+    name = partition_name(month)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    partial_path = f"{path}.partial"
+
+    os.makedirs(archive_dir, exist_ok=True)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+
+        with open(partial_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+                cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        # only drop the rows once the archive is safely in place
+        os.replace(partial_path, path)
+        cursor.execute(f"DROP TABLE {name}")
+
+    return path
+
+
+def _orphaned_rows(cursor, name):
+    """The number of rows in the partition `name` that refer to users or secrets since deleted"""
+    conditions = []
+
+    for field in ("user", "secret"):
+        column = Audit._meta.get_field(field).column
+        related = Audit._meta.get_field(field).related_model._meta
+        conditions.append(
+            f"({column} IS NOT NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM {related.db_table} WHERE {related.pk.column} = {name}.{column}))"
+        )
+
+    cursor.execute(f"SELECT COUNT(*) FROM {name} WHERE {' OR '.join(conditions)}")
+    return cursor.fetchone()[0]
+
+
+@transaction.atomic
+def restore_partition(path, connection=default_connection):
+    """
+    Attach the partition archived in `path` again. Raises ValueError, leaving the database as it
+    was, if any of its rows refer to users or secrets deleted since it was archived.
+    """
+    month = partition_month(os.path.basename(path))
+
+    if not month:
+        raise ValueError(f"{path} is not an audit partition archive")
+
+    name = partition_name(month)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+
+        with gzip.open(path, "rb") as archive:
+            cursor.copy_expert(f"COPY {name} FROM STDIN WITH (FORMAT csv, HEADER)", archive)
+
+        orphaned = _orphaned_rows(cursor, name)
+
+        if orphaned:
+            raise ValueError(
+                f"{path} cannot be attached again, as {orphaned} of its rows refer to users or "
+                "secrets deleted since it was archived"
+            )
+
+        _attach(cursor, name, month)
+
+    return name
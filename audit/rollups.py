@@ -0,0 +1,144 @@
+"""
+Per-secret, per-day audit counts.
+
+`AuditRollup` holds one row per (secret, user, action, day) with the number of matching audit
+events, so questions such as "who viewed this secret in the last 90 days" or "which secrets have
+not been touched in a year" are answered from a small indexed table instead of the audit table.
+Events without a secret are not rolled up.
+
+With `settings.AUDIT_ROLLUP_ON_WRITE` on, every write of audit events also increments the
+rollups in the same transaction, with one upsert for however many events are written together.
+Otherwise, or to backfill existing history, the `rollup_audit` command rebuilds them from the
+audit table a day at a time. Days are in the current time zone.
+"""
+
+import collections
+import datetime as dt
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from secret.bulk import chunks
+from secret.models import Secret
+from .models import Actions, Audit, AuditRollup
+
+
+def _day_start(day):
+    return timezone.make_aware(dt.datetime.combine(day, dt.time()))
+
+
+def _upsert_rollups(counts, replace=False):
+    """
+    Write `counts`, pairs of a (secret_id, user_id, action, day) key and its count, adding to the
+    counts already there or, with `replace`, overwriting them
+    """
+    quote = connection.ops.quote_name
+    table = quote(AuditRollup._meta.db_table)
+    fields = [AuditRollup._meta.get_field(name) for name in ("secret", "user", "action", "day")]
+    columns = [field.column for field in fields] + ["count"]
+    count = quote("count")
+    update = f"EXCLUDED.{count}" if replace else f"{table}.{count} + EXCLUDED.{count}"
+    # the rows a statement can hold within the database's limit on parameters
+    batch_size = (connection.features.max_query_params or 5000) // len(columns)
+
+    # Postgres and SQLite both take ON CONFLICT, which also covers concurrent writes of a key
+    for batch in chunks(counts, batch_size):
+        sql = (
+            f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))} "
+            f"ON CONFLICT ({', '.join(quote(column) for column in columns[:4])}) "
+            f"DO UPDATE SET {count} = {update}"
+        )
+        params = [
+            value
+            for key, events in batch
+            for value in (
+                *(field.get_db_prep_value(part, connection) for field, part in zip(fields, key)),
+                events,
+            )
+        ]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+def record_rollups(events):
+    """Add the given, just written, `Audit` events to the rollups"""
+    if not settings.AUDIT_ROLLUP_ON_WRITE:
+        return
+
+    counts = collections.Counter(
+        (event.secret_id, event.user_id, event.action, timezone.localdate(event.timestamp))
+        for event in events
+        if event.secret_id
+    )
+
+    _upsert_rollups(counts.items())
+
+
+@transaction.atomic
+def rebuild_rollups(start, end):
+    """
+    Replace the rollups for the days from `start` to `end` inclusive with fresh counts.
+
+    The counts overwrite the rollups in place rather than after deleting them, so that
+    `record_rollups` can keep writing the same days, today included, meanwhile.
+    """
+    rollups = AuditRollup.objects.filter(day__gte=start, day__lte=end)
+    # read before counting, so that rollups first written after the count are not taken as stale
+    existing = {
+        (secret_id, user_id, action, day): pk
+        for pk, secret_id, user_id, action, day in rollups.values_list(
+            "pk", "secret", "user", "action", "day"
+        ).iterator()
+    }
+
+    rows = (
+        Audit.objects.filter(
+            secret__isnull=False,
+            timestamp__gte=_day_start(start),
+            timestamp__lt=_day_start(end + dt.timedelta(days=1)),
+        )
+        .annotate(day=TruncDate("timestamp"))
+        .values("secret", "user", "action", "day")
+        .annotate(events=Count("id"))
+        .order_by()
+    )
+    counts = {
+        (row["secret"], row["user"], row["action"], row["day"]): row["events"]
+        for row in rows.iterator()
+    }
+
+    _upsert_rollups(counts.items(), replace=True)
+
+    # rollups of events no longer in the audit table
+    stale = [pk for key, pk in existing.items() if key not in counts]
+
+    for batch in chunks(stale, 1000):
+        AuditRollup.objects.filter(pk__in=batch).delete()
+
+    return len(counts)
+
+
+def secret_activity(secret, days=90, action=Actions.view_secret):
+    """The users who took `action` on `secret` in the last `days` days, most active first"""
+    since = timezone.localdate() - dt.timedelta(days=days)
+
+    return (
+        AuditRollup.objects.filter(secret=secret, action=action.name, day__gt=since)
+        .values("user", "user__email")
+        .annotate(total=Sum("count"))
+        .order_by("-total", "user__email")
+    )
+
+
+def untouched_secrets(days=365):
+    """Secrets with no audited activity in the last `days` days"""
+    since = timezone.localdate() - dt.timedelta(days=days)
+
+    return Secret.objects.filter(deleted=False).exclude(
+        Exists(AuditRollup.objects.filter(secret=OuterRef("pk"), day__gt=since))
+    )
@@ -0,0 +1,125 @@
+import pytest
+
+from django.urls import reverse
+
+from audit.models import Actions, Audit
+from audit.pagination import EstimatedCountPaginator
+from secret.tests.factories import SecretFactory
+from user.tests.factories import UserFactory, otp_verify_user
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def admin_client(client):
+    user = UserFactory(is_staff=True, is_superuser=True, two_factor_enabled=True)
+    client.force_login(user)
+    otp_verify_user(user, client)
+    return client
+
+
+class TestEstimatedCountPaginator:
+    def test_exact_count_below_limit(self):
+        user = UserFactory()
+        for _ in range(3):
+            Audit.objects.create(user=user, action=Actions.view_secret.name)
+
+        paginator = EstimatedCountPaginator(Audit.objects.all(), 2, exact_count_limit=5)
+
+        assert paginator.count == 3
+        assert paginator.num_pages == 2
+
+    def test_exact_count_above_limit_without_postgres(self, django_assert_num_queries):
+        user = UserFactory()
+        for _ in range(4):
+            Audit.objects.create(user=user, action=Actions.view_secret.name)
+
+        paginator = EstimatedCountPaginator(Audit.objects.all(), 2, exact_count_limit=2)
+
+        # the bounded count, then the full one
+        with django_assert_num_queries(2):
+            assert paginator.count == 4
+
+
+class TestAuditChangelist:
+    def test_filter_sidebar_does_not_list_users_or_secrets(self, admin_client):
+        user = UserFactory(email="audited@example.com")
+        other = UserFactory(email="not-audited@example.com")
+        SecretFactory(name="unaudited-secret", created_by=other)
+        Audit.objects.create(user=user, action=Actions.create_secret.name)
+
+        response = admin_client.get(reverse("admin:audit_audit_changelist"))
+
+        assert response.status_code == 200
+        content = response.content.decode()
+        assert "audited@example.com" in content
+        assert "not-audited@example.com" not in content
+        assert "unaudited-secret" not in content
+        assert reverse("admin:audit_audit_autocomplete") in content
+
+    def test_filter_by_user(self, admin_client):
+        user = UserFactory(email="audited@example.com")
+        other = UserFactory(email="other@example.com")
+        Audit.objects.create(user=user, action=Actions.create_secret.name)
+        Audit.objects.create(user=other, action=Actions.create_secret.name)
+
+        response = admin_client.get(
+            reverse("admin:audit_audit_changelist"), {"user__id__exact": user.pk}
+        )
+
+        assert list(response.context["cl"].result_list.values_list("user", flat=True)) == [user.pk]
+        # the selected user is rendered as the autocomplete's only option
+        assert f'<option value="{user.pk}" selected>audited@example.com</option>' in (
+            response.content.decode()
+        )
+
+    def test_filter_by_secret(self, admin_client):
+        user = UserFactory()
+        secret = SecretFactory(created_by=user)
+        Audit.objects.create(user=user, secret=secret, action=Actions.view_secret.name)
+        Audit.objects.create(user=user, action=Actions.create_secret.name)
+
+        response = admin_client.get(
+            reverse("admin:audit_audit_changelist"), {"secret__id__exact": str(secret.pk)}
+        )
+
+        assert [audit.secret for audit in response.context["cl"].result_list] == [secret]
+
+    def test_invalid_secret_filter(self, admin_client):
+        response = admin_client.get(
+            reverse("admin:audit_audit_changelist"), {"secret__id__exact": "not-a-uuid"}
+        )
+
+        assert response.status_code == 302
+        assert response.url.endswith("?e=1")
+
+
+class TestAuditAutocomplete:
+    def test_users(self, admin_client):
+        UserFactory(email="alice@example.com")
+        UserFactory(email="bob@example.com")
+
+        response = admin_client.get(
+            reverse("admin:audit_audit_autocomplete"), {"field_name": "user", "term": "ali"}
+        )
+
+        assert [result["text"] for result in response.json()["results"]] == ["alice@example.com"]
+        assert response.json()["pagination"] == {"more": False}
+
+    def test_secrets(self, admin_client):
+        user = UserFactory()
+        secret = SecretFactory(name="aws-root", created_by=user)
+        SecretFactory(name="github", created_by=user)
+
+        response = admin_client.get(
+            reverse("admin:audit_audit_autocomplete"), {"field_name": "secret", "term": "aws"}
+        )
+
+        assert response.json()["results"] == [{"id": str(secret.pk), "text": "aws-root"}]
+
+    def test_unknown_field(self, admin_client):
+        response = admin_client.get(
+            reverse("admin:audit_audit_autocomplete"), {"field_name": "action"}
+        )
+
+        assert response.status_code == 404
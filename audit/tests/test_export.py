@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+
+import pytest
+
+from django.core.management import call_command
+from django.urls import reverse
+
+from audit.models import Actions, Audit
+from secret.tests.factories import SecretFactory
+from user.tests.factories import UserFactory, otp_verify_user
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def events():
+    user = UserFactory()
+    secret = SecretFactory(name="aws")
+
+    return [
+        Audit.objects.create(user=user, secret=secret, action=Actions.view_secret.name),
+        Audit.objects.create(user=user, action=Actions.create_secret.name, description="created"),
+        Audit.objects.create(user=user, secret=secret, action=Actions.update_secret.name),
+    ]
+
+
+def _export(*args):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command("export_audit", *args, stdout=stdout, stderr=stderr)
+    return stdout.getvalue(), stderr.getvalue()
+
+
+class TestExportAuditCommand:
+    def test_ndjson(self, events):
+        output, _ = _export("--format", "ndjson", "--chunk-size", "2")
+
+        rows = [json.loads(line) for line in output.splitlines()]
+
+        assert [row["event.id"] for row in rows] == [str(event.pk) for event in events]
+        assert rows[0]["event.action"] == "view_secret"
+        assert rows[0]["user.email"] == events[0].user.email
+        assert rows[0]["passman.secret.name"] == "aws"
+        assert rows[1]["passman.secret.id"] is None
+        assert rows[1]["message"] == "created"
+
+    def test_csv(self, events):
+        output, _ = _export("--format", "csv")
+
+        rows = list(csv.DictReader(io.StringIO(output)))
+
+        assert len(rows) == 3
+        assert rows[2]["event.action"] == "update_secret"
+        assert rows[2]["@timestamp"] == events[2].timestamp.isoformat()
+
+    def test_resume_from_high_water_mark(self, events):
+        _, stderr = _export("--after-id", str(events[0].pk))
+
+        assert f"--after-id {events[2].pk}" in stderr
+
+        output, _ = _export("--after-id", str(events[1].pk))
+
+        assert [json.loads(line)["event.id"] for line in output.splitlines()] == [str(events[2].pk)]
+
+
+class TestExportAuditAdmin:
+    def test_superuser_only(self, client, events):
+        user = UserFactory(is_staff=True, two_factor_enabled=True)
+        client.force_login(user)
+        otp_verify_user(user, client)
+
+        response = client.get(reverse("admin:audit_audit_export"))
+
+        assert response.status_code == 403
+
+    def test_stream(self, client, events):
+        user = UserFactory(is_staff=True, is_superuser=True, two_factor_enabled=True)
+        client.force_login(user)
+        otp_verify_user(user, client)
+
+        response = client.get(
+            reverse("admin:audit_audit_export"), {"format": "csv", "after_id": events[0].pk}
+        )
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "text/csv"
+
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        assert [row["event.id"] for row in rows] == [str(events[1].pk), str(events[2].pk)]
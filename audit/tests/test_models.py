@@ -1,12 +1,14 @@
 import datetime as dt
 import pytest
 
+from django.conf import settings
+from django.core.cache import caches
 from django.utils import timezone
 
 from secret.tests.factories import SecretFactory
 from user.tests.factories import UserFactory
 
-from audit.models import Actions, Audit, create_audit_event
+from audit.models import Actions, Audit, create_audit_event, create_audit_events
 
 pytestmark = pytest.mark.django_db
 
@@ -82,6 +84,19 @@ def test_create_audit_event():
     assert not audit.secret
 
 
+def test_create_audit_events():
+    user = UserFactory()
+    secret = SecretFactory()
+
+    create_audit_events(user, Actions.download_file, ["a.txt", "b.txt"], secret=secret)
+
+    assert sorted(
+        Audit.objects.filter(user=user, secret=secret, action="download_file").values_list(
+            "description", flat=True
+        )
+    ) == ["a.txt", "b.txt"]
+
+
 @pytest.mark.freeze_time("2020-07-25 12:00:01")
 def test_create_audit_event_separate_secrets():
 
@@ -107,3 +122,51 @@ def test_create_audit_event_separate_secrets():
 
     assert audit.timestamp == timezone.now()
     assert audit.description == "I viewed another secret"
+
+
+@pytest.fixture
+def audit_cache(settings):
+    settings.CACHES = {
+        **settings.CACHES,
+        "audit": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "audit"},
+    }
+    caches["audit"].clear()
+
+    return caches["audit"]
+
+
+@pytest.mark.freeze_time("2020-07-25 12:00:01")
+def test_report_once_repeat_does_not_query(audit_cache, django_assert_num_queries, freezer):
+    user = UserFactory()
+    secret = SecretFactory()
+
+    create_audit_event(user, Actions.view_secret, secret=secret, report_once=True)
+
+    with django_assert_num_queries(0):
+        create_audit_event(user, Actions.view_secret, secret=secret, report_once=True)
+
+    freezer.move_to(
+        dt.datetime.now() + dt.timedelta(minutes=settings.AUDIT_EVENT_REPEAT_AFTER_MINUTES + 5)
+    )
+
+    create_audit_event(user, Actions.view_secret, secret=secret, report_once=True)
+
+    assert Audit.objects.count() == 2
+
+
+@pytest.mark.freeze_time("2020-07-25 12:00:01")
+def test_report_once_cold_cache(audit_cache, django_assert_num_queries):
+    user = UserFactory()
+    secret = SecretFactory()
+
+    create_audit_event(user, Actions.view_secret, secret=secret, report_once=True)
+    audit_cache.clear()
+
+    # falls back to the table, then remembers the event again
+    with django_assert_num_queries(1):
+        create_audit_event(user, Actions.view_secret, secret=secret, report_once=True)
+
+    with django_assert_num_queries(0):
+        create_audit_event(user, Actions.view_secret, secret=secret, report_once=True)
+
+    assert Audit.objects.count() == 1
@@ -0,0 +1,121 @@
+import datetime as dt
+
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils import timezone
+
+from audit.admin import AuditAdmin, MonthListFilter
+from audit.models import Actions, Audit, create_audit_event
+from audit.partitions import (
+    add_months,
+    create_partitions,
+    is_partitioned,
+    list_partitions,
+    partition_month,
+    partition_name,
+)
+from core.admin import admin_site
+from user.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+postgres_only = pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="audit partitioning is Postgres only"
+)
+
+
+@pytest.mark.parametrize(
+    "month, months, expected",
+    [
+        (dt.date(2024, 1, 1), 1, dt.date(2024, 2, 1)),
+        (dt.date(2024, 11, 1), 3, dt.date(2025, 2, 1)),
+        (dt.date(2024, 1, 1), -1, dt.date(2023, 12, 1)),
+        (dt.date(2024, 3, 1), -26, dt.date(2022, 1, 1)),
+    ],
+)
+def test_add_months(month, months, expected):
+    assert add_months(month, months) == expected
+
+
+def test_partition_names():
+    assert partition_name(dt.date(2024, 3, 1)) == "audit_audit_p2024_03"
+    assert partition_month("audit_audit_p2024_03") == dt.date(2024, 3, 1)
+    assert partition_month("audit_audit_p2024_03.csv.gz") == dt.date(2024, 3, 1)
+    assert partition_month("audit_audit_default") is None
+
+
+@pytest.mark.skipif(connection.vendor == "postgresql", reason="tests the non-Postgres fallback")
+def test_command_is_a_no_op_without_partitioning(capsys):
+    assert not is_partitioned()
+
+    call_command("audit_partitions", "--archive", "--retention-months", "1")
+
+    assert "not partitioned" in capsys.readouterr().out
+
+
+@pytest.mark.freeze_time("2020-07-25 12:00:01")
+def test_admin_month_filter(rf):
+    user = UserFactory()
+    create_audit_event(user, Actions.view_secret)
+    Audit.objects.create(
+        user=user, action="view_secret", timestamp=timezone.now() - dt.timedelta(days=31)
+    )
+
+    request = rf.get("/", {"month": "2020-07"})
+    request.user = user
+
+    month_filter = MonthListFilter(
+        request, {"month": "2020-07"}, Audit, AuditAdmin(Audit, admin_site)
+    )
+
+    assert month_filter.lookups(request, None)[0] == ("2020-07", "July 2020")
+    assert month_filter.queryset(request, Audit.objects.all()).count() == 1
+
+
+@postgres_only
+@pytest.mark.freeze_time("2020-07-25 12:00:01")
+def test_partitions_archive_and_restore(tmp_path):
+    assert is_partitioned()
+
+    user = UserFactory()
+    old = timezone.make_aware(dt.datetime(2019, 3, 10))
+    Audit.objects.create(user=user, action="view_secret", timestamp=old)
+
+    create_partitions(dt.date(2019, 3, 1), dt.date(2019, 3, 1))
+    assert dt.date(2019, 3, 1) in list_partitions()
+
+    call_command(
+        "audit_partitions", "--archive", "--retention-months", "12", "--archive-dir", str(tmp_path)
+    )
+
+    archive = tmp_path / "audit_audit_p2019_03.csv.gz"
+    assert archive.exists()
+    assert not Audit.objects.filter(timestamp=old).exists()
+    assert add_months(dt.date(2020, 7, 1), 3) in list_partitions()
+
+    call_command("audit_partitions", "--restore", str(archive))
+
+    assert Audit.objects.filter(timestamp=old).exists()
+
+
+@postgres_only
+@pytest.mark.freeze_time("2020-07-25 12:00:01")
+def test_restore_refuses_rows_for_deleted_users(tmp_path):
+    user = UserFactory()
+    old = timezone.make_aware(dt.datetime(2019, 3, 10))
+    Audit.objects.create(user=user, action="view_secret", timestamp=old)
+    create_partitions(dt.date(2019, 3, 1), dt.date(2019, 3, 1))
+
+    call_command(
+        "audit_partitions", "--archive", "--retention-months", "12", "--archive-dir", str(tmp_path)
+    )
+    # no longer protected by the foreign key, as its events are archived
+    user.delete()
+
+    with pytest.raises(CommandError, match="1 of its rows refer to users or secrets deleted"):
+        call_command("audit_partitions", "--restore", str(tmp_path / "audit_audit_p2019_03.csv.gz"))
+
+    assert dt.date(2019, 3, 1) not in list_partitions()
@@ -0,0 +1,234 @@
+import datetime as dt
+import io
+
+import pytest
+
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from audit.models import Actions, Audit, AuditRollup, create_audit_event
+from audit.rollups import record_rollups, rebuild_rollups, secret_activity, untouched_secrets
+from audit.writer import AuditWriter, serialise_event
+from secret.tests.factories import SecretFactory
+from user.tests.factories import UserFactory, otp_verify_user
+
+pytestmark = pytest.mark.django_db
+
+
+def _rollups():
+    return sorted(
+        AuditRollup.objects.values_list("secret__name", "user__email", "action", "day", "count")
+    )
+
+
+@pytest.fixture
+def secret():
+    return SecretFactory(name="aws")
+
+
+@pytest.fixture
+def user():
+    return UserFactory(email="alice@example.com")
+
+
+class TestRecordRollups:
+    @pytest.mark.freeze_time("2020-07-25 12:00:00")
+    def test_create_audit_event(self, user, secret):
+        create_audit_event(user, Actions.view_secret, secret=secret)
+        create_audit_event(user, Actions.view_secret, secret=secret)
+        create_audit_event(user, Actions.update_secret, secret=secret)
+        create_audit_event(user, Actions.imported)
+
+        assert _rollups() == [
+            ("aws", "alice@example.com", "update_secret", dt.date(2020, 7, 25), 1),
+            ("aws", "alice@example.com", "view_secret", dt.date(2020, 7, 25), 2),
+        ]
+
+    def test_disabled(self, settings, user, secret):
+        settings.AUDIT_ROLLUP_ON_WRITE = False
+
+        create_audit_event(user, Actions.view_secret, secret=secret)
+
+        assert not AuditRollup.objects.exists()
+
+    def test_writer_batches(self, tmp_path, user, secret):
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path))
+        yesterday = timezone.now() - dt.timedelta(days=1)
+
+        for timestamp in (yesterday, yesterday, timezone.now()):
+            writer.submit(serialise_event(timestamp, user.pk, "view_secret", secret_id=secret.pk))
+        writer.flush()
+
+        assert [(day, count) for *_, day, count in _rollups()] == [
+            (timezone.localdate(yesterday), 2),
+            (timezone.localdate(), 1),
+        ]
+
+    def test_one_query_per_batch(self, django_assert_num_queries, user, secret):
+        other = SecretFactory(name="gcp")
+        events = [
+            Audit(
+                timestamp=timezone.make_aware(dt.datetime(2020, 7, day, 9)),
+                user=user,
+                secret=event_secret,
+                action=Actions.view_secret.name,
+            )
+            for day in (1, 1, 2, 3)
+            for event_secret in (secret, other)
+        ]
+
+        with django_assert_num_queries(1):
+            record_rollups(events)
+
+        # and adds to the counts already there
+        with django_assert_num_queries(1):
+            record_rollups(events[:2])
+
+        assert [(name, day.day, count) for name, _, _, day, count in _rollups()] == [
+            ("aws", 1, 3),
+            ("aws", 2, 1),
+            ("aws", 3, 1),
+            ("gcp", 1, 3),
+            ("gcp", 2, 1),
+            ("gcp", 3, 1),
+        ]
+
+
+class TestRebuildRollups:
+    def test_matches_audit_table(self, settings, user, secret):
+        other = UserFactory(email="bob@example.com")
+        settings.AUDIT_ROLLUP_ON_WRITE = False
+
+        for day, event_user in ((1, user), (1, user), (1, other), (2, user), (5, user)):
+            Audit.objects.create(
+                timestamp=timezone.make_aware(dt.datetime(2020, 7, day, 9)),
+                user=event_user,
+                secret=secret,
+                action=Actions.view_secret.name,
+            )
+
+        assert rebuild_rollups(dt.date(2020, 7, 1), dt.date(2020, 7, 2)) == 3
+        assert _rollups() == [
+            ("aws", "alice@example.com", "view_secret", dt.date(2020, 7, 1), 2),
+            ("aws", "alice@example.com", "view_secret", dt.date(2020, 7, 2), 1),
+            ("aws", "bob@example.com", "view_secret", dt.date(2020, 7, 1), 1),
+        ]
+
+        # rebuilding replaces, rather than adds to, the days' counts
+        assert rebuild_rollups(dt.date(2020, 7, 1), dt.date(2020, 7, 5)) == 4
+        assert sum(count for *_, count in _rollups()) == 5
+
+    @pytest.mark.freeze_time("2020-07-02 12:00:00")
+    def test_over_rollups_written_on_write(self, user, secret):
+        other = SecretFactory(name="gcp")
+        create_audit_event(user, Actions.view_secret, secret=secret)
+        create_audit_event(user, Actions.view_secret, secret=secret)
+        # counts that no longer match the audit table, and a key with no events left
+        AuditRollup.objects.update(count=5)
+        AuditRollup.objects.create(
+            secret=other, user=user, action="view_secret", day=dt.date(2020, 7, 1), count=1
+        )
+
+        assert rebuild_rollups(dt.date(2020, 7, 1), dt.date(2020, 7, 2)) == 1
+        assert _rollups() == [
+            ("aws", "alice@example.com", "view_secret", dt.date(2020, 7, 2), 2),
+        ]
+
+        # on-write rollups keep adding to the rebuilt counts
+        create_audit_event(user, Actions.view_secret, secret=secret)
+
+        assert [count for *_, count in _rollups()] == [3]
+
+    @pytest.mark.freeze_time("2020-07-10 12:00:00")
+    def test_command_catches_up(self, settings, user, secret):
+        for day in (1, 8, 9, 10):
+            Audit.objects.create(
+                timestamp=timezone.make_aware(dt.datetime(2020, 7, day, 9)),
+                user=user,
+                secret=secret,
+                action=Actions.view_secret.name,
+            )
+
+        stdout = io.StringIO()
+        call_command("rollup_audit", "--days-per-batch", "3", stdout=stdout)
+
+        assert "Rebuilt 4 rollups from 2020-07-01 to 2020-07-10" in stdout.getvalue()
+
+        stdout = io.StringIO()
+        call_command("rollup_audit", stdout=stdout)
+
+        assert "Rebuilt 1 rollups from 2020-07-10 to 2020-07-10" in stdout.getvalue()
+        assert AuditRollup.objects.count() == 4
+
+
+class TestQueries:
+    def test_secret_activity(self, user, secret):
+        other = UserFactory(email="bob@example.com")
+        today = timezone.localdate()
+
+        for rollup_user, days_ago, count in (
+            (user, 1, 3),
+            (user, 10, 1),
+            (other, 2, 2),
+            (other, 100, 9),
+        ):
+            AuditRollup.objects.create(
+                secret=secret,
+                user=rollup_user,
+                action="view_secret",
+                day=today - dt.timedelta(days=days_ago),
+                count=count,
+            )
+
+        assert [(row["user__email"], row["total"]) for row in secret_activity(secret)] == [
+            ("alice@example.com", 4),
+            ("bob@example.com", 2),
+        ]
+
+    def test_untouched_secrets(self, user, secret):
+        stale = SecretFactory(name="stale")
+        SecretFactory(name="deleted", deleted=True)
+        today = timezone.localdate()
+
+        AuditRollup.objects.create(
+            secret=secret, user=user, action="view_secret", day=today, count=1
+        )
+        AuditRollup.objects.create(
+            secret=stale,
+            user=user,
+            action="view_secret",
+            day=today - dt.timedelta(days=400),
+            count=1,
+        )
+
+        assert list(untouched_secrets(365)) == [stale]
+
+
+def test_untouched_admin_report(client, secret):
+    admin = UserFactory(is_staff=True, is_superuser=True, two_factor_enabled=True)
+    client.force_login(admin)
+    otp_verify_user(admin, client)
+
+    response = client.get(reverse("admin:audit_auditrollup_untouched"), {"days": "30"})
+
+    assert response.status_code == 200
+    assert list(response.context["page_obj"]) == [secret]
+    assert "Secrets untouched for 30 days" in response.content.decode()
+
+
+def test_rollup_changelist(client, user, secret):
+    admin = UserFactory(is_staff=True, is_superuser=True, two_factor_enabled=True)
+    client.force_login(admin)
+    otp_verify_user(admin, client)
+    AuditRollup.objects.create(
+        secret=secret, user=user, action="view_secret", day=timezone.localdate(), count=7
+    )
+
+    response = client.get(
+        reverse("admin:audit_auditrollup_changelist"), {"secret__id__exact": str(secret.pk)}
+    )
+
+    assert response.status_code == 200
+    assert [rollup.count for rollup in response.context["cl"].result_list] == [7]
+    assert reverse("admin:audit_auditrollup_untouched") in response.content.decode()
@@ -0,0 +1,258 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from audit import writer as audit_writer
+from audit.models import Actions, Audit, create_audit_event, create_audit_events
+from audit.writer import AuditWriter, serialise_event
+from secret.tests.factories import SecretFactory
+from user.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _event(user, secret=None, action=Actions.view_secret):
+    return serialise_event(
+        timezone.now(), user.pk, action.name, secret_id=secret.pk if secret else None
+    )
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+class TestAuditWriter:
+    def test_flush_in_batches(self, tmp_path):
+        user = UserFactory()
+        secret = SecretFactory()
+        writer = AuditWriter(batch_size=2, flush_interval_ms=10, spool_dir=str(tmp_path))
+
+        for _ in range(5):
+            writer.submit(_event(user, secret))
+
+        assert writer.queue_depth == 5
+
+        writer.flush()
+
+        assert writer.queue_depth == 0
+        assert writer.metrics.events_written == 5
+        assert writer.metrics.batches_written == 3
+        assert Audit.objects.filter(user=user, secret=secret, action="view_secret").count() == 5
+
+    def test_submit_many(self, tmp_path):
+        user = UserFactory()
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path))
+        writer._spool = open(tmp_path / "audit-spool-test.jsonl", "a", encoding="utf-8")
+
+        writer.submit_many([_event(user), _event(user, action=Actions.download_file)])
+
+        assert writer.queue_depth == 2
+        assert len((tmp_path / "audit-spool-test.jsonl").read_text().splitlines()) == 2
+
+        writer.flush()
+        writer._spool.close()
+
+        assert writer.metrics.batches_written == 1
+        assert Audit.objects.filter(user=user).count() == 2
+        assert (tmp_path / "audit-spool-test.jsonl").read_text() == ""
+
+    def test_replay_dead_process_spool(self, tmp_path):
+        user = UserFactory()
+        pid = _dead_pid()
+
+        with open(tmp_path / f"audit-spool-{pid}.jsonl", "w") as spool:
+            spool.write(json.dumps(_event(user)) + "\n")
+            spool.write(json.dumps(_event(user, action=Actions.create_secret)) + "\n")
+            spool.write('{"timestamp": "2020-')
+
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path))
+
+        assert writer.replay_spools() == 2
+        assert sorted(Audit.objects.values_list("action", flat=True)) == [
+            "create_secret",
+            "view_secret",
+        ]
+        assert os.listdir(tmp_path) == []
+
+    def test_segments_deleted_once_written(self, tmp_path):
+        user = UserFactory()
+        writer = AuditWriter(
+            batch_size=1, flush_interval_ms=10, spool_dir=str(tmp_path), segment_bytes=1
+        )
+        writer.open_spool()
+
+        for _ in range(3):
+            writer.submit(_event(user))
+
+        # each event filled a segment, and the spool was started again
+        assert len(os.listdir(tmp_path)) == 4
+
+        writer._write(writer._take())
+
+        assert len(os.listdir(tmp_path)) == 3
+
+        writer.flush()
+        writer._spool.close()
+
+        assert os.listdir(tmp_path) == [f"audit-spool-{os.getpid()}.jsonl"]
+        assert Audit.objects.count() == 3
+
+    def test_replay_segments_and_dead_claims(self, tmp_path):
+        user = UserFactory()
+        pid = _dead_pid()
+        (tmp_path / f"audit-spool-{pid}.1.jsonl").write_text(json.dumps(_event(user)) + "\n")
+        (tmp_path / f"audit-spool-{pid}.claim-abc.jsonl").write_text(
+            json.dumps(_event(user)) + "\n"
+        )
+
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path))
+
+        assert writer.replay_spools() == 2
+        assert os.listdir(tmp_path) == []
+
+    def test_spool_claimed_elsewhere_skipped(self, tmp_path, monkeypatch):
+        user = UserFactory()
+        pid = _dead_pid()
+        path = tmp_path / f"audit-spool-{pid}.jsonl"
+        path.write_text(json.dumps(_event(user)) + "\n")
+        # listed, then renamed by another replayer before this one could claim it
+        gone = str(tmp_path / f"audit-spool-{pid}.claim-other.jsonl")
+        monkeypatch.setattr("audit.writer.glob.glob", lambda pattern: [gone, str(path)])
+
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path))
+
+        assert writer.replay_spools() == 1
+        assert Audit.objects.count() == 1
+
+    def test_start_does_not_replay(self, tmp_path):
+        user = UserFactory()
+        path = tmp_path / f"audit-spool-{_dead_pid()}.jsonl"
+        path.write_text(json.dumps(_event(user)) + "\n")
+
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path))
+        writer.start()
+        writer.stop()
+
+        assert path.exists()
+        assert Audit.objects.count() == 0
+
+    def test_own_spool_left_alone(self, tmp_path):
+        user = UserFactory()
+        writer = AuditWriter(
+            batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path), segment_bytes=1
+        )
+        writer.open_spool()
+        writer.submit(_event(user))
+        files = sorted(os.listdir(tmp_path))
+
+        assert writer.replay_spools() == 0
+        assert sorted(os.listdir(tmp_path)) == files
+
+        writer.flush()
+        writer._spool.close()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_thread_replays_dead_process_spools(self, tmp_path):
+        user = UserFactory()
+        path = tmp_path / f"audit-spool-{_dead_pid()}.jsonl"
+        path.write_text(json.dumps(_event(user)) + "\n")
+
+        writer = AuditWriter(
+            batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path), replay_interval=0.01
+        )
+        writer.start()
+        deadline = time.monotonic() + 5
+        while path.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.stop()
+
+        assert Audit.objects.count() == 1
+        assert os.listdir(tmp_path) == [f"audit-spool-{os.getpid()}.jsonl"]
+
+    def test_live_process_spool_left_alone(self, tmp_path):
+        user = UserFactory()
+        path = tmp_path / f"audit-spool-{os.getppid()}.jsonl"
+        path.write_text(json.dumps(_event(user)) + "\n")
+
+        writer = AuditWriter(batch_size=10, flush_interval_ms=10, spool_dir=str(tmp_path))
+
+        assert writer.replay_spools() == 0
+        assert path.exists()
+
+
+def test_replay_command(settings, tmp_path):
+    settings.AUDIT_WRITER_SPOOL_DIR = str(tmp_path)
+    user = UserFactory()
+    (tmp_path / f"audit-spool-{_dead_pid()}.jsonl").write_text(json.dumps(_event(user)) + "\n")
+
+    call_command("replay_audit_spools")
+
+    assert Audit.objects.count() == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_writer_kept_only_once_started(settings, tmp_path, monkeypatch):
+    settings.AUDIT_WRITER_SPOOL_DIR = str(tmp_path)
+    monkeypatch.setattr("audit.writer._writer", None)
+
+    def start(writer):
+        raise FileNotFoundError
+
+    monkeypatch.setattr(AuditWriter, "start", start)
+
+    with pytest.raises(FileNotFoundError):
+        audit_writer.get_writer()
+
+    assert audit_writer._writer is None
+
+    monkeypatch.setattr(AuditWriter, "start", AuditWriter.open_spool)
+
+    writer = audit_writer.get_writer()
+
+    assert audit_writer._writer is writer
+    writer._spool.close()
+
+
+def test_async_mode_submits_to_writer(settings, monkeypatch):
+    settings.AUDIT_WRITER_MODE = "async"
+    user = UserFactory()
+    submitted = []
+
+    class Writer:
+        def submit(self, event):
+            submitted.append(event)
+
+    monkeypatch.setattr("audit.writer.get_writer", Writer)
+
+    create_audit_event(user, Actions.view_secret, description="viewed")
+
+    assert Audit.objects.count() == 0
+    assert [(e["user_id"], e["action"], e["description"]) for e in submitted] == [
+        (user.pk, "view_secret", "viewed")
+    ]
+
+
+def test_async_mode_submits_events_together(settings, monkeypatch):
+    settings.AUDIT_WRITER_MODE = "async"
+    user = UserFactory()
+    submitted = []
+
+    class Writer:
+        def submit_many(self, events):
+            submitted.append(events)
+
+    monkeypatch.setattr("audit.writer.get_writer", Writer)
+
+    create_audit_events(user, Actions.download_file, ["a.txt", "b.txt"])
+
+    assert Audit.objects.count() == 0
+    assert [[e["description"] for e in events] for events in submitted] == [["a.txt", "b.txt"]]
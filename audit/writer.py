@@ -0,0 +1,355 @@
+"""
+Buffered audit event writer.
+
+In "async" mode (`settings.AUDIT_WRITER_MODE`) `create_audit_event` hands events to an in-process
+queue instead of inserting them in the request. A background thread inserts them with
+`bulk_create` once `AUDIT_WRITER_BATCH_SIZE` events are waiting or `AUDIT_WRITER_FLUSH_INTERVAL_MS`
+has passed.
+
+Each event is also appended to a per-process spool file in `AUDIT_WRITER_SPOOL_DIR` before it is
+queued. Once the spool reaches `SPOOL_SEGMENT_BYTES` it is closed off as a segment and a new one
+started, and each segment is deleted once every event in it has been written, so the spool only
+holds what is still to be written even under steady load.
+
+Spools left behind by processes that died are written by the `replay_audit_spools` command, which
+runs before the web processes start, and by each running writer's thread every
+`AUDIT_WRITER_REPLAY_INTERVAL_SECONDS`, so that spools of workers killed or crashed in between are
+not left until the next deploy. A replayer claims each spool by renaming it to its own pid before
+reading it, so that two replayers cannot write the same events, and a claim left by a replayer
+that died is picked up by the next. Events are written at least once.
+"""
+
+import atexit
+import datetime as dt
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Audit
+from .rollups import record_rollups
+
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PREFIX = "audit-spool-"
+SPOOL_SEGMENT_BYTES = 1024 * 1024
+
+
+def _spool_path(spool_dir, pid, suffix=None):
+    """`audit-spool-<pid>.jsonl`, or `audit-spool-<pid>.<suffix>.jsonl` for a segment or a claim"""
+    name = f"{SPOOL_PREFIX}{pid}.{suffix}.jsonl" if suffix else f"{SPOOL_PREFIX}{pid}.jsonl"
+    return os.path.join(spool_dir, name)
+
+
+def _spool_owner(path):
+    """The pid of the process a spool file belongs to"""
+    return int(os.path.basename(path).removeprefix(SPOOL_PREFIX).split(".")[0])
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def serialise_event(timestamp, user_id, action, description="", secret_id=None):
+    return {
+        "timestamp": timestamp.isoformat(),
+        "user_id": user_id,
+        "secret_id": str(secret_id) if secret_id else None,
+        "action": action,
+        "description": description,
+    }
+
+
+def _to_audit(event):
+    return Audit(
+        timestamp=dt.datetime.fromisoformat(event["timestamp"]),
+        user_id=event["user_id"],
+        secret_id=event["secret_id"],
+        action=event["action"],
+        description=event["description"],
+    )
+
+
+@transaction.atomic
+def _insert(audits, batch_size=None):
+    Audit.objects.bulk_create(audits, batch_size=batch_size)
+    record_rollups(audits)
+
+
+class AuditWriterMetrics:
+    def __init__(self):
+        self.events_written = 0
+        self.batches_written = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = None
+        self.max_flush_seconds = 0.0
+
+    def record_flush(self, events, seconds):
+        self.events_written += events
+        self.batches_written += 1
+        self.last_flush_seconds = seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, seconds)
+
+
+class AuditWriter:
+    def __init__(
+        self,
+        batch_size,
+        flush_interval_ms,
+        spool_dir,
+        segment_bytes=SPOOL_SEGMENT_BYTES,
+        replay_interval=None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.spool_dir = spool_dir
+        self.segment_bytes = segment_bytes
+        # seconds between replays of dead processes' spools by the background thread, or None
+        self.replay_interval = replay_interval
+
+        self.queue = queue.Queue()
+        self.metrics = AuditWriterMetrics()
+
+        self._lock = threading.Lock()
+        # events are written in the order they were submitted, so these two counts say which
+        # spooled events are in the database
+        self._submitted = 0
+        self._written = 0
+        self._spool = None
+        # (path, number of events submitted by the end of it) for each closed off spool segment
+        self._segments = []
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def start(self):
+        self.open_spool()
+
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+        atexit.register(self.stop)
+
+    def open_spool(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._spool = open(_spool_path(self.spool_dir, os.getpid()), "a", encoding="utf-8")
+
+    def _close_segment(self):
+        """Set the spool written so far aside until its events are written, and start a new one"""
+        self._spool.close()
+
+        path = _spool_path(self.spool_dir, os.getpid(), suffix=self._submitted)
+        os.rename(self._spool.name, path)
+        self._segments.append((path, self._submitted))
+
+        self._spool = open(self._spool.name, "a", encoding="utf-8")
+
+    def stop(self):
+        """Stop the background thread, writing out anything still queued"""
+        if self._thread:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+
+    def submit(self, event):
+        self.submit_many([event])
+
+    def submit_many(self, events):
+        """Queue `events` together, with a single write to the spool"""
+        with self._lock:
+            self._submitted += len(events)
+
+            if self._spool:
+                self._spool.write("".join(json.dumps(event) + "\n" for event in events))
+                self._spool.flush()
+
+                if self._spool.tell() >= self.segment_bytes:
+                    self._close_segment()
+
+            for event in events:
+                self.queue.put(event)
+
+    def _take(self, timeout=None):
+        """Take up to `batch_size` queued events, waiting at most `timeout` seconds for the first"""
+        events = []
+
+        try:
+            events.append(self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait())
+
+            while len(events) < self.batch_size:
+                events.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        return events
+
+    def _write(self, events):
+        started = time.monotonic()
+
+        close_old_connections()
+        _insert([_to_audit(event) for event in events])
+
+        elapsed = time.monotonic() - started
+        self.metrics.record_flush(len(events), elapsed)
+
+        with self._lock:
+            self._written += len(events)
+
+            while self._segments and self._segments[0][1] <= self._written:
+                os.remove(self._segments.pop(0)[0])
+
+            # everything spooled so far is in the database
+            if self._written == self._submitted and self._spool:
+                self._spool.seek(0)
+                self._spool.truncate()
+
+        logger.info(
+            "Wrote %d audit events in %.3fs, queue depth %d",
+            len(events),
+            elapsed,
+            self.queue_depth,
+        )
+
+    def flush(self):
+        """Write every queued event in the calling thread"""
+        while events := self._take():
+            self._write(events)
+
+    def _replay_dead_spools(self):
+        """Replay other processes' spools from the background thread, without stopping it"""
+        try:
+            close_old_connections()
+            self.replay_spools()
+        except Exception:
+            logger.exception("Failed to replay spooled audit events, will retry")
+
+    def _run(self):
+        events = []
+        next_replay = self.replay_interval and time.monotonic() + self.replay_interval
+
+        while not self._stopping.is_set():
+            if next_replay and time.monotonic() >= next_replay:
+                self._replay_dead_spools()
+                next_replay = time.monotonic() + self.replay_interval
+
+            if not events:
+                events = self._take(timeout=self.flush_interval)
+
+            # wait out the rest of the interval for a batch to fill up
+            deadline = time.monotonic() + self.flush_interval
+            while events and len(events) < self.batch_size and time.monotonic() < deadline:
+                events += self._take(timeout=max(deadline - time.monotonic(), 0.001))
+
+            if not events:
+                continue
+
+            try:
+                self._write(events)
+            except Exception:
+                self.metrics.failed_flushes += 1
+                logger.exception("Failed to write %d audit events, will retry", len(events))
+                self._stopping.wait(self.flush_interval)
+            else:
+                events = []
+
+        # hand anything taken but not written back for `stop()` to flush
+        for event in events:
+            self.queue.put(event)
+
+    def claim_spools(self):
+        """
+        Rename the spools of processes that are no longer running to this process's pid, returning
+        their new paths. A spool another replayer claimed first is left to it.
+        """
+        claimed = []
+
+        for path in glob.glob(os.path.join(self.spool_dir, f"{SPOOL_PREFIX}*.jsonl")):
+            pid = _spool_owner(path)
+
+            # a spool under our own pid was left by an earlier process, e.g. in a restarted container
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+
+            claim = _spool_path(self.spool_dir, os.getpid(), suffix=f"claim-{uuid.uuid4().hex}")
+
+            # held so that this writer's own spool and segments cannot change names meanwhile
+            with self._lock:
+                if self._spool and path in {self._spool.name, *(p for p, _ in self._segments)}:
+                    continue
+
+                try:
+                    os.rename(path, claim)
+                except FileNotFoundError:
+                    continue
+
+            claimed.append(claim)
+
+        return claimed
+
+    def replay_spools(self):
+        """Write the events spooled by processes that are no longer running"""
+        replayed = 0
+
+        for path in self.claim_spools():
+            events = []
+            with open(path, encoding="utf-8") as spool:
+                for line in spool:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # the process died part way through writing this line
+                        logger.warning("Skipping a truncated audit event in %s", path)
+
+            _insert([_to_audit(event) for event in events], batch_size=self.batch_size)
+            os.remove(path)
+
+            replayed += len(events)
+
+        if replayed:
+            logger.info("Replayed %d spooled audit events", replayed)
+
+        return replayed
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return this process's writer, starting it on first use"""
+    global _writer
+
+    with _writer_lock:
+        if _writer is None:
+            writer = AuditWriter(
+                batch_size=settings.AUDIT_WRITER_BATCH_SIZE,
+                flush_interval_ms=settings.AUDIT_WRITER_FLUSH_INTERVAL_MS,
+                spool_dir=settings.AUDIT_WRITER_SPOOL_DIR,
+                replay_interval=settings.AUDIT_WRITER_REPLAY_INTERVAL_SECONDS,
+            )
+            # kept only once started, so a failed start is tried again by the next event rather
+            # than leaving events queued on a writer that will never write them
+            writer.start()
+            _writer = writer
+
+    return _writer
@@ -68,6 +68,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "core.middleware.ProtectAllViewsMiddleware",
     "axes.middleware.AxesMiddleware",
+    "secret.middleware.DecryptionCountMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -184,6 +185,12 @@ MESSAGE_TAGS = {
 
 CRYPTOGRAPHY_KEY = env("CRYPTOGRAPHY_KEY", default=SECRET_KEY)
 CRYPTOGRAPHY_SALT = env("CRYPTOGRAPHY_SALT")
+# keys replaced by CRYPTOGRAPHY_KEY, still accepted until `reencrypt` has run; a JSON list of
+# {"key": ..., "salt": ..., "secret_key": ...}, secret_key defaulting to SECRET_KEY. See secret.keys
+CRYPTOGRAPHY_OLD_KEYS = env.json("CRYPTOGRAPHY_OLD_KEYS", default=[])
+# the format encrypted fields are written in, "aes-gcm" or django_cryptography's "fernet"; both are
+# read. See secret.keys
+SECRET_FIELD_CODEC = env("SECRET_FIELD_CODEC", default="aes-gcm")
 
 # guardian config
 
@@ -201,10 +208,38 @@ OTP_TOTP_ISSUER = OTP_HOTP_ISSUER
 # audit event config
 
 AUDIT_EVENT_REPEAT_AFTER_MINUTES = env.int("AUDIT_EVENT_REPEAT_AFTER_MINUTES", default=12 * 60)
+# "async" queues audit events for a background thread to bulk insert; "sync" inserts them in the
+# request, as the tests do
+AUDIT_WRITER_MODE = env("AUDIT_WRITER_MODE", default="async")
+AUDIT_WRITER_BATCH_SIZE = env.int("AUDIT_WRITER_BATCH_SIZE", default=100)
+AUDIT_WRITER_FLUSH_INTERVAL_MS = env.int("AUDIT_WRITER_FLUSH_INTERVAL_MS", default=500)
+# queued events are spooled here until written, and replayed after a crash by the
+# `replay_audit_spools` command and by the other processes' writers; must be persistent
+AUDIT_WRITER_SPOOL_DIR = env(
+    "AUDIT_WRITER_SPOOL_DIR", default=os.path.join(BASE_DIR, "audit-spool")
+)
+AUDIT_WRITER_REPLAY_INTERVAL_SECONDS = env.int("AUDIT_WRITER_REPLAY_INTERVAL_SECONDS", default=60)
+# monthly audit partitions (Postgres only), maintained by the `audit_partitions` command
+AUDIT_PARTITIONS_MONTHS_AHEAD = env.int("AUDIT_PARTITIONS_MONTHS_AHEAD", default=3)
+# partitions older than this many months are archived by `audit_partitions --archive`
+AUDIT_RETENTION_MONTHS = env.int("AUDIT_RETENTION_MONTHS", default=None)
+AUDIT_ARCHIVE_DIR = env("AUDIT_ARCHIVE_DIR", default=os.path.join(BASE_DIR, "audit-archive"))
+# the audit admin counts rows exactly up to this many, and uses Postgres' estimate beyond it
+AUDIT_ADMIN_EXACT_COUNT_LIMIT = env.int("AUDIT_ADMIN_EXACT_COUNT_LIMIT", default=10000)
+# keep the per-secret, per-day rollups current as events are written; when off, run
+# `rollup_audit` periodically instead
+AUDIT_ROLLUP_ON_WRITE = env.bool("AUDIT_ROLLUP_ON_WRITE", default=True)
 
 # app settings
 
 SECRET_PAGINATION_ITEMS_PER_PAGE = 20
+# "keyset" pages the secret list with opaque cursors; "offset" uses numbered pages
+SECRET_PAGINATION_MODE = env("SECRET_PAGINATION_MODE", default="keyset")
+# the total is a COUNT(*) over every visible secret, so it is opt-in for keyset pagination
+SECRET_PAGINATION_SHOW_COUNT = env.bool("SECRET_PAGINATION_SHOW_COUNT", default=False)
+SECRET_AUDIT_ITEMS_PER_PAGE = 50
+# attachments are encrypted and stored in chunks of this many bytes; see `secret.files`
+SECRET_FILE_CHUNK_SIZE = env.int("SECRET_FILE_CHUNK_SIZE", default=256 * 1024)
 SESSION_COOKIE_AGE = env.int("SESSION_COOKIE_AGE", default=86400)
 
 LOGGING = {
@@ -263,6 +298,9 @@ CACHES = {
         # See - https://github.com/jazzband/django-axes/blob/master/docs/configuration.rst#cache-problems
         "BACKEND": "django.core.cache.backends.dummy.DummyCache",
     },
+    # remembers recently reported `report_once` audit events; point it at a cache shared by every
+    # worker (e.g. redis) so that the dedupe holds across processes
+    "audit": env.cache("AUDIT_CACHE_URL", default="locmemcache://"),
 }
 
 AXES_CACHE = "axes_cache"
@@ -1,5 +1,6 @@
 from django.contrib.admin.sites import AdminSite
 from django.contrib.auth.admin import Group, GroupAdmin
+from django.urls import path
 
 from django_otp.plugins.otp_totp.admin import TOTPDeviceAdmin, TOTPDevice
 
@@ -7,6 +8,14 @@ from django_otp.plugins.otp_totp.admin import TOTPDeviceAdmin, TOTPDevice
 class OTPAdminSite(AdminSite):
     def __init__(self, name="otpadmin"):
         super().__init__(name)
+        self.extra_urls = []
+
+    def register_view(self, route, view, name):
+        """Add a view that is not about one model, behind the same checks as the rest of the site"""
+        self.extra_urls.append(path(route, self.admin_view(view), name=name))
+
+    def get_urls(self):
+        return self.extra_urls + super().get_urls()
 
     def has_permission(self, request):
         """
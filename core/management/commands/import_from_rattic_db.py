@@ -1,31 +1,45 @@
+import datetime as dt
+import functools
+import operator
+import time
+
+from django.contrib.auth.models import Group, Permission
 from django.core.management.base import BaseCommand
 from django.db import transaction
-
-from django.contrib.auth.models import Group
+from django.db.models import Q
+from django.utils import timezone
 
 import psycopg2
 import psycopg2.extras
 
 from audit.models import Audit
-from secret.models import Secret
+from audit.rollups import record_rollups
+from core.models import RatticCred, RatticSync
+from secret.access import refresh_access
+from secret.bulk import EncryptionPool, chunks, ciphertext_expressions
+from secret.models import Secret, SecretGroupObjectPermission
 from user.models import User
 
-GET_CRED_SQL = (
-    "SELECT cc.*, ag.name as owner_group_name FROM cred_cred as cc "
+GET_NOW_SQL = "SELECT now();"
+_CRED_SQL = (
+    "SELECT cc.id, cc.modified, cc.title, cc.url, cc.username, cc.password, cc.description, "
+    "ag.name as owner_group_name FROM cred_cred as cc "
     "LEFT JOIN auth_group as ag ON cc.group_id = ag.id "
-    "WHERE cc.latest_id is null;"
+    "WHERE cc.latest_id is null "
 )
+GET_CRED_SQL = _CRED_SQL + "ORDER BY cc.id;"
+GET_CHANGED_CRED_SQL = _CRED_SQL + "AND cc.modified >= %s ORDER BY cc.id;"
 GET_GROUP_SQL = "SELECT name FROM auth_group;"
-GET_VIEWER_GROUPS = (
-    "SELECT ag.name from auth_group as ag "
+GET_VIEWER_GROUPS_SQL = (
+    "SELECT ccg.cred_id, ag.name from auth_group as ag "
     "INNER JOIN cred_cred_groups as ccg ON ag.id = ccg.group_id "
-    "WHERE ccg.cred_id = {};"
+    "WHERE ccg.cred_id = ANY(%s);"
 )
 GET_AUDIT_SQL = (
-    "SELECT cca.audittype, au.email, cca.time FROM cred_credaudit cca "
+    "SELECT cca.id, cca.cred_id, cca.audittype, au.email, cca.time FROM cred_credaudit cca "
     "INNER JOIN auth_user au ON cca.user_id = au.id "
-    "WHERE cca.cred_id = {} "
-    "ORDER BY time;"
+    "WHERE cca.id > %s "
+    "ORDER BY cca.id;"
 )
 GET_USER_SQL = (
     "SELECT au.email, string_agg(ag.name, '|') as groups FROM auth_group ag "
@@ -38,6 +52,13 @@ GET_USER_SQL = (
 CHANGE_PERM = "change_secret"
 VIEW_PERM = "view_secret"
 
+# creds, or users, written per transaction, and rows fetched from rattic at a time
+DEFAULT_BATCH_SIZE = 1000
+
+# creds modified this long before the last run started are read again, in case the clocks of the
+# Rattic app and database disagree. A cred read again that has not changed is left alone.
+SYNC_OVERLAP = dt.timedelta(minutes=10)
+
 # rattic audit actions
 CREDADD = "A"
 CREDCHANGE = "C"
@@ -63,8 +84,10 @@ CREDAUDITCHOICES = dict(
 
 class Command(BaseCommand):
     help = (
-        "Import credential, group and audit data from an existing Ratticweb database "
-        "NOTE: this command is not idempotent"
+        "Import credential, group and audit data from an existing Ratticweb database. Creds "
+        "imported before are updated rather than imported again, only if they changed in Rattic "
+        "since, and with --incremental only the creds and audit events that changed since the "
+        "last run are read"
     )
 
     def add_arguments(self, parser):
@@ -75,6 +98,26 @@ class Command(BaseCommand):
         parser.add_argument("--user")
         parser.add_argument("--host", default="localhost")
         parser.add_argument("--password")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help=(
+                "Processes to encrypt secrets in, by default none, in this process. See the "
+                "benchmark_bulk_encryption command for whether more pay off on this machine."
+            ),
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only read the creds and audit events added or changed since the last run",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Rows read from rattic and written per transaction at a time",
+        )
 
     def connect_to_rattic_db(self, dbname, user, host, password):
         conn_str = f"dbname='{dbname}' host='{host}'"
@@ -93,129 +136,335 @@ class Command(BaseCommand):
             )
             raise
 
-    def get_viewer_groups(self, conn, cred_id):
-        """return a list of viewer groups"""
+    def fetch(self, conn, sql, params=None):
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(GET_VIEWER_GROUPS.format(cred_id))
+        cur.execute(sql, params)
+
+        return cur.fetchall()
+
+    def stream(self, conn, sql, params=None):
+        """
+        Yield the rows of a query through a server-side cursor, which brings them over
+        `batch_size` at a time instead of the whole result at once
+        """
+        self.cursors += 1
+        cur = conn.cursor(
+            f"rattic_import_{self.cursors}", cursor_factory=psycopg2.extras.DictCursor
+        )
+        cur.itersize = self.batch_size
 
-        rows = cur.fetchall()
-        for row in rows:
-            yield row[0]
+        try:
+            cur.execute(sql, params)
+            yield from cur
+        finally:
+            cur.close()
 
-    def get_audit_events(self, conn, cred_id):
-        """return a list of audit events"""
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(GET_AUDIT_SQL.format(cred_id))
+    def detail(self, message):
+        """Per row output, only shown with --verbosity 2 or more"""
+        if self.verbosity > 1:
+            self.stdout.write(message)
 
-        rows = cur.fetchall()
-        for row in rows:
-            yield row[0], row[1], row[2]
+    def progress(self, label, done, started):
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(f"{label}: {done} ({rate:.0f} rows/s)")
+
+    def get_viewer_groups(self, conn, cred_ids):
+        """return a {cred id: [viewer group name, ...]} mapping for the given creds"""
+        viewer_groups = {}
+
+        for cred_id, name in self.fetch(conn, GET_VIEWER_GROUPS_SQL, [cred_ids]):
+            viewer_groups.setdefault(cred_id, []).append(name)
+
+        return viewer_groups
 
     def import_groups(self, conn, dry_run):
         """ Import groups from rattic into passman """
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(GET_GROUP_SQL)
+        names = [row[0] for row in self.stream(conn, GET_GROUP_SQL)]
 
-        rows = cur.fetchall()
-        for count, row in enumerate(rows, 1):
-            self.stdout.write("importing group: " + row[0])
-            if not dry_run:
-                Group.objects.get_or_create(name=row[0])
+        for name in names:
+            self.detail("importing group: " + name)
 
-        return count
+        if not dry_run:
+            Group.objects.bulk_create(
+                [Group(name=name) for name in names],
+                ignore_conflicts=True,
+                batch_size=self.batch_size,
+            )
 
-    def import_secrets(self, conn, dry_run):
-        """ Import creds/secrets and set the owner/viewer groups """
+        self.groups = {group.name: group for group in Group.objects.filter(name__in=names)}
 
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(GET_CRED_SQL)
+        return len(names)
+
+    def group_grants(self, og_name, vg_names):
+        """
+        (group name, permission codename) for the owner group's change and view permissions, and
+        the viewer groups' view permissions
+        """
+        grants = []
+
+        for vg_name in vg_names:
+            if og_name and og_name == vg_name:
+                continue
+
+            self.detail(f"giving view permissions for viewer group: {vg_name}")
+            grants.append((vg_name, VIEW_PERM))
+
+        if og_name:
+            self.detail(f"giving change permissions for owner group: {og_name}")
+            grants += [(og_name, VIEW_PERM), (og_name, CHANGE_PERM)]
+
+        return grants
+
+    def revoke_grants(self, revoked):
+        """Delete the group permissions for the given (secret id, group id, codename)s"""
+        if not revoked:
+            return
+
+        SecretGroupObjectPermission.objects.filter(
+            functools.reduce(
+                operator.or_,
+                (
+                    Q(
+                        content_object=secret_id,
+                        group=group_id,
+                        permission=self.permissions[codename],
+                    )
+                    for secret_id, group_id, codename in revoked
+                ),
+            )
+        ).delete()
+
+    def audit_event(self, secret_id, audit_type, user, timestamp):
+        audit_display = CREDAUDITCHOICES[audit_type]
+        self.detail(f"adding audit event: {audit_display}")
+
+        return Audit(
+            timestamp=timestamp,
+            user=self.anon_user,
+            secret_id=secret_id,
+            action="imported",
+            description=f"[Rattic Import] {audit_display} by {user}",
+        )
 
-        rows = cur.fetchall()
+    @transaction.atomic
+    def import_secret_batch(self, conn, rows):
+        """
+        Import a batch of creds with their permissions, in one transaction.
+
+        A cred imported before only updates its secret if the cred was modified in Rattic since it
+        was last imported, and Rattic wins then: the secret's fields are overwritten, even if they
+        were edited in passman in the meantime. The group permissions the import granted before
+        are replaced with the cred's current ones, while those granted in passman are kept. A cred
+        that has not changed leaves its secret, and any edits to it in passman, as they are.
+        """
+        imported = RatticCred.objects.in_bulk([row[0] for row in rows])
+        rows = [
+            row for row in rows if row[0] not in imported or imported[row[0]].modified != row[1]
+        ]
+
+        if not rows:
+            return 0, 0
+
+        viewer_groups = self.get_viewer_groups(conn, [row[0] for row in rows])
+        now = timezone.now()
+        created, updated, grants = {}, {}, {}
+
+        for cred_id, modified, title, url, username, password, description, og_name in rows:
+            self.detail("importing secret: " + title)
+
+            secret = Secret(
+                name=title, url=url, username=username, password=password, details=description,
+            )
 
-        for count, row in enumerate(rows, 1):
-            self.stdout.write("importing secret: " + row[1])
+            if cred_id in imported:
+                secret.pk, secret.last_updated = imported[cred_id].secret_id, now
+                updated[cred_id] = secret
+            else:
+                created[cred_id] = secret
 
-            if not dry_run:
-                secret = Secret.objects.create(
-                    name=row[1], url=row[7], username=row[2], password=row[3], details=row[4],
+            grants[cred_id] = self.group_grants(og_name, viewer_groups.get(cred_id, []))
+
+        if self.dry_run:
+            return len(created), len(updated)
+
+        self.encryption.encrypt([*created.values(), *updated.values()])
+        ciphertext_expressions(updated.values())
+
+        Secret.objects.bulk_create(created.values(), batch_size=self.batch_size)
+        Secret.objects.bulk_update(
+            updated.values(),
+            ["name", "url", "username", "password", "details", "last_updated"],
+            batch_size=self.batch_size,
+        )
+
+        creds, granted, revoked = [], [], []
+
+        for cred_id, modified, *_ in rows:
+            secret = created.get(cred_id) or updated[cred_id]
+            cred = imported.get(cred_id) or RatticCred(cred_id=cred_id, secret=secret)
+            before = {tuple(grant) for grant in cred.grants}
+            after = {(self.groups[name].pk, codename) for name, codename in grants[cred_id]}
+
+            granted += [(secret.pk, *grant) for grant in after - before]
+            revoked += [(secret.pk, *grant) for grant in before - after]
+            cred.modified, cred.grants = modified, sorted(after)
+            creds.append(cred)
+
+        RatticCred.objects.bulk_create(
+            [cred for cred in creds if cred.cred_id in created], batch_size=self.batch_size
+        )
+        RatticCred.objects.bulk_update(
+            [cred for cred in creds if cred.cred_id in updated],
+            ["modified", "grants"],
+            batch_size=self.batch_size,
+        )
+
+        self.revoke_grants(revoked)
+        SecretGroupObjectPermission.objects.bulk_create(
+            [
+                SecretGroupObjectPermission(
+                    content_object_id=secret_id,
+                    group_id=group_id,
+                    permission=self.permissions[codename],
                 )
+                for secret_id, group_id, codename in granted
+            ],
+            # e.g. a permission granted in passman too, which is then taken as the import's
+            ignore_conflicts=True,
+            batch_size=self.batch_size,
+        )
+
+        # bulk_create sends no post_save signals to do this row by row
+        refresh_access(secret_ids=[secret.pk for secret in [*created.values(), *updated.values()]])
 
-            # owner group
-            og_name = row[-1]
-            if og_name:
-                self.stdout.write(f"giving change permissions for owner group: {og_name}")
+        return len(created), len(updated)
 
-                if not dry_run:
-                    og = Group.objects.get(name=og_name)
+    def import_secrets(self, conn, since=None):
+        """
+        Import creds/secrets and set the owner/viewer groups, only those modified since `since`
+        when it is given
+        """
 
-                    secret.set_permission(og, CHANGE_PERM)
+        self.anon_user = User.objects.get(email="AnonymousUser")
+        self.permissions = {
+            permission.codename: permission
+            for permission in Permission.objects.filter(
+                content_type__app_label="secret", codename__in=[VIEW_PERM, CHANGE_PERM]
+            )
+        }
 
-            cred_id = row[0]
+        if since:
+            rows = self.stream(conn, GET_CHANGED_CRED_SQL, [since - SYNC_OVERLAP])
+        else:
+            rows = self.stream(conn, GET_CRED_SQL)
 
-            for vg_name in self.get_viewer_groups(conn, cred_id):
-                if og_name and og_name == vg_name:
-                    continue
+        started = time.monotonic()
+        created = updated = 0
 
-                self.stdout.write(f"giving view permissions for viewer group: {vg_name}")
+        for batch in chunks(rows, self.batch_size):
+            batch_created, batch_updated = self.import_secret_batch(conn, batch)
+            created += batch_created
+            updated += batch_updated
+            self.progress("secrets", created + updated, started)
 
-                if not dry_run:
-                    vg = Group.objects.get(name=vg_name)
+        self.stdout.write(f"{updated} secrets updated")
 
-                    secret.set_permission(vg, VIEW_PERM)
+        return created
 
-            anon_user = User.objects.get(email="AnonymousUser")
+    @transaction.atomic
+    def import_audit_batch(self, events):
+        """
+        Import a batch of audit events, and move the sync's audit high-water mark past them in the
+        same transaction so that none is imported twice
+        """
+        secret_ids = dict(
+            RatticCred.objects.filter(cred_id__in={event[1] for event in events}).values_list(
+                "cred_id", "secret_id"
+            )
+        )
+        audits = [
+            self.audit_event(secret_ids[cred_id], audit_type, user, timestamp)
+            for _, cred_id, audit_type, user, timestamp in events
+            # events on creds that were not imported, e.g. old versions of a cred
+            if cred_id in secret_ids
+        ]
 
-            # import audit events
-            for audit_type, user, timestamp in self.get_audit_events(conn, cred_id):
-                audit_display = CREDAUDITCHOICES[audit_type]
-                audit_details = f"[Rattic Import] {audit_display} by {user}"
+        if self.dry_run:
+            return len(events)
 
-                self.stdout.write(f"adding audit event: {audit_display}")
+        Audit.objects.bulk_create(audits, batch_size=self.batch_size)
+        record_rollups(audits)
 
-                if not dry_run:
-                    audit = Audit.objects.create(
-                        timestamp=timestamp,
-                        user=anon_user,
-                        secret=secret,
-                        action="imported",
-                        description=audit_details,
-                    )
+        self.sync.audit_id = events[-1][0]
+        self.sync.save(update_fields=["audit_id"])
 
-                    audit.timestamp = timestamp
-                    audit.save()
+        return len(audits)
 
-        return count
+    def import_audit_events(self, conn):
+        """Import the audit events added since the last run, which is all of them the first time"""
+        started = time.monotonic()
+        done = audits = 0
 
-    def import_users(self, conn, dry_run):
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(GET_USER_SQL)
+        rows = self.stream(conn, GET_AUDIT_SQL, [self.sync.audit_id])
 
-        rows = cur.fetchall()
+        for events in chunks(rows, self.batch_size):
+            audits += self.import_audit_batch(events)
+            done += len(events)
+            self.progress("audit events", done, started)
 
-        for count, row in enumerate(rows, 1):
+        return audits
+
+    @transaction.atomic
+    def import_user_batch(self, rows):
+        memberships = {}
 
+        for row in rows:
             email, groups = row[0].lower(), row[1].split("|")
+            self.detail(f"importing user: {email} with groups: {groups}")
+            memberships[email] = groups
 
-            self.stdout.write(f"importing user: {email} with groups: {groups}")
+        if self.dry_run:
+            return
 
-            if not dry_run:
-                user, created = User.objects.get_or_create(email=email)
+        users = {user.email: user for user in User.objects.filter(email__in=memberships)}
+        new_users = [User(email=email) for email in memberships if email not in users]
 
-                if created:
-                    self.stdout.write(f"user created {email}")
-                else:
-                    self.stdout.write(f"user found {email}")
+        for user in new_users:
+            self.detail(f"user created {user.email}")
 
-                for group in groups:
-                    group = Group.objects.get(name=group)
-                    user.groups.add(group)
+        users.update((user.email, user) for user in User.objects.bulk_create(new_users))
 
-                    self.stdout.write(f"adding {email} to {group}")
+        User.groups.through.objects.bulk_create(
+            [
+                User.groups.through(user_id=users[email].pk, group_id=self.groups[name].pk)
+                for email, groups in memberships.items()
+                for name in groups
+            ],
+            ignore_conflicts=True,
+            batch_size=self.batch_size,
+        )
 
-        return count
+        # group membership changes reach the access table through m2m signals, which
+        # bulk_create does not send
+        refresh_access(user_ids=[user.pk for user in users.values()])
+
+    def import_users(self, conn, dry_run):
+        started = time.monotonic()
+        done = 0
+
+        for batch in chunks(self.stream(conn, GET_USER_SQL), self.batch_size):
+            self.import_user_batch(batch)
+            done += len(batch)
+            self.progress("users", done, started)
+
+        return done
 
-    @transaction.atomic
     def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        self.verbosity = options["verbosity"]
+        self.batch_size = options["batch_size"]
+        self.cursors = 0
 
         try:
             conn = self.connect_to_rattic_db(
@@ -224,16 +473,46 @@ class Command(BaseCommand):
         except BaseException:
             exit(1)
 
+        source = f"{options['host']}/{options['dbname']}"
+        self.sync = RatticSync.objects.filter(source=source).first() or RatticSync(source=source)
+
+        if not self.dry_run:
+            self.sync.save()
+
+        since = None
+
+        if options["incremental"]:
+            since = self.sync.cred_modified
+            self.stdout.write(
+                f"Reading creds modified since {since}" if since else "No previous run to follow"
+            )
+
         total = self.import_groups(conn, options["dry_run"])
 
         self.stdout.write(f"\nSuccessfully imported {total} groups\n\n\n")
 
-        total = self.import_secrets(conn, options["dry_run"])
+        # as of the Rattic database's clock, the next incremental run reads creds from here
+        cred_modified = self.fetch(conn, GET_NOW_SQL)[0][0]
+
+        # nothing is encrypted in a dry run
+        workers = 0 if self.dry_run else options["workers"]
+
+        with EncryptionPool(workers) as self.encryption:
+            total = self.import_secrets(conn, since)
 
         self.stdout.write(f"\nSuccessfully imported {total} secrets")
 
+        total = self.import_audit_events(conn)
+
+        self.stdout.write(f"\nSuccessfully imported {total} audit events")
+
         total = self.import_users(conn, options["dry_run"])
 
         self.stdout.write(f"\nSuccessufly imported {total} users")
 
+        if not self.dry_run:
+            self.sync.cred_modified = cred_modified
+            self.sync.synced = timezone.now()
+            self.sync.save(update_fields=["cred_modified", "synced"])
+
         self.stdout.write(self.style.SUCCESS("Done."))
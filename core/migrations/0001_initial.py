@@ -0,0 +1,51 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("secret", "0016_secret_blobs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RatticSync",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("source", models.CharField(max_length=255, unique=True)),
+                ("cred_modified", models.DateTimeField(null=True)),
+                ("audit_id", models.PositiveIntegerField(default=0)),
+                ("synced", models.DateTimeField(null=True)),
+            ],
+            options={
+                "verbose_name": "Rattic sync",
+            },
+        ),
+        migrations.CreateModel(
+            name="RatticCred",
+            fields=[
+                ("cred_id", models.PositiveIntegerField(primary_key=True, serialize=False)),
+                (
+                    "secret",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="secret.secret",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Rattic cred",
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ratticcred",
+            name="grants",
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name="ratticcred",
+            name="modified",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import models
+
+
+class RatticCred(models.Model):
+    """
+    A Rattic cred imported as a secret, so that `import_from_rattic_db` updates the secret when the
+    cred changes rather than importing it again
+    """
+
+    cred_id = models.PositiveIntegerField(primary_key=True)
+    secret = models.OneToOneField("secret.Secret", on_delete=models.CASCADE, related_name="+")
+    # the cred's modified time when it was last imported
+    modified = models.DateTimeField(null=True)
+    # [group id, permission codename] for each group permission the import granted on the secret,
+    # which are the ones it replaces when the cred changes
+    grants = models.JSONField(default=list)
+
+    class Meta:
+        verbose_name = "Rattic cred"
+
+
+class RatticSync(models.Model):
+    """
+    How far `import_from_rattic_db` has got through a Rattic database. An `--incremental` run only
+    reads the creds modified since `cred_modified` and the audit events after `audit_id`.
+    """
+
+    source = models.CharField(max_length=255, unique=True)
+    # the Rattic database's clock when the last run started reading creds
+    cred_modified = models.DateTimeField(null=True)
+    audit_id = models.PositiveIntegerField(default=0)
+    synced = models.DateTimeField(null=True)
+
+    class Meta:
+        verbose_name = "Rattic sync"
+
+    def __str__(self):
+        return self.source
@@ -0,0 +1,258 @@
+import datetime as dt
+
+import pytest
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.utils import timezone
+from guardian.shortcuts import assign_perm, get_group_perms
+
+from audit.models import Audit
+from core.management.commands import import_from_rattic_db as rattic
+from core.models import RatticCred, RatticSync
+from secret.models import Secret, SecretAccess
+from user.models import User
+
+pytestmark = pytest.mark.django_db
+
+T1 = timezone.make_aware(dt.datetime(2019, 3, 1, 9, 30))
+T2 = timezone.make_aware(dt.datetime(2019, 3, 2, 9, 30))
+T3 = timezone.make_aware(dt.datetime(2019, 3, 3, 9, 30))
+T4 = timezone.make_aware(dt.datetime(2019, 3, 4, 9, 30))
+
+
+def _cred(cred_id, title, owner_group):
+    # id, title, url, username, password, description, owner group name; the modified time is
+    # added after the id as the rows are read
+    return [cred_id, title, "http://x/", f"{title}-user", f"{title}-pass", "details", owner_group]
+
+
+class Rattic:
+    """The rows of a Rattic database, as the command's queries return them"""
+
+    def __init__(self):
+        self.now = T3
+        self.groups = [["ops"], ["devs"]]
+        # cred id -> (modified, row)
+        self.creds = {1: (T1, _cred(1, "db", "ops")), 2: (T1, _cred(2, "wiki", None))}
+        self.viewer_groups = [[1, "devs"], [1, "ops"], [2, "devs"]]
+        self.audits = [
+            [1, 1, "A", "alice@example.com", T1],
+            [2, 1, "P", "bob@example.com", T2],
+            # on an old version of a cred, which is not imported
+            [3, 9, "C", "bob@example.com", T2],
+        ]
+        self.users = [["Alice@example.com", "ops|devs"], ["bob@example.com", "devs"]]
+
+    def results(self, sql, params):
+        if sql == rattic.GET_NOW_SQL:
+            return [[self.now]]
+        if sql == rattic.GET_GROUP_SQL:
+            return self.groups
+        if sql == rattic.GET_CRED_SQL:
+            return [
+                [row[0], modified, *row[1:]] for _, (modified, row) in sorted(self.creds.items())
+            ]
+        if sql == rattic.GET_CHANGED_CRED_SQL:
+            return [
+                [row[0], modified, *row[1:]]
+                for _, (modified, row) in sorted(self.creds.items())
+                if modified >= params[0]
+            ]
+        if sql == rattic.GET_VIEWER_GROUPS_SQL:
+            return [row for row in self.viewer_groups if row[0] in params[0]]
+        if sql == rattic.GET_AUDIT_SQL:
+            return [row for row in self.audits if row[0] > params[0]]
+        if sql == rattic.GET_USER_SQL:
+            return self.users
+
+
+class Cursor:
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.itersize = None
+
+    def execute(self, sql, params=None):
+        self.connection.queries.append((sql, params))
+        self.rows = self.connection.rattic.results(sql, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        self.connection.streamed.append((self.name, self.itersize))
+        return iter(self.rows)
+
+    def close(self):
+        self.connection.closed.append(self.name)
+
+
+class Connection:
+    def __init__(self):
+        self.rattic = Rattic()
+        self.queries = []
+        self.streamed = []
+        self.closed = []
+
+    def cursor(self, name=None, **kwargs):
+        return Cursor(self, name)
+
+    def params(self, sql):
+        return [params for query, params in self.queries if query == sql]
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = Connection()
+    monkeypatch.setattr(
+        rattic.Command,
+        "connect_to_rattic_db",
+        lambda self, *args: connection,
+    )
+    return connection
+
+
+def test_import(connection):
+    User.objects.get_or_create(email="AnonymousUser")
+    alice = User.objects.create(email="alice@example.com", is_active=True)
+
+    call_command("import_from_rattic_db", "--dbname=rattic")
+
+    ops, devs = Group.objects.get(name="ops"), Group.objects.get(name="devs")
+    db, wiki = Secret.objects.get(name="db"), Secret.objects.get(name="wiki")
+
+    assert Secret.objects.with_encrypted().get(name="db").password == "db-pass"
+    assert set(get_group_perms(ops, db)) == {"view_secret", "change_secret"}
+    assert set(get_group_perms(devs, db)) == {"view_secret"}
+    assert set(get_group_perms(devs, wiki)) == {"view_secret"}
+    assert not get_group_perms(ops, wiki)
+
+    assert list(
+        Audit.objects.filter(secret=db)
+        .order_by("timestamp")
+        .values_list("timestamp", "description")
+    ) == [
+        (T1, "[Rattic Import] Added by alice@example.com"),
+        (T2, "[Rattic Import] Password Viewed by bob@example.com"),
+    ]
+
+    assert set(alice.groups.values_list("name", flat=True)) == {"ops", "devs"}
+    assert set(User.objects.get(email="bob@example.com").groups.all()) == {devs}
+
+    # the access table is kept in line with the bulk inserted permissions and memberships
+    assert set(SecretAccess.objects.values_list("user", "secret", "permission")) == {
+        (alice.pk, db.pk, "change_secret"),
+        (alice.pk, wiki.pk, "view_secret"),
+    }
+    call_command("rebuild_secret_access", "--verify")
+
+    # one query per batch of creds, not per cred
+    assert connection.params(rattic.GET_VIEWER_GROUPS_SQL) == [[[1, 2]]]
+
+    assert set(RatticCred.objects.values_list("cred_id", "secret", "modified")) == {
+        (1, db.pk, T1),
+        (2, wiki.pk, T1),
+    }
+    assert RatticCred.objects.get(cred_id=1).grants == sorted(
+        [[devs.pk, "view_secret"], [ops.pk, "change_secret"], [ops.pk, "view_secret"]]
+    )
+    sync = RatticSync.objects.get(source="localhost/rattic")
+    assert (sync.cred_modified, sync.audit_id) == (T3, 3)
+
+
+def test_batches(connection):
+    User.objects.get_or_create(email="AnonymousUser")
+
+    call_command("import_from_rattic_db", "--dbname=rattic", "--workers=2", "--batch-size=1")
+
+    assert Secret.objects.count() == 2
+    # encrypted in the worker processes
+    assert Secret.objects.with_encrypted().get(name="wiki").password == "wiki-pass"
+    assert Audit.objects.filter(action="imported").count() == 2
+    assert User.objects.filter(email__in=["alice@example.com", "bob@example.com"]).count() == 2
+
+    assert connection.params(rattic.GET_VIEWER_GROUPS_SQL) == [[[1]], [[2]]]
+    assert RatticSync.objects.get().audit_id == 3
+
+    # the big queries come through server-side cursors, a batch of rows at a time
+    names = [name for name, _ in connection.streamed]
+    assert None not in names
+    assert len(set(names)) == len(names)
+    assert {itersize for _, itersize in connection.streamed} == {1}
+    assert sorted(connection.closed) == sorted(names)
+
+
+def test_dry_run(connection):
+    User.objects.get_or_create(email="AnonymousUser")
+
+    call_command("import_from_rattic_db", "--dbname=rattic", "--dry-run")
+
+    assert not Group.objects.filter(name__in=["ops", "devs"]).exists()
+    assert not Secret.objects.exists()
+    assert not Audit.objects.exists()
+    assert not User.objects.filter(email="alice@example.com").exists()
+    assert not RatticSync.objects.exists()
+
+
+def test_run_again(connection):
+    User.objects.get_or_create(email="AnonymousUser")
+
+    call_command("import_from_rattic_db", "--dbname=rattic")
+    # edited in passman, but not in Rattic since
+    Secret.objects.filter(name="db").update(name="production db")
+    connection.queries.clear()
+
+    call_command("import_from_rattic_db", "--dbname=rattic")
+
+    assert Secret.objects.count() == 2
+    assert Secret.objects.filter(name="production db").exists()
+    assert Audit.objects.filter(action="imported").count() == 2
+    # nothing about the unchanged creds is read or written beyond the creds themselves
+    assert connection.params(rattic.GET_VIEWER_GROUPS_SQL) == []
+    # audit events are read after the last one imported, whether incremental or not
+    assert connection.params(rattic.GET_AUDIT_SQL) == [[3]]
+
+
+def test_incremental(connection):
+    User.objects.get_or_create(email="AnonymousUser")
+    alice = User.objects.create(email="alice@example.com", is_active=True)
+
+    call_command("import_from_rattic_db", "--dbname=rattic")
+    db = Secret.objects.get(name="db")
+    # granted in passman after the import
+    admins = Group.objects.create(name="admins")
+    assign_perm("change_secret", admins, db)
+    connection.queries.clear()
+
+    # db moves from ops to devs and is renamed, and a cred and an audit event are added
+    connection.rattic.now = T4
+    connection.rattic.creds[1] = (T4, _cred(1, "database", "devs"))
+    connection.rattic.creds[3] = (T4, _cred(3, "ci", "ops"))
+    connection.rattic.viewer_groups = [[1, "devs"], [2, "devs"], [3, "ops"]]
+    connection.rattic.audits.append([4, 3, "A", "alice@example.com", T4])
+
+    call_command("import_from_rattic_db", "--dbname=rattic", "--incremental")
+
+    assert connection.params(rattic.GET_CHANGED_CRED_SQL) == [[T3 - rattic.SYNC_OVERLAP]]
+    assert connection.params(rattic.GET_VIEWER_GROUPS_SQL) == [[[1, 3]]]
+    assert connection.params(rattic.GET_AUDIT_SQL) == [[3]]
+
+    ops, devs = Group.objects.get(name="ops"), Group.objects.get(name="devs")
+    db = Secret.objects.with_encrypted().get(pk=db.pk)
+    ci = Secret.objects.get(name="ci")
+
+    assert Secret.objects.count() == 3
+    assert (db.name, db.password) == ("database", "database-pass")
+    assert not get_group_perms(ops, db)
+    assert set(get_group_perms(devs, db)) == {"view_secret", "change_secret"}
+    assert set(get_group_perms(admins, db)) == {"change_secret"}
+    assert set(get_group_perms(ops, ci)) == {"view_secret", "change_secret"}
+    assert list(Audit.objects.filter(secret=ci).values_list("description", flat=True)) == [
+        "[Rattic Import] Added by alice@example.com"
+    ]
+    assert RatticSync.objects.get().cred_modified == T4
+
+    # alice is in both groups, so still has change access to db through devs
+    assert SecretAccess.objects.get(user=alice, secret=db).permission == "change_secret"
+    call_command("rebuild_secret_access", "--verify")
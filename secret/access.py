@@ -0,0 +1,119 @@
+"""
+Maintenance of the `SecretAccess` table.
+
+`SecretFilter` reads the secrets a user can see from `SecretAccess` instead of asking guardian to
+union the user and group object permissions on every request. The functions below recompute the
+effective access from the guardian tables for a set of secrets and/or users and reconcile the
+stored rows with it.
+"""
+from itertools import chain
+
+from django.db import transaction
+
+from .models import (
+    SecretAccess,
+    SecretGroupObjectPermission,
+    SecretUserObjectPermission,
+)
+
+VIEW_PERMISSION = "view_secret"
+CHANGE_PERMISSION = "change_secret"
+
+ACCESS_PERMISSIONS = (VIEW_PERMISSION, CHANGE_PERMISSION)
+
+BATCH_SIZE = 1000
+
+
+def compute_access(secret_ids=None, user_ids=None):
+    """
+    Return a `{(user_id, secret_id): permission}` mapping of the highest permission each active
+    user holds on each secret, optionally limited to the given secrets and/or users.
+    """
+    user_perms = SecretUserObjectPermission.objects.filter(
+        user__is_active=True, permission__codename__in=ACCESS_PERMISSIONS
+    )
+    # conditions on the group's members go in one filter() so they share one join, which
+    # values_list() below reads the user from
+    group_members = {"group__user__is_active": True}
+
+    if secret_ids is not None:
+        user_perms = user_perms.filter(content_object_id__in=secret_ids)
+
+    if user_ids is not None:
+        user_perms = user_perms.filter(user_id__in=user_ids)
+        group_members["group__user__in"] = user_ids
+
+    group_perms = SecretGroupObjectPermission.objects.filter(
+        permission__codename__in=ACCESS_PERMISSIONS, **group_members
+    )
+
+    if secret_ids is not None:
+        group_perms = group_perms.filter(content_object_id__in=secret_ids)
+
+    access = {}
+
+    for user_id, secret_id, codename in chain(
+        user_perms.values_list("user_id", "content_object_id", "permission__codename"),
+        group_perms.values_list("group__user", "content_object_id", "permission__codename"),
+    ):
+        if access.get((user_id, secret_id)) != CHANGE_PERMISSION:
+            access[(user_id, secret_id)] = codename
+
+    return access
+
+
+def diff_access(secret_ids=None, user_ids=None):
+    """
+    Compare the stored access rows with the guardian permissions.
+
+    Returns a `(missing, changed, stale)` tuple: rows to create as a `{(user_id, secret_id):
+    permission}` dict, existing `SecretAccess` objects whose permission must be updated, and the
+    ids of rows that no longer grant anything.
+    """
+    expected = compute_access(secret_ids, user_ids)
+
+    stored = SecretAccess.objects.all()
+
+    if secret_ids is not None:
+        stored = stored.filter(secret_id__in=secret_ids)
+
+    if user_ids is not None:
+        stored = stored.filter(user_id__in=user_ids)
+
+    changed, stale = [], []
+
+    for access in stored:
+        permission = expected.pop((access.user_id, access.secret_id), None)
+
+        if permission is None:
+            stale.append(access.pk)
+        elif permission != access.permission:
+            access.permission = permission
+            changed.append(access)
+
+    return expected, changed, stale
+
+
+@transaction.atomic
+def refresh_access(secret_ids=None, user_ids=None):
+    """
+    Bring the stored access rows for the given secrets and/or users (everything when neither is
+    given) in line with the guardian permissions. Returns the number of rows touched.
+    """
+    missing, changed, stale = diff_access(secret_ids, user_ids)
+
+    for start in range(0, len(stale), BATCH_SIZE):
+        end = start + BATCH_SIZE
+        SecretAccess.objects.filter(pk__in=stale[start:end]).delete()
+
+    SecretAccess.objects.bulk_update(changed, ["permission"], batch_size=BATCH_SIZE)
+
+    SecretAccess.objects.bulk_create(
+        [
+            SecretAccess(user_id=user_id, secret_id=secret_id, permission=permission)
+            for (user_id, secret_id), permission in missing.items()
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    return len(missing) + len(changed) + len(stale)
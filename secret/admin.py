@@ -1,8 +1,24 @@
+from django import forms
+from django.contrib import messages
+from django.contrib.auth.models import Group
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadhandler import MemoryFileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from django.template.response import TemplateResponse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
 from guardian.admin import GuardedModelAdmin
 
-from core.admin import admin_site  # noqa: F401
+from core.admin import admin_site
+from .imports import FORMAT_CHOICES, InvalidExport, SecretImporter, guess_format, parse
 from .models import Secret  # noqa: F401
 
+# skipped entries listed on the page after an import
+SHOW_IMPORT_ERRORS = 100
+# exports larger than this are imported with the `import_secrets` command instead, as they would
+# take too long to import within a request
+MAX_IMPORT_UPLOAD_SIZE = 5 * 1024 * 1024
+
 
 class SecretAdmin(GuardedModelAdmin):
 
@@ -24,3 +40,123 @@ class SecretAdmin(GuardedModelAdmin):
 
 # All password editing should be done through the interface
 # admin_site.register(Secret, SecretAdmin)
+
+
+class SecretImportForm(forms.Form):
+    file = forms.FileField(help_text="A CSV, KeePass 2 XML or 1Password (.1pif) export")
+    format = forms.ChoiceField(
+        choices=[("", "Going by the file name")] + list(FORMAT_CHOICES),
+        required=False,
+    )
+    change_groups = forms.ModelMultipleChoiceField(
+        queryset=Group.objects.all().order_by("name"),
+        required=False,
+        help_text="Groups that can change the imported secrets",
+    )
+    view_groups = forms.ModelMultipleChoiceField(
+        queryset=Group.objects.all().order_by("name"),
+        required=False,
+        help_text="Groups that can view the imported secrets",
+    )
+    dry_run = forms.BooleanField(
+        required=False, help_text="Check every entry in the export without saving any"
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        if cleaned_data.get("file") and not cleaned_data.get("format"):
+            cleaned_data["format"] = guess_format(cleaned_data["file"].name)
+
+            if not cleaned_data["format"]:
+                self.add_error("format", "Choose the format of the export")
+
+        return cleaned_data
+
+
+class ImportUploadHandler(MemoryFileUploadHandler):
+    """
+    Keeps an uploaded export in memory, where Django would write one over
+    `FILE_UPLOAD_MAX_MEMORY_SIZE` to a temporary file, as the export is plaintext. An export over
+    `MAX_IMPORT_UPLOAD_SIZE` is dropped as it is read, and `too_large` set.
+    """
+
+    too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.activated = True
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > MAX_IMPORT_UPLOAD_SIZE:
+            self.too_large = True
+            raise SkipFile
+
+        return super().receive_data_chunk(raw_data, start)
+
+
+@csrf_exempt
+def import_view(request):
+    """
+    Import secrets from another password manager's export; see `secret.imports` and the
+    `import_secrets` command
+    """
+    # the handler has to be in place before the CSRF check reads the request body
+    request.upload_handlers = [ImportUploadHandler(request)]
+
+    return csrf_protect(_import_view)(request)
+
+
+def _import_view(request):
+    if not request.user.is_superuser:
+        raise PermissionDenied
+
+    form = SecretImportForm(request.POST or None, request.FILES or None)
+    importer = None
+
+    if request.upload_handlers[0].too_large:
+        # in place of the file being missing
+        form.errors["file"] = form.error_class(
+            [
+                f"The file is over {filesizeformat(MAX_IMPORT_UPLOAD_SIZE)}. Import it with the "
+                "import_secrets management command instead."
+            ]
+        )
+    elif request.method == "POST" and form.is_valid():
+        upload = form.cleaned_data["file"]
+        importer = SecretImporter(
+            request.user,
+            upload.name,
+            change_groups=form.cleaned_data["change_groups"],
+            view_groups=form.cleaned_data["view_groups"],
+            dry_run=form.cleaned_data["dry_run"],
+        )
+
+        try:
+            importer.run(parse(form.cleaned_data["format"], upload.file))
+        except InvalidExport as e:
+            form.add_error(
+                "file",
+                f"The file could not be read after {importer.imported} entries: {e}",
+            )
+        else:
+            verb = "would be" if importer.dry_run else "were"
+            messages.success(
+                request,
+                f"{importer.imported} secrets {verb} imported, {len(importer.errors)} skipped",
+            )
+
+    return TemplateResponse(
+        request,
+        "admin/secret/import.html",
+        {
+            **admin_site.each_context(request),
+            "title": "Import secrets",
+            "form": form,
+            "max_upload_size": MAX_IMPORT_UPLOAD_SIZE,
+            "importer": importer,
+            "errors": importer.errors[:SHOW_IMPORT_ERRORS] if importer else [],
+        },
+    )
+
+
+admin_site.register_view("secret/import/", import_view, name="secret_import")
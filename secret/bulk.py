@@ -0,0 +1,128 @@
+"""
+Encrypting the fields of many instances at once, across processes.
+
+Saving an instance encrypts its fields one after another in the saving process. Bulk imports hand
+their unsaved instances to an `EncryptionPool` first, which encrypts them in worker processes and
+leaves the ciphertext on each instance, so `bulk_create` writes it as it is. The results do not
+depend on the number of workers: each instance gets its own values back, in its own fields.
+"""
+
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+
+import django
+from django.conf import settings
+from django.db.models import Value
+
+from .fields import Ciphertext, LazyEncryptedMixin, encrypted_field_names
+from .keys import configured_keys, encrypt_values
+
+
+def chunks(rows, size):
+    """Group an iterable of rows into lists of at most `size`, without reading ahead"""
+    rows = iter(rows)
+
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def _setup_worker():
+    django.setup()
+
+
+def process_pool(workers):
+    """A pool of `workers` processes with Django set up, or None to work in this process"""
+    if not workers:
+        return None
+
+    return concurrent.futures.ProcessPoolExecutor(
+        workers,
+        # a fresh interpreter per worker, rather than a fork of this process's connections
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_setup_worker,
+    )
+
+
+def map_rows(pool, workers, function, rows, *args):
+    """`function(row, *args)` for each of `rows`, in order, split across the pool if there is one"""
+    if not pool:
+        return [function(row, *args) for row in rows]
+
+    count = len(rows)
+    return list(
+        pool.map(
+            function,
+            rows,
+            *([arg] * count for arg in args),
+            chunksize=max(1, count // (workers * 4)),
+        )
+    )
+
+
+class EncryptionPool:
+    """
+    Encrypts the encrypted fields of unsaved instances in `workers` processes, `os.cpu_count()` by
+    default, or in this process with 0. Use it as a context manager to shut the workers down.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.pool = process_pool(self.workers)
+        # as of now, so that every worker encrypts alike
+        self.keys = configured_keys()
+        self.codec = settings.SECRET_FIELD_CODEC
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self):
+        if self.pool:
+            self.pool.shutdown()
+
+    def encrypt(self, instances):
+        """Replace the plaintext in each instance's encrypted fields with its ciphertext"""
+        instances = list(instances)
+
+        if not instances:
+            return instances
+
+        model = type(instances[0])
+        fields = encrypted_field_names(model)
+        binary = [model._meta.get_field(field).binary for field in fields]
+
+        # read around the descriptors, which would decrypt a value that is already encrypted
+        rows = [[instance.__dict__.get(field) for field in fields] for instance in instances]
+        plaintext = [
+            [None if isinstance(value, Ciphertext) else value for value in row] for row in rows
+        ]
+
+        results = map_rows(
+            self.pool, self.workers, encrypt_values, plaintext, binary, self.keys, self.codec
+        )
+
+        for instance, values in zip(instances, results):
+            for field, new in zip(fields, values):
+                if new is not None:
+                    instance.__dict__[field] = Ciphertext(new)
+
+        return instances
+
+
+def ciphertext_expressions(instances):
+    """
+    Wrap the ciphertext in encrypted instances' fields in expressions, for `bulk_update`, which
+    reads each field's value through its descriptor and so would decrypt it again
+    """
+    for instance in instances:
+        for field in instance._meta.concrete_fields:
+            value = instance.__dict__.get(field.attname)
+
+            if isinstance(field, LazyEncryptedMixin) and isinstance(value, Ciphertext):
+                instance.__dict__[field.attname] = Value(value, output_field=field)
+
+    return instances
@@ -0,0 +1,48 @@
+from functools import wraps
+
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import Http404
+
+from .models import Secret
+from .permissions import has_secret_perm
+
+
+def get_secret(request, pk):
+    """
+    Return the secret with primary key `pk`, fetching it at most once per request.
+
+    The encrypted fields are loaded with the row, but are only decrypted when read (see
+    `secret.fields`), so every view and permission check handling the request shares one instance.
+    """
+    secrets = request.__dict__.setdefault("_secret_cache", {})
+    key = str(pk)
+
+    if key not in secrets:
+        try:
+            secrets[key] = Secret.objects.with_encrypted().get(pk=pk)
+        except (Secret.DoesNotExist, ValidationError):
+            raise Http404("Secret does not exist")
+
+    return secrets[key]
+
+
+def permission_required_or_403(perm, lookup_kwarg="pk"):
+    """
+    Check `perm` on the secret identified by the view's `lookup_kwarg` argument, as guardian's
+    decorator of the same name does, but with the secret and the user's permissions on it taken
+    from the request's cache.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            secret = get_secret(request, kwargs[lookup_kwarg])
+
+            if not has_secret_perm(request, perm, secret):
+                raise PermissionDenied
+
+            return view_func(request, *args, **kwargs)
+
+        return _wrapped_view
+
+    return decorator
@@ -0,0 +1,130 @@
+"""
+Lazily decrypted `django_cryptography` fields.
+
+A plain `encrypt(...)` field decrypts and unpickles its value as each row is loaded, whether or not
+anything reads it. The fields below keep the value from the database as a `Ciphertext` and only
+decrypt it the first time the attribute is read; saving an instance whose value was never read
+writes the ciphertext back untouched.
+
+Values are encrypted in the format and under the keys configured in `secret.keys`.
+Decryptions are counted per request by `secret.middleware.DecryptionCountMiddleware`.
+"""
+
+import contextvars
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+from django.utils.encoding import force_bytes
+
+from django_cryptography.fields import EncryptedMixin
+
+from . import keys
+
+_decryption_counter = contextvars.ContextVar("decryption_counter", default=None)
+
+
+def encrypted_field_names(model):
+    return [
+        field.attname for field in model._meta.concrete_fields if isinstance(field, EncryptedMixin)
+    ]
+
+
+class DecryptionCounter:
+    def __init__(self):
+        self.count = 0
+
+
+def start_decryption_count():
+    """Start counting decryptions in the current context, returning the counter"""
+    counter = DecryptionCounter()
+    _decryption_counter.set(counter)
+    return counter
+
+
+def decryption_count():
+    counter = _decryption_counter.get()
+    return counter.count if counter else 0
+
+
+class Ciphertext:
+    """An encrypted value as stored in the database"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __eq__(self, other):
+        return isinstance(other, Ciphertext) and self.data == other.data
+
+    def __repr__(self):
+        return f"<Ciphertext: {len(self.data)} bytes>"
+
+
+class DecryptingAttribute(DeferredAttribute):
+    """Decrypts the field's value on first access and keeps the plaintext on the instance"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+
+        value = super().__get__(instance, cls)
+
+        if isinstance(value, Ciphertext):
+            value = instance.__dict__[self.field.attname] = self.field.decrypt(value)
+
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class LazyEncryptedMixin(EncryptedMixin):
+    descriptor_class = DecryptingAttribute
+
+    def _dump(self, value):
+        return keys.encrypt(value, binary=self.binary)
+
+    def _load(self, value):
+        return keys.decrypt(value, binary=self.binary, ttl=self.ttl)
+
+    @property
+    def binary(self):
+        """Whether values are bytes, rather than text"""
+        return isinstance(self, models.BinaryField)
+
+    def decrypt(self, ciphertext):
+        counter = _decryption_counter.get()
+
+        if counter:
+            counter.count += 1
+
+        return self._load(ciphertext.data)
+
+    def from_db_value(self, value, *args, **kwargs):
+        if value is not None:
+            return Ciphertext(force_bytes(value))
+        return value
+
+    def pre_save(self, model_instance, add):
+        # read around the descriptor so that an unread value is not decrypted just to be saved
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+        return super().pre_save(model_instance, add)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, Ciphertext):
+            return connection.Database.Binary(value.data)
+        return super().get_db_prep_value(value, connection, prepared)
+
+
+class EncryptedCharField(LazyEncryptedMixin, models.CharField):
+    pass
+
+
+class EncryptedTextField(LazyEncryptedMixin, models.TextField):
+    pass
+
+
+class EncryptedBinaryField(LazyEncryptedMixin, models.BinaryField):
+    pass
@@ -0,0 +1,521 @@
+"""
+Chunked, compressed, authenticated encryption of secret attachments, stored once per content.
+
+A file's plaintext is split into `settings.SECRET_FILE_CHUNK_SIZE` chunks, and each chunk is
+compressed with zlib and then encrypted with AES-256-GCM under a random key kept, encrypted, on a
+`SecretBlob`. Chunk `i` is encrypted under the nonce `<blob nonce prefix> <i> <last chunk flag>`,
+so chunks cannot be reordered, swapped between blobs or dropped from the end without decryption
+failing. As every chunk holds the same amount of plaintext, a byte range maps to a run of chunks
+and can be read without decrypting the rest.
+
+Blobs are addressed by the SHA-256 of their plaintext: a `SecretFile` whose contents are already
+stored points at the existing blob and bumps its `ref_count`, and `delete_secret_file` deletes the
+blob along with the last file pointing at it.
+
+Uploads are encrypted as they are received by `EncryptingUploadHandler`, which spools only
+ciphertext, and downloads decrypt one chunk at a time in `iter_file`, so neither holds more than a
+chunk of a file in memory. `iter_zip` streams all of a secret's files as one ZIP archive in the same
+way.
+
+Files stored before chunking have their whole Fernet-encrypted contents in
+`SecretFile.file_data` and no blob; they are still read, and the `convert_secret_files` command
+moves them to blobs.
+"""
+
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import tempfile
+import zipfile
+import zlib
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+NONCE_PREFIX_SIZE = 7
+
+COMPRESSION = "zlib"
+
+# chunk rows written per INSERT
+CHUNK_BATCH_SIZE = 16
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileIntegrityError(Exception):
+    """A stored file's chunks are missing, out of order or have been tampered with"""
+
+
+class RangeNotSatisfiable(Exception):
+    """A `Range` header asks for bytes beyond the end of the file"""
+
+
+def chunk_nonce(nonce_prefix, index, last):
+    return bytes(nonce_prefix) + index.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+
+
+def chunk_count(size, chunk_size):
+    # an empty file is still stored as one (empty) last chunk
+    return max(-(-size // chunk_size), 1)
+
+
+def guess_content_type(file_name, declared=None):
+    """The content type for a file, from its name rather than what the uploader claimed if possible"""
+    content_type, _ = mimetypes.guess_type(file_name)
+    return content_type or declared or "application/octet-stream"
+
+
+class ChunkEncryptor:
+    """Splits plaintext fed to `update()` into chunks, compresses them and encrypts them"""
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or settings.SECRET_FILE_CHUNK_SIZE
+        self.key = AESGCM.generate_key(bit_length=256)
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.size = 0
+
+        self._sha256 = hashlib.sha256()
+        self._aead = AESGCM(self.key)
+        self._buffer = bytearray()
+        self._index = 0
+
+    def _encrypt(self, data, last):
+        ciphertext = self._aead.encrypt(
+            chunk_nonce(self.nonce_prefix, self._index, last), zlib.compress(data), None
+        )
+        self._index += 1
+        return ciphertext
+
+    def update(self, data):
+        """Yield the encrypted chunks completed by `data`"""
+        self.size += len(data)
+        self._sha256.update(data)
+        self._buffer += data
+
+        # a full chunk is held back until more data arrives, as it may turn out to be the last
+        while len(self._buffer) > self.chunk_size:
+            yield self._encrypt(bytes(self._buffer[: self.chunk_size]), last=False)
+            del self._buffer[: self.chunk_size]
+
+    def finish(self):
+        """Return the last encrypted chunk"""
+        chunk = self._encrypt(bytes(self._buffer), last=True)
+        self._buffer.clear()
+        return chunk
+
+    @property
+    def sha256(self):
+        """The hex SHA-256 of the plaintext fed in so far"""
+        return self._sha256.hexdigest()
+
+
+class EncryptedSpool:
+    """
+    Encrypts data written to it into a temporary file. Nothing is stored until the whole file,
+    and so its hash, is known.
+    """
+
+    def __init__(self):
+        self.encryptor = ChunkEncryptor()
+        self.file = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+        # compression makes chunks vary in length
+        self.chunk_lengths = []
+
+    def _append(self, chunk):
+        self.file.write(chunk)
+        self.chunk_lengths.append(len(chunk))
+
+    def write(self, data):
+        for chunk in self.encryptor.update(data):
+            self._append(chunk)
+
+    def finish(self):
+        self._append(self.encryptor.finish())
+
+    @property
+    def stored_size(self):
+        return sum(self.chunk_lengths)
+
+    def chunks(self):
+        self.file.seek(0)
+
+        for length in self.chunk_lengths:
+            yield self.file.read(length)
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """
+    An upload already encrypted by `EncryptingUploadHandler`. `file` holds the encrypted chunks,
+    never the plaintext.
+    """
+
+    def __init__(self, spool, name, content_type, size, charset):
+        super().__init__(spool.file, name, content_type, size, charset)
+        self.spool = spool
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    Encrypts each uploaded file as it is received, spooling only ciphertext to a temporary file.
+    Must be the first upload handler, as it stops any others seeing the plaintext.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+
+        self.spool = EncryptedSpool()
+
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.spool.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.spool.finish()
+
+        return EncryptedUploadedFile(
+            self.spool, self.file_name, self.content_type, file_size, self.charset
+        )
+
+
+def _add_blob_reference(sha256):
+    """Take a reference to the existing blob with this hash, if there is one"""
+    from .models import SecretBlob
+
+    blob = SecretBlob.objects.select_for_update().filter(sha256=sha256).first()
+
+    if blob:
+        blob.ref_count = F("ref_count") + 1
+        blob.save(update_fields=["ref_count"])
+
+    return blob
+
+
+def _get_or_create_blob(spool):
+    from .models import SecretBlob, SecretBlobChunk
+
+    encryptor = spool.encryptor
+
+    if blob := _add_blob_reference(encryptor.sha256):
+        return blob
+
+    try:
+        with transaction.atomic():
+            blob = SecretBlob.objects.create(
+                sha256=encryptor.sha256,
+                size=encryptor.size,
+                stored_size=spool.stored_size,
+                chunk_size=encryptor.chunk_size,
+                compression=COMPRESSION,
+                nonce_prefix=encryptor.nonce_prefix,
+                encryption_key=encryptor.key,
+                ref_count=1,
+            )
+
+            batch = []
+            for index, data in enumerate(spool.chunks()):
+                batch.append(SecretBlobChunk(blob=blob, index=index, data=data))
+
+                if len(batch) == CHUNK_BATCH_SIZE:
+                    SecretBlobChunk.objects.bulk_create(batch)
+                    batch = []
+
+            SecretBlobChunk.objects.bulk_create(batch)
+    except IntegrityError:
+        # the same contents were stored by a concurrent upload
+        return _add_blob_reference(encryptor.sha256)
+
+    return blob
+
+
+def store_file(secret, file_name, content_type, spool):
+    """Save the contents of a finished `EncryptedSpool` as a new `SecretFile`"""
+    from .models import SecretFile
+
+    encryptor = spool.encryptor
+
+    with transaction.atomic():
+        return SecretFile.objects.create(
+            secret=secret,
+            file_name=file_name,
+            content_type=content_type,
+            size=encryptor.size,
+            sha256=encryptor.sha256,
+            blob=_get_or_create_blob(spool),
+        )
+
+
+def save_uploaded_file(secret, uploaded_file):
+    """Store a file received through `EncryptingUploadHandler` as a `SecretFile`"""
+    return store_file(
+        secret,
+        uploaded_file.name,
+        guess_content_type(uploaded_file.name, uploaded_file.content_type),
+        uploaded_file.spool,
+    )
+
+
+def _spool(fileobj):
+    spool = EncryptedSpool()
+
+    while data := fileobj.read(spool.encryptor.chunk_size):
+        spool.write(data)
+
+    spool.finish()
+    return spool
+
+
+def save_file(secret, file_name, fileobj, content_type=None):
+    """Encrypt and store the contents of the binary file object `fileobj` as a `SecretFile`"""
+    return store_file(
+        secret, file_name, content_type or guess_content_type(file_name), _spool(fileobj)
+    )
+
+
+def delete_secret_file(secret_file):
+    """Delete `secret_file`, and its blob if no other file uses it"""
+    from .models import SecretBlob
+
+    with transaction.atomic():
+        blob_id = secret_file.blob_id
+        secret_file.delete()
+
+        if blob_id is None:
+            return
+
+        blob = SecretBlob.objects.select_for_update().get(pk=blob_id)
+
+        if blob.ref_count <= 1:
+            blob.delete()
+        else:
+            blob.ref_count = F("ref_count") - 1
+            blob.save(update_fields=["ref_count"])
+
+
+def parse_range(header, size):
+    """
+    The `(start, end)` byte range, `end` exclusive, asked for by a `Range` header, or None if the
+    whole file should be sent: for a header that is malformed or asks for several ranges.
+    """
+    match = RANGE_RE.match(header.strip())
+
+    if not match or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        # the last `last` bytes
+        if not int(last) or not size:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size
+
+    start = int(first)
+
+    if last and int(last) < start:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable
+
+    return start, min(int(last) + 1, size) if last else size
+
+
+def _iter_legacy_file(secret_file, start, end, block_size):
+    data = io.BytesIO(bytes(secret_file.file_data or b"")[start:end])
+
+    while block := data.read(block_size):
+        yield block
+
+
+def _decompress(data, chunk_size):
+    decompressor = zlib.decompressobj()
+    plaintext = decompressor.decompress(data, chunk_size)
+
+    # a chunk never holds more than `chunk_size` bytes of plaintext
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise FileIntegrityError("A chunk decompresses to more than a chunk's worth of data")
+
+    return plaintext
+
+
+def iter_file(secret_file, start=0, end=None):
+    """
+    Yield the decrypted contents of `secret_file` a chunk at a time, from byte `start` to byte
+    `end` (exclusive; the end of the file by default). Only the chunks covering the range are read
+    and decrypted.
+    """
+    from .models import SecretBlob
+
+    if secret_file.blob_id is None:
+        yield from _iter_legacy_file(secret_file, start, end, settings.SECRET_FILE_CHUNK_SIZE)
+        return
+
+    blob = SecretBlob.objects.with_encrypted().get(pk=secret_file.blob_id)
+
+    size, chunk_size = blob.size, blob.chunk_size
+    end = size if end is None else min(end, size)
+
+    # an empty file still has its one empty chunk checked
+    if start >= end and size:
+        return
+
+    aead = AESGCM(bytes(blob.encryption_key))
+    count = chunk_count(size, chunk_size)
+    first, last = start // chunk_size, max(end - 1, 0) // chunk_size
+    expected = first
+
+    chunks = (
+        blob.chunks.filter(index__gte=first, index__lte=last)
+        .order_by("index")
+        .values_list("index", "data")
+    )
+
+    for index, data in chunks.iterator(chunk_size=CHUNK_BATCH_SIZE):
+        if index != expected or index >= count:
+            raise FileIntegrityError(f"Unexpected chunk {index} in blob {blob.pk}")
+
+        try:
+            plaintext = aead.decrypt(
+                chunk_nonce(blob.nonce_prefix, index, last=index == count - 1),
+                bytes(data),
+                None,
+            )
+        except InvalidTag:
+            raise FileIntegrityError(f"Chunk {index} of blob {blob.pk} failed to decrypt")
+
+        if blob.compression == COMPRESSION:
+            plaintext = _decompress(plaintext, chunk_size)
+
+        chunk_start = index * chunk_size
+        lower, upper = max(start - chunk_start, 0), end - chunk_start
+        yield plaintext[lower:upper]
+
+        expected += 1
+
+    if expected != last + 1:
+        raise FileIntegrityError(f"Blob {blob.pk} is missing chunks")
+
+
+class _ZipStream:
+    """A write-only file for `zipfile` that hands back whatever has been written since last asked"""
+
+    def __init__(self):
+        self.buffer = []
+
+    def write(self, data):
+        self.buffer.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.buffer)
+        self.buffer = []
+        return data
+
+
+def _zip_names(secret_files):
+    """Each file's name in the archive, numbered where several files share a name"""
+    seen = set()
+
+    for secret_file in secret_files:
+        name = os.path.basename(secret_file.file_name) or "file"
+        stem, extension = os.path.splitext(name)
+        number = 1
+
+        while name in seen:
+            number += 1
+            name = f"{stem} ({number}){extension}"
+
+        seen.add(name)
+        yield name
+
+
+def iter_zip(secret_files):
+    """
+    Yield a ZIP archive of `secret_files`, decrypting and compressing one chunk at a time. Files
+    still stored in `file_data` have their contents loaded one by one as they are reached.
+    """
+    from .models import SecretFile
+
+    secret_files = list(secret_files)
+    stream = _ZipStream()
+
+    # the stream cannot seek, so each entry's sizes and checksum follow its data
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for secret_file, name in zip(secret_files, _zip_names(secret_files)):
+            if secret_file.blob_id is None:
+                secret_file = SecretFile.objects.with_encrypted().get(pk=secret_file.pk)
+
+            created = timezone.localtime(secret_file.created)
+            info = zipfile.ZipInfo(name, date_time=created.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # lets zipfile decide up front whether the entry needs ZIP64 sizes
+            info.file_size = secret_file.size
+
+            with archive.open(info, mode="w") as entry:
+                for data in iter_file(secret_file):
+                    entry.write(data)
+
+                    if stream.buffer:
+                        yield stream.take()
+
+            yield stream.take()
+
+    # the central directory
+    yield stream.take()
+
+
+def convert_legacy_file(secret_file):
+    """Move a file stored whole in `file_data` into a blob, in place"""
+    spool = _spool(io.BytesIO(bytes(secret_file.file_data or b"")))
+    encryptor = spool.encryptor
+
+    with transaction.atomic():
+        secret_file.blob = _get_or_create_blob(spool)
+        secret_file.size = encryptor.size
+        secret_file.sha256 = encryptor.sha256
+        secret_file.content_type = secret_file.content_type or guess_content_type(
+            secret_file.file_name
+        )
+        secret_file.file_data = None
+        secret_file.save(update_fields=["blob", "size", "sha256", "content_type", "file_data"])
+
+
+def collect_garbage():
+    """
+    Correct every blob's `ref_count` from the files actually pointing at it, and delete the blobs
+    no file uses, e.g. after a secret was deleted outright. Returns the number deleted.
+    """
+    from .models import SecretBlob, SecretFile
+
+    deleted = 0
+
+    with transaction.atomic():
+        # locked first, so no upload can take a reference to a blob while it is being deleted
+        blobs = list(SecretBlob.objects.select_for_update().values_list("pk", "ref_count"))
+        references = dict(
+            SecretFile.objects.filter(blob__isnull=False)
+            .values("blob")
+            .annotate(files=Count("pk"))
+            .values_list("blob", "files")
+        )
+
+        for blob_id, ref_count in blobs:
+            if blob_id not in references:
+                SecretBlob.objects.filter(pk=blob_id).delete()
+                deleted += 1
+            elif references[blob_id] != ref_count:
+                SecretBlob.objects.filter(pk=blob_id).update(ref_count=references[blob_id])
+
+    return deleted
@@ -5,12 +5,13 @@ import django_filters
 from guardian.shortcuts import get_objects_for_group, get_objects_for_user
 
 from .models import Secret
+from .search import search_secrets
 
 
 class SecretFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(lookup_expr="icontains", distinct=True)
-    group = django_filters.CharFilter(method="filter_by_group", distinct=True)
-    me = django_filters.CharFilter(method="shared_directly", distinct=True)
+    name = django_filters.CharFilter(method="search")
+    group = django_filters.CharFilter(method="filter_by_group")
+    me = django_filters.CharFilter(method="shared_directly")
 
     o = django_filters.OrderingFilter(
         fields=(
@@ -24,6 +25,9 @@ class SecretFilter(django_filters.FilterSet):
         },
     )
 
+    def search(self, queryset, name, value):
+        return search_secrets(queryset, value)
+
     def shared_directly(self, queryset, name, value):
         return get_objects_for_user(
             self.request.user,
@@ -54,12 +58,8 @@ class SecretFilter(django_filters.FilterSet):
         if self.request.user.is_superuser:
             return parent
         else:
-            return get_objects_for_user(
-                self.request.user,
-                ["view_secret", "change_secret"],
-                parent,
-                any_perm=True,
-            )
+            # SecretAccess is unique on (user, secret), so the join cannot duplicate rows
+            return parent.filter(effective_access__user=self.request.user)
 
     class Meta:
         model = Secret
@@ -0,0 +1,410 @@
+"""
+Importing secrets in bulk from other password managers' exports.
+
+`parse` reads an export a row or an element at a time and yields each entry as a dict of `Secret`
+field values, and `SecretImporter` saves them a batch at a time, so memory use does not grow with
+the size of the export. The formats are:
+
+- "csv": a header row then one entry per row, as most password managers export. Columns are
+  matched by name, e.g. "title" or "name" and "login_uri" or "url"; see `CSV_COLUMNS`.
+- "keepass": KeePass 2 XML. Entries in the recycle bin, and the history of each entry, are skipped.
+  It is read with defusedxml, which turns away entity declarations and external references.
+- "1pif": the 1Password Interchange Format, one JSON object per item. Trashed items are skipped.
+
+Values a secret has no field for are added to its details as "<label>: <value>" lines. A TOTP
+value, either an otpauth:// URI or a base32 secret, becomes the secret's MFA string.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+
+from django.contrib.auth.models import Permission
+from django.db import transaction
+
+import defusedxml.ElementTree as ElementTree
+import pyotp
+
+from audit.models import Actions, Audit, create_audit_event
+from .access import CHANGE_PERMISSION, VIEW_PERMISSION, refresh_access
+from .bulk import EncryptionPool, chunks
+from .models import Secret, SecretGroupObjectPermission, SecretUserObjectPermission
+
+DEFAULT_BATCH_SIZE = 1000
+
+# lower case column name: the secret field it fills
+CSV_COLUMNS = {
+    "name": "name",
+    "title": "name",
+    "account": "name",
+    "url": "url",
+    "website": "url",
+    "web site": "url",
+    "login_uri": "url",
+    "login url": "url",
+    "username": "username",
+    "user name": "username",
+    "login": "username",
+    "login name": "username",
+    "login_username": "username",
+    "password": "password",
+    "login_password": "password",
+    "notes": "details",
+    "note": "details",
+    "details": "details",
+    "comments": "details",
+    "extra": "details",
+    "totp": "mfa_string",
+    "otp": "mfa_string",
+    "otpauth": "mfa_string",
+    "login_totp": "mfa_string",
+    "one-time password": "mfa_string",
+}
+# columns about the export rather than the entry, which are left out of the details
+CSV_IGNORED_COLUMNS = {"type", "favorite", "fav", "reprompt"}
+
+KEEPASS_ALGORITHMS = {
+    "HMAC-SHA-1": hashlib.sha1,
+    "HMAC-SHA-256": hashlib.sha256,
+    "HMAC-SHA-512": hashlib.sha512,
+}
+
+
+class InvalidExport(Exception):
+    pass
+
+
+def totp_uri(value, name, **kwargs):
+    """An otpauth:// URI for a TOTP value that may be a bare base32 secret"""
+    value = value.strip()
+
+    if not value or value.startswith("otpauth://"):
+        return value
+
+    return pyotp.TOTP(value.replace(" ", "").upper(), **kwargs).provisioning_uri(name=name)
+
+
+def _entry(name="", url="", username="", password="", details="", mfa_string="", extra=()):
+    """An entry's `Secret` field values, with the `extra` (label, value) pairs in its details"""
+    lines = [f"{label}: {value}" for label, value in extra if value not in (None, "")]
+
+    if lines:
+        details = "\n".join([details, "", *lines] if details else lines)
+
+    return {
+        "name": name or "",
+        "url": url or "",
+        "username": username or "",
+        "password": password or "",
+        "details": details or "",
+        "mfa_string": mfa_string or "",
+    }
+
+
+def parse_csv(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    header = next(reader, [])
+    labels = [label.strip().lower() for label in header]
+
+    for row in reader:
+        values, extra = {}, []
+
+        for label, value in zip(labels, row):
+            field = CSV_COLUMNS.get(label)
+
+            if field and field not in values:
+                values[field] = value
+            elif label not in CSV_IGNORED_COLUMNS:
+                extra.append((label, value))
+
+        yield _entry(**values, extra=extra)
+
+
+def _keepass_entry(element):
+    strings = {
+        string.findtext("Key"): string.findtext("Value") or ""
+        for string in element.findall("String")
+    }
+    name = strings.pop("Title", "")
+    mfa_string = strings.pop("otp", "")
+
+    # KeePass's own TOTP settings
+    base32 = strings.pop("TimeOtp-Secret-Base32", "")
+    digits = strings.pop("TimeOtp-Length", "") or 6
+    interval = strings.pop("TimeOtp-Period", "") or 30
+    algorithm = strings.pop("TimeOtp-Algorithm", "")
+
+    if base32 and not mfa_string:
+        mfa_string = totp_uri(
+            base32,
+            name,
+            digits=int(digits),
+            interval=int(interval),
+            digest=KEEPASS_ALGORITHMS.get(algorithm, hashlib.sha1),
+        )
+
+    return _entry(
+        name=name,
+        url=strings.pop("URL", ""),
+        username=strings.pop("UserName", ""),
+        password=strings.pop("Password", ""),
+        details=strings.pop("Notes", ""),
+        mfa_string=mfa_string,
+        extra=sorted(strings.items()),
+    )
+
+
+def parse_keepass(stream):
+    # the elements being read, outermost first, and the UUIDs of the groups among them
+    elements, groups = [], []
+    recycle_bin = None
+
+    for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            elements.append(element)
+
+            if element.tag == "Group":
+                groups.append(None)
+
+            continue
+
+        elements.pop()
+        parent = elements[-1].tag if elements else None
+
+        if (element.tag, parent) == ("RecycleBinUUID", "Meta"):
+            recycle_bin = element.text
+        elif (element.tag, parent) == ("UUID", "Group"):
+            # a group's UUID comes before its entries
+            groups[-1] = element.text
+        elif element.tag == "Group":
+            groups.pop()
+        elif element.tag == "Entry" and parent != "History":
+            if recycle_bin not in groups:
+                yield _keepass_entry(element)
+        elif parent != "Meta":
+            # part of an entry, which is let go of once the entry has been read
+            continue
+
+        # let go of what has been read, e.g. attachments in the metadata
+        elements[-1].remove(element)
+
+
+def _1pif_entry(item):
+    contents = item.get("secureContents") or {}
+    fields = {
+        field["designation"]: field.get("value", "")
+        for field in contents.get("fields") or []
+        if field.get("designation")
+    }
+    urls = contents.get("URLs") or []
+    mfa_string, extra = "", []
+
+    for section in contents.get("sections") or []:
+        for field in section.get("fields") or []:
+            value = field.get("v", "")
+
+            if not mfa_string and (
+                field.get("n", "").startswith("TOTP_") or str(value).startswith("otpauth://")
+            ):
+                mfa_string = value
+            else:
+                extra.append((field.get("t") or field.get("n", ""), value))
+
+    return _entry(
+        name=item.get("title"),
+        url=item.get("location") or (urls[0].get("url") if urls else ""),
+        username=fields.get("username"),
+        password=fields.get("password") or contents.get("password"),
+        details=contents.get("notesPlain"),
+        mfa_string=mfa_string,
+        extra=extra,
+    )
+
+
+def parse_1pif(stream):
+    for line in io.TextIOWrapper(stream, encoding="utf-8"):
+        line = line.strip()
+
+        # items are separated by "***<uuid>***" lines
+        if not line or line.startswith("***"):
+            continue
+
+        item = json.loads(line)
+
+        # folders, saved searches and the like
+        if item.get("trashed") or item.get("typeName", "").startswith("system."):
+            continue
+
+        yield _1pif_entry(item)
+
+
+FORMATS = {"csv": parse_csv, "keepass": parse_keepass, "1pif": parse_1pif}
+
+FORMAT_CHOICES = (
+    ("csv", "CSV"),
+    ("keepass", "KeePass 2 XML"),
+    ("1pif", "1Password Interchange Format"),
+)
+
+EXTENSIONS = {".csv": "csv", ".xml": "keepass", ".1pif": "1pif"}
+
+
+def guess_format(file_name):
+    """The format of an export named `file_name`, going by its extension, or None"""
+    return EXTENSIONS.get(os.path.splitext(file_name)[1].lower())
+
+
+def parse(export_format, stream):
+    """Yield the entries in an export, read from the binary `stream`, as `Secret` field values"""
+    try:
+        yield from FORMATS[export_format](stream)
+    except (csv.Error, ElementTree.ParseError, ValueError) as e:
+        # ValueError covers bad JSON, text that is not UTF-8 and XML that defusedxml refuses
+        raise InvalidExport(str(e)) from e
+
+
+def clean_entry(entry):
+    """The entry ready to save, or a ValueError saying why it cannot be"""
+    entry["name"] = entry["name"].strip() or entry["url"].strip() or entry["username"].strip()
+
+    if not entry["name"]:
+        raise ValueError("it has no name, URL or username")
+
+    for field in ("name", "url", "username", "password", "mfa_string"):
+        max_length = Secret._meta.get_field(field).max_length
+
+        if len(entry[field]) > max_length:
+            raise ValueError(f"its {field} is longer than {max_length} characters")
+
+    if entry["mfa_string"]:
+        try:
+            entry["mfa_string"] = totp_uri(entry["mfa_string"], entry["name"])
+            otp = pyotp.parse_uri(entry["mfa_string"])
+
+            # as `Secret.get_otp`, which only generates time based codes
+            if not isinstance(otp, pyotp.TOTP):
+                raise ValueError
+            otp.interval = int(otp.interval)
+            otp.now()
+        except ValueError:
+            raise ValueError("its TOTP value is not a valid otpauth:// URI or base32 secret")
+
+    return entry
+
+
+class SecretImporter:
+    """
+    Saves entries from `parse` as secrets, `batch_size` at a time. Each batch is saved in one
+    transaction with a single audit event summing it up.
+
+    `user` is recorded as the secrets' creator and can change them, as when a secret is created in
+    the UI; `change_groups` can change them and `view_groups` can view them. Entries that cannot be
+    saved are skipped and listed in `errors`, as (entry number, name, reason). A dry run checks
+    every entry and saves nothing.
+    """
+
+    def __init__(
+        self,
+        user,
+        source,
+        change_groups=(),
+        view_groups=(),
+        batch_size=DEFAULT_BATCH_SIZE,
+        dry_run=False,
+        workers=0,
+    ):
+        self.user = user
+        self.source = source
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.workers = workers
+
+        self.change_groups = list(change_groups)
+        self.view_groups = [group for group in view_groups if group not in self.change_groups]
+
+        self.imported = 0
+        self.batches = 0
+        self.errors = []
+
+    def run(self, entries, progress=None):
+        """Import `entries`, calling `progress(imported)` after each batch"""
+        permissions = {
+            permission.codename: permission
+            for permission in Permission.objects.filter(
+                content_type__app_label="secret", codename__in=[VIEW_PERMISSION, CHANGE_PERMISSION]
+            )
+        }
+        self.owner_permissions = [permissions[VIEW_PERMISSION], permissions[CHANGE_PERMISSION]]
+        # (group, permission) for every secret, with change implying view as it does for the owner
+        self.group_permissions = [
+            (group, permission)
+            for group in self.change_groups
+            for permission in self.owner_permissions
+        ] + [(group, permissions[VIEW_PERMISSION]) for group in self.view_groups]
+
+        # nothing is encrypted in a dry run
+        with EncryptionPool(0 if self.dry_run else self.workers) as self.encryption:
+            for batch in chunks(self.valid_entries(entries), self.batch_size):
+                self.import_batch(batch)
+
+                if progress:
+                    progress(self.imported)
+
+        return self
+
+    def valid_entries(self, entries):
+        for number, entry in enumerate(entries, 1):
+            try:
+                yield clean_entry(entry)
+            except ValueError as e:
+                self.errors.append((number, entry["name"], str(e)))
+
+    def summary(self, count):
+        shared = [f"{group.name} (change)" for group in self.change_groups] + [
+            f"{group.name} (view)" for group in self.view_groups
+        ]
+        description = f"Imported {count} secrets from {self.source}, batch {self.batches}"
+
+        if shared:
+            description += f", shared with {', '.join(shared)}"
+
+        return description[: Audit._meta.get_field("description").max_length]
+
+    @transaction.atomic
+    def import_batch(self, entries):
+        self.batches += 1
+        self.imported += len(entries)
+
+        if self.dry_run:
+            return
+
+        secrets = [Secret(created_by=self.user, **entry) for entry in entries]
+
+        self.encryption.encrypt(secrets)
+        Secret.objects.bulk_create(secrets)
+
+        SecretUserObjectPermission.objects.bulk_create(
+            [
+                SecretUserObjectPermission(
+                    user=self.user, permission=permission, content_object=secret
+                )
+                for secret in secrets
+                for permission in self.owner_permissions
+            ]
+        )
+        SecretGroupObjectPermission.objects.bulk_create(
+            [
+                SecretGroupObjectPermission(
+                    group=group, permission=permission, content_object=secret
+                )
+                for secret in secrets
+                for group, permission in self.group_permissions
+            ]
+        )
+
+        # bulk_create sends no post_save signals to do this row by row
+        refresh_access(secret_ids=[secret.pk for secret in secrets])
+
+        create_audit_event(self.user, Actions.imported, description=self.summary(len(secrets)))
@@ -0,0 +1,242 @@
+"""
+Keys and ciphertext formats for the encrypted model fields in `secret.fields`.
+
+Every stored value starts with a version byte naming the codec that wrote it:
+
+- `\\x01`, "aes-gcm": `\\x01 <4 byte key id> <12 byte nonce> <AES-256-GCM ciphertext and tag>`, over
+  the value's UTF-8 or raw bytes, with the version and key id as associated data. The key is
+  derived from the configured key with HKDF, and the key id says which configured key that was.
+- `\\x80`, "fernet": django_cryptography's format, a pickled value encrypted with AES-CBC and signed
+  with HMAC-SHA256 under `SECRET_KEY`. Values stored before the codec was configurable use it.
+
+Values are read in either format and written in `settings.SECRET_FIELD_CODEC`'s. A value in the old
+format moves to the new one whenever it is read and saved, and the `reencrypt` command rewrites the
+rest.
+
+Values are encrypted under `settings.CRYPTOGRAPHY_KEY` and `CRYPTOGRAPHY_SALT`. To rotate the key,
+add the current key and salt to `settings.CRYPTOGRAPHY_OLD_KEYS` and set new ones. Values still
+encrypted under an old key keep decrypting, and `reencrypt` rewrites them under the new key while
+the site stays up. Once it has finished, the old keys can be removed.
+
+The Fernet format does not record which key encrypted it, so for it the keys are tried in turn,
+current first. A key only counts as having decrypted a value if the padding and the pickle inside
+are both valid, and the pickle holds the field's type, str or bytes. Otherwise the value fails to
+decrypt, and `reencrypt` stops, rather than garbage being returned or rewritten under the new key.
+An old key may name the `secret_key` it was signed with; if `SECRET_KEY` is rotated as well, the
+signature alone tells old values from new ones, so give each old key its own where you can.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.encoding import force_bytes
+from django_cryptography.core.signing import FernetSigner, SignatureExpired
+from django_cryptography.fields import Expired
+from django_cryptography.utils.crypto import FernetBytes, InvalidToken
+
+# as django_cryptography derives `CRYPTOGRAPHY_KEY`
+KDF_ITERATIONS = 30000
+
+KEY_ID_SIZE = 4
+NONCE_SIZE = 12
+
+
+def derive_key(key, salt):
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(), length=32, salt=force_bytes(salt), iterations=KDF_ITERATIONS
+    )
+    return kdf.derive(force_bytes(key))
+
+
+def configured_keys():
+    """
+    The (encryption key, signing key) pairs values may be encrypted under, current first. They are
+    plain bytes, so they can be handed to another process.
+    """
+    keys = [(bytes(settings.CRYPTOGRAPHY_KEY), force_bytes(settings.SECRET_KEY))]
+
+    for old in settings.CRYPTOGRAPHY_OLD_KEYS:
+        keys.append(
+            (
+                derive_key(old["key"], old["salt"]),
+                force_bytes(old.get("secret_key") or settings.SECRET_KEY),
+            )
+        )
+
+    return tuple(keys)
+
+
+class Keyring:
+    """The configured keys, ready for each codec to use"""
+
+    def __init__(self, keys):
+        self.fernets = [FernetBytes(key, FernetSigner(signing_key)) for key, signing_key in keys]
+
+        # key id -> (index of the configured key, cipher)
+        self.aeads = {}
+
+        for index, (key, _) in enumerate(keys):
+            aead_key = HKDF(
+                algorithm=hashes.SHA256(), length=32, salt=None, info=b"passman field encryption"
+            ).derive(key)
+            key_id = hashlib.sha256(aead_key).digest()[:KEY_ID_SIZE]
+            self.aeads.setdefault(key_id, (index, AESGCM(aead_key)))
+
+        self.current_key_id = next(iter(self.aeads))
+
+
+class FernetCodec:
+    version = b"\x80"
+
+    def encrypt(self, keyring, value, binary):
+        return keyring.fernets[0].encrypt(pickle.dumps(value))
+
+    def decrypt(self, keyring, data, binary, ttl=None):
+        """Returns the value and the index of the key that decrypted it"""
+        error = None
+        value_type = bytes if binary else str
+
+        for index, fernet in enumerate(keyring.fernets):
+            try:
+                value = pickle.loads(fernet.decrypt(data, ttl))
+            except SignatureExpired:
+                return Expired, index
+            except Exception as e:
+                # a wrong key fails the signature or the padding, or very rarely yields garbage that
+                # does not unpickle
+                error = error or e
+                continue
+
+            # or, more rarely still, garbage that does unpickle, to something other than a value
+            if isinstance(value, value_type):
+                return value, index
+
+            error = error or InvalidToken(
+                f"Decrypted to a {type(value).__name__}, not {value_type.__name__}"
+            )
+
+        raise error
+
+
+class AESGCMCodec:
+    version = b"\x01"
+
+    def encrypt(self, keyring, value, binary):
+        plaintext = bytes(value) if binary else str(value).encode()
+        header = self.version + keyring.current_key_id
+        nonce = os.urandom(NONCE_SIZE)
+        _, aead = keyring.aeads[keyring.current_key_id]
+
+        return header + nonce + aead.encrypt(nonce, plaintext, header)
+
+    def decrypt(self, keyring, data, binary, ttl=None):
+        header_size = 1 + KEY_ID_SIZE
+        nonce_end = header_size + NONCE_SIZE
+        header, nonce, ciphertext = (
+            data[:header_size],
+            data[header_size:nonce_end],
+            data[nonce_end:],
+        )
+
+        try:
+            index, aead = keyring.aeads[header[1:]]
+        except KeyError:
+            raise InvalidToken("Encrypted under a key that is not configured")
+
+        try:
+            plaintext = aead.decrypt(nonce, ciphertext, header)
+        except InvalidTag:
+            raise InvalidToken("Failed to decrypt")
+
+        return (plaintext if binary else plaintext.decode()), index
+
+
+CODECS = {"fernet": FernetCodec(), "aes-gcm": AESGCMCodec()}
+
+_CODECS_BY_VERSION = {codec.version: codec for codec in CODECS.values()}
+
+
+def _codec_for(data):
+    try:
+        return _CODECS_BY_VERSION[data[:1]]
+    except KeyError:
+        raise InvalidToken("Unknown ciphertext format")
+
+
+@functools.lru_cache(maxsize=None)
+def _keyring(keys):
+    return Keyring(keys)
+
+
+@functools.lru_cache(maxsize=None)
+def _keys():
+    return configured_keys()
+
+
+@receiver(setting_changed)
+def _clear_keys(setting, **kwargs):
+    if setting in ("CRYPTOGRAPHY_KEY", "CRYPTOGRAPHY_OLD_KEYS", "SECRET_KEY"):
+        _keys.cache_clear()
+
+
+def decrypt(data, binary=False, ttl=None):
+    """Decrypt a value stored in any format, under any of the configured keys"""
+    data = bytes(data)
+    return _codec_for(data).decrypt(_keyring(_keys()), data, binary, ttl)[0]
+
+
+def encrypt(value, binary=False, codec=None):
+    """Encrypt a value under the current key, in `settings.SECRET_FIELD_CODEC`'s format by default"""
+    return CODECS[codec or settings.SECRET_FIELD_CODEC].encrypt(_keyring(_keys()), value, binary)
+
+
+def encrypt_values(values, binary, keys=None, codec=None):
+    """
+    Each of `values`, plaintext or None, encrypted under the current key and codec. `binary` says
+    which values are bytes rather than text. Runs in `secret.bulk.EncryptionPool`'s worker
+    processes, which are handed `keys` from `configured_keys()` and the codec's name.
+    """
+    keyring = _keyring(keys or _keys())
+    codec = CODECS[codec or settings.SECRET_FIELD_CODEC]
+
+    return [
+        None if value is None else codec.encrypt(keyring, value, is_binary)
+        for value, is_binary in zip(values, binary)
+    ]
+
+
+def reencrypt_values(values, binary, keys=None, codec=None):
+    """
+    Each of `values`, a list of ciphertexts or None, rewritten under the current key and codec, or
+    None where it already is. `binary` says which values hold bytes rather than text. Runs in the
+    `reencrypt` command's worker processes, which are handed `keys` from `configured_keys()` and
+    the codec's name.
+    """
+    keyring = _keyring(keys or _keys())
+    codec = CODECS[codec or settings.SECRET_FIELD_CODEC]
+    results = []
+
+    for data, is_binary in zip(values, binary):
+        if data is None:
+            results.append(None)
+            continue
+
+        stored_codec = _codec_for(data)
+        value, index = stored_codec.decrypt(keyring, data, is_binary)
+
+        if index == 0 and stored_codec is codec:
+            results.append(None)
+        else:
+            results.append(codec.encrypt(keyring, value, is_binary))
+
+    return results
@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from secret.bulk import EncryptionPool
+from secret.models import Secret
+
+
+def _secrets(count, size):
+    return [
+        Secret(name=f"secret {n}", password="p" * size, details="d" * size, mfa_string="m" * size)
+        for n in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time encrypting the fields of unsaved secrets in an EncryptionPool with different numbers "
+        "of worker processes, as the bulk imports do before bulk_create. Nothing is saved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument("--size", type=int, default=255, help="Characters in each field")
+        parser.add_argument(
+            "--workers",
+            default=f"0,{os.cpu_count()}",
+            help="Comma separated worker counts to compare; 0 encrypts in this process",
+        )
+
+    def handle(self, *args, **options):
+        rows, size = options["rows"], options["size"]
+        baseline = None
+
+        self.stdout.write(f"{'workers':>7} {'seconds':>8} {'rows/s':>9} {'speed-up':>9}")
+
+        for workers in [int(count) for count in options["workers"].split(",")]:
+            with EncryptionPool(workers) as pool:
+                # start the workers before the clock does
+                pool.encrypt(_secrets(max(workers, 1) * 4, size))
+
+                secrets = _secrets(rows, size)
+                started = time.perf_counter()
+                pool.encrypt(secrets)
+                elapsed = time.perf_counter() - started
+
+            baseline = baseline or elapsed
+            self.stdout.write(
+                f"{workers:>7} {elapsed:>8.2f} {rows / elapsed:>9.0f} {baseline / elapsed:>8.1f}x"
+            )
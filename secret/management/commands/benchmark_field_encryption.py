@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from secret.keys import CODECS, decrypt, encrypt
+
+
+def _time_per_call(function, iterations):
+    started = time.perf_counter()
+
+    for _ in range(iterations):
+        function()
+
+    return (time.perf_counter() - started) / iterations
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the cost and stored size of the encrypted field formats in secret.keys, for text "
+        "and binary values of a few sizes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=2000)
+        parser.add_argument(
+            "--sizes",
+            default="16,255,4096",
+            help="Comma separated value sizes, in characters or bytes",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        sizes = [int(size) for size in options["sizes"].split(",")]
+
+        self.stdout.write(
+            f"{'codec':<8} {'value':<12} {'encrypt µs':>11} {'decrypt µs':>11} {'stored bytes':>13}"
+        )
+
+        for binary in (False, True):
+            for size in sizes:
+                value = b"x" * size if binary else "x" * size
+                kind = f"{size} {'bytes' if binary else 'chars'}"
+
+                for name in CODECS:
+                    data = encrypt(value, binary=binary, codec=name)
+                    encrypt_time = _time_per_call(
+                        lambda: encrypt(value, binary=binary, codec=name), iterations
+                    )
+                    decrypt_time = _time_per_call(lambda: decrypt(data, binary=binary), iterations)
+
+                    self.stdout.write(
+                        f"{name:<8} {kind:<12} {encrypt_time * 1e6:>11.1f} "
+                        f"{decrypt_time * 1e6:>11.1f} {len(data):>13}"
+                    )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from secret.files import convert_legacy_file
+from secret.models import SecretFile
+
+
+class Command(BaseCommand):
+    help = (
+        "Move attachments stored whole in SecretFile.file_data into compressed, chunked AES-GCM blobs. "
+        "Each file is converted in its own transaction, so the command can be stopped and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report how many files need converting"
+        )
+
+    def handle(self, *args, **options):
+        legacy = SecretFile.objects.filter(blob__isnull=True).order_by("pk")
+
+        if options["dry_run"]:
+            self.stdout.write(f"{legacy.count()} files to convert.")
+            return
+
+        converted = 0
+
+        # one file's contents in memory at a time
+        for pk in legacy.values_list("pk", flat=True):
+            convert_legacy_file(SecretFile.objects.with_encrypted().get(pk=pk))
+            converted += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {converted} files converted."))
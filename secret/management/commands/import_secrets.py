@@ -0,0 +1,108 @@
+import time
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+
+from secret.imports import (
+    DEFAULT_BATCH_SIZE,
+    FORMATS,
+    InvalidExport,
+    SecretImporter,
+    guess_format,
+    parse,
+)
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Import secrets from a CSV, KeePass 2 XML or 1Password (.1pif) export, a batch at a time. "
+        "Run it with --dry-run first: entries that cannot be imported are skipped and listed, and "
+        "running it again imports everything again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file")
+        parser.add_argument(
+            "--format", choices=list(FORMATS), help="By default, going by the file's extension"
+        )
+        parser.add_argument(
+            "--user", required=True, help="Email of the user the secrets are created by"
+        )
+        parser.add_argument(
+            "--change-group",
+            action="append",
+            default=[],
+            help="A group that can change the secrets; repeatable",
+        )
+        parser.add_argument(
+            "--view-group",
+            action="append",
+            default=[],
+            help="A group that can view the secrets; repeatable",
+        )
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Processes to encrypt secrets in, by default none, in this process",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Check every entry without saving any"
+        )
+
+    def get_groups(self, names):
+        groups = {group.name: group for group in Group.objects.filter(name__in=names)}
+        unknown = [name for name in names if name not in groups]
+
+        if unknown:
+            raise CommandError(f"No group called {', '.join(unknown)}")
+
+        return [groups[name] for name in names]
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with the email {options['user']}")
+
+        export_format = options["format"] or guess_format(options["file"])
+
+        if not export_format:
+            raise CommandError(f"Pass --format, as it cannot be told from {options['file']}")
+
+        importer = SecretImporter(
+            user,
+            options["file"],
+            change_groups=self.get_groups(options["change_group"]),
+            view_groups=self.get_groups(options["view_group"]),
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            workers=options["workers"],
+        )
+        started = time.monotonic()
+
+        def progress(imported):
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"{imported} secrets ({imported / elapsed if elapsed else 0:.0f}/s)")
+
+        with open(options["file"], "rb") as stream:
+            try:
+                importer.run(parse(export_format, stream), progress)
+            except InvalidExport as e:
+                raise CommandError(
+                    f"{options['file']} could not be read after {importer.imported} entries, "
+                    f"which {'would have been' if importer.dry_run else 'were'} imported: {e}"
+                )
+
+        for number, name, reason in importer.errors:
+            self.stdout.write(self.style.WARNING(f"Entry {number} ({name}) skipped: {reason}"))
+
+        verb = "would be" if importer.dry_run else "were"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done. {importer.imported} secrets {verb} imported in {importer.batches} batches, "
+                f"{len(importer.errors)} skipped."
+            )
+        )
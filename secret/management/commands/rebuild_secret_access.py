@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from secret.access import diff_access, refresh_access
+from secret.models import Secret
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the effective access table used by the secret list from the guardian "
+        "user and group object permissions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report rows that are out of sync; do not update the database",
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="Secrets per batch")
+
+    def secret_id_batches(self, batch_size):
+        secret_ids = list(Secret.objects.order_by("pk").values_list("pk", flat=True))
+
+        for start in range(0, len(secret_ids), batch_size):
+            end = start + batch_size
+            yield secret_ids[start:end]
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            self.verify(options["batch_size"])
+            return
+
+        updated = 0
+
+        for secret_ids in self.secret_id_batches(options["batch_size"]):
+            updated += refresh_access(secret_ids=secret_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {updated} access rows updated."))
+
+    def verify(self, batch_size):
+        missing = changed = stale = 0
+
+        for secret_ids in self.secret_id_batches(batch_size):
+            batch_missing, batch_changed, batch_stale = diff_access(secret_ids=secret_ids)
+
+            missing += len(batch_missing)
+            changed += len(batch_changed)
+            stale += len(batch_stale)
+
+        if missing or changed or stale:
+            raise CommandError(
+                f"Access table out of sync: {missing} missing, {changed} with the wrong "
+                f"permission, {stale} stale. Run without --verify to fix."
+            )
+
+        self.stdout.write(self.style.SUCCESS("Access table is in sync."))
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models import Value
+
+from secret.bulk import map_rows, process_pool
+from secret.fields import Ciphertext, encrypted_field_names
+from secret.keys import configured_keys, reencrypt_values
+
+DEFAULT_CHECKPOINT = ".reencrypt-checkpoint.json"
+
+
+def encrypted_models():
+    return [model for model in apps.get_models() if encrypted_field_names(model)]
+
+
+def checkpoint_target(keys, codec):
+    """
+    What a run re-encrypts to, the codec and a hash of the current keys, saved with its checkpoint
+    so that one left before the next key rotation is not resumed
+    """
+    key, signing_key = keys[0]
+    return f"{codec}:{hashlib.sha256(key + signing_key).hexdigest()[:16]}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encrypt every encrypted field under the current CRYPTOGRAPHY_KEY and in the "
+        "SECRET_FIELD_CODEC format, while the site stays up, so the keys in CRYPTOGRAPHY_OLD_KEYS "
+        "and the old format can be retired. Rows are locked and rewritten "
+        "in primary key order a batch at a time, with progress saved after each batch; run it "
+        "again after an interruption to carry on."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Processes to decrypt and encrypt in; 0 to do it in this process",
+        )
+        parser.add_argument(
+            "--rows-per-second", type=float, help="Slow down to at most this many rows a second"
+        )
+        parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+        parser.add_argument(
+            "--restart", action="store_true", help="Ignore any checkpoint and start from the top"
+        )
+        parser.add_argument(
+            "--model", action="append", help="Only this model, e.g. secret.Secret; repeatable"
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.rows_per_second = options["rows_per_second"]
+        self.checkpoint_path = options["checkpoint"]
+        self.keys = configured_keys()
+        self.codec = settings.SECRET_FIELD_CODEC
+
+        models = encrypted_models()
+
+        if options["model"]:
+            labels = {model._meta.label_lower: model for model in models}
+            unknown = [label for label in options["model"] if label.lower() not in labels]
+
+            if unknown:
+                raise CommandError(f"No encrypted fields on {', '.join(unknown)}")
+
+            models = [labels[label.lower()] for label in options["model"]]
+
+        self.target = checkpoint_target(self.keys, self.codec)
+        self.checkpoint = {} if options["restart"] else self.load_checkpoint()
+        self.checkpoint["target"] = self.target
+
+        self.workers = options["workers"]
+        self.pool = process_pool(self.workers)
+
+        try:
+            for model in models:
+                self.reencrypt_model(model)
+        finally:
+            if self.pool:
+                self.pool.shutdown()
+
+        # kept after a run over some models, so a later run can skip them
+        if not options["model"] and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        self.stdout.write(
+            self.style.SUCCESS("Done. Every value is encrypted under the current key and format.")
+        )
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as checkpoint:
+                progress = json.load(checkpoint)
+        except FileNotFoundError:
+            return {}
+
+        if progress.get("target") != self.target:
+            self.stdout.write(
+                f"Ignoring {self.checkpoint_path}, which was saved for another key or format"
+            )
+            return {}
+
+        self.stdout.write(f"Resuming from {self.checkpoint_path}")
+        return progress
+
+    def save_checkpoint(self):
+        partial_path = f"{self.checkpoint_path}.partial"
+
+        with open(partial_path, "w", encoding="utf-8") as checkpoint:
+            json.dump(self.checkpoint, checkpoint)
+
+        os.replace(partial_path, self.checkpoint_path)
+
+    def reencrypt_rows(self, rows, binary):
+        """The values in `rows` encrypted under the current key, split across the workers"""
+        return map_rows(
+            self.pool, self.workers, reencrypt_values, rows, binary, self.keys, self.codec
+        )
+
+    def reencrypt_batch(self, model, fields, last_pk):
+        """Rewrite the next batch after `last_pk`, returning its last pk and row counts"""
+        queryset = model._base_manager.order_by("pk")
+
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+
+        with transaction.atomic():
+            # locked so that a concurrent save cannot be overwritten with the value read here
+            rows = list(queryset.select_for_update().values_list("pk", *fields)[: self.batch_size])
+
+            if not rows:
+                return None, 0, 0
+
+            binary = [
+                isinstance(model._meta.get_field(field), models.BinaryField) for field in fields
+            ]
+            results = self.reencrypt_rows(
+                [[value.data if value else None for value in row[1:]] for row in rows], binary
+            )
+
+            updated = []
+            for row, values in zip(rows, results):
+                if not any(values):
+                    continue
+
+                instance = model(pk=row[0])
+                for field, old, new in zip(fields, row[1:], values):
+                    # written as the ciphertext given, not decrypted and encrypted again on save
+                    value = Ciphertext(new) if new else old
+                    setattr(
+                        instance, field, Value(value, output_field=model._meta.get_field(field))
+                    )
+                updated.append(instance)
+
+            model._base_manager.bulk_update(updated, fields)
+
+        return rows[-1][0], len(rows), len(updated)
+
+    def reencrypt_model(self, model):
+        label = model._meta.label
+        fields = encrypted_field_names(model)
+        progress = self.checkpoint.setdefault(label, {"last_pk": None, "rows": 0, "rewritten": 0})
+
+        if progress.get("done"):
+            self.stdout.write(f"{label}: already done")
+            return
+
+        started = time.monotonic()
+        rows = 0
+
+        while True:
+            batch_started = time.monotonic()
+            last_pk, batch_rows, batch_rewritten = self.reencrypt_batch(
+                model, fields, progress["last_pk"]
+            )
+
+            if last_pk is None:
+                break
+
+            rows += batch_rows
+            progress.update(
+                last_pk=str(last_pk),
+                rows=progress["rows"] + batch_rows,
+                rewritten=progress["rewritten"] + batch_rewritten,
+            )
+            self.save_checkpoint()
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{label}: {progress['rows']} rows, {progress['rewritten']} rewritten, "
+                f"{rows / elapsed if elapsed else 0:.0f} rows/s"
+            )
+
+            if self.rows_per_second:
+                pause = batch_rows / self.rows_per_second - (time.monotonic() - batch_started)
+                if pause > 0:
+                    time.sleep(pause)
+
+        progress["done"] = True
+        self.save_checkpoint()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{label}: done, {progress['rows']} rows checked, {progress['rewritten']} rewritten; "
+            f"{rows} rows in {elapsed:.1f}s this run"
+        )
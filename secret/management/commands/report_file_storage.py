@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.template.defaultfilters import filesizeformat
+
+from secret.files import collect_garbage
+from secret.models import SecretBlob, SecretFile
+
+
+class Command(BaseCommand):
+    help = (
+        "Report how much space attachment deduplication and compression save, optionally "
+        "deleting blobs no file uses any more"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--collect-garbage",
+            action="store_true",
+            help="Correct blob reference counts and delete unreferenced blobs first",
+        )
+
+    def handle(self, *args, **options):
+        if options["collect_garbage"]:
+            self.stdout.write(f"Deleted {collect_garbage()} unreferenced blobs.")
+
+        files = SecretFile.objects.filter(blob__isnull=False).aggregate(
+            count=Count("pk"), size=Sum("size")
+        )
+        blobs = SecretBlob.objects.aggregate(
+            count=Count("pk"), size=Sum("size"), stored_size=Sum("stored_size")
+        )
+        legacy = SecretFile.objects.filter(blob__isnull=True).count()
+
+        file_size = files["size"] or 0
+        blob_size = blobs["size"] or 0
+        stored_size = blobs["stored_size"] or 0
+
+        rows = [
+            ("Files", files["count"]),
+            ("Distinct contents (blobs)", blobs["count"]),
+            ("Size of files", filesizeformat(file_size)),
+            ("Saved by deduplication", filesizeformat(file_size - blob_size)),
+            ("Saved by compression", filesizeformat(blob_size - stored_size)),
+            ("Stored", filesizeformat(stored_size)),
+        ]
+
+        if file_size:
+            rows.append(("Space saved", f"{100 * (file_size - stored_size) / file_size:.1f}%"))
+
+        if legacy:
+            rows.append(("Files not yet converted", f"{legacy} (run convert_secret_files)"))
+
+        width = max(len(label) for label, _ in rows)
+
+        for label, value in rows:
+            self.stdout.write(f"{label.ljust(width)}  {value}")
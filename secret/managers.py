@@ -0,0 +1,19 @@
+from django.db import models
+
+from .fields import encrypted_field_names
+
+
+class EncryptedFieldsQuerySet(models.QuerySet):
+    def with_encrypted(self):
+        """Load the encrypted columns along with the rest of each row"""
+        return self.defer(None)
+
+
+class EncryptedFieldsManager(models.Manager.from_queryset(EncryptedFieldsQuerySet)):
+    """
+    Leaves a model's encrypted columns out of its queries unless `with_encrypted()` is asked for;
+    reading a deferred field on an instance still fetches it.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer(*encrypted_field_names(self.model))
@@ -0,0 +1,22 @@
+import logging
+
+from .fields import start_decryption_count
+
+
+logger = logging.getLogger(__name__)
+
+
+class DecryptionCountMiddleware:
+    """Logs how many encrypted values each request decrypted"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = start_decryption_count()
+
+        response = self.get_response(request)
+
+        logger.info("%s %s decrypted %d values", request.method, request.path, counter.count)
+
+        return response
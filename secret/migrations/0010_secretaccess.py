@@ -0,0 +1,61 @@
+# Generated by Django 4.2.18 on 2026-10-18 05:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_secret_access(apps, schema_editor):
+    SecretAccess = apps.get_model("secret", "SecretAccess")
+    SecretUserObjectPermission = apps.get_model("secret", "SecretUserObjectPermission")
+    SecretGroupObjectPermission = apps.get_model("secret", "SecretGroupObjectPermission")
+
+    perms = ("view_secret", "change_secret")
+    access = {}
+
+    rows = list(
+        SecretUserObjectPermission.objects.filter(
+            user__is_active=True, permission__codename__in=perms
+        ).values_list("user_id", "content_object_id", "permission__codename")
+    ) + list(
+        SecretGroupObjectPermission.objects.filter(
+            group__user__is_active=True, permission__codename__in=perms
+        ).values_list("group__user", "content_object_id", "permission__codename")
+    )
+
+    for user_id, secret_id, codename in rows:
+        if access.get((user_id, secret_id)) != "change_secret":
+            access[(user_id, secret_id)] = codename
+
+    SecretAccess.objects.bulk_create(
+        [
+            SecretAccess(user_id=user_id, secret_id=secret_id, permission=permission)
+            for (user_id, secret_id), permission in access.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('secret', '0009_add_file_model'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecretAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(choices=[('view_secret', 'View'), ('change_secret', 'Change')], max_length=20)),
+                ('secret', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_access', to='secret.secret')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='secret_access', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'secret access',
+                'unique_together': {('user', 'secret')},
+            },
+        ),
+        migrations.RunPython(populate_secret_access, migrations.RunPython.noop),
+    ]
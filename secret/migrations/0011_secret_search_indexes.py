@@ -0,0 +1,37 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_FIELDS = ("name", "url", "username")
+
+
+def create_search_indexes(apps, schema_editor):
+    # `icontains` compiles to UPPER(col::text) LIKE UPPER(%s) on Postgres, so the trigram indexes
+    # are built over that expression for the planner to use them.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS secret_secret_{field}_trgm "
+            f"ON secret_secret USING gin ((UPPER({field}::text)) gin_trgm_ops)"
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f"DROP INDEX IF EXISTS secret_secret_{field}_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secret", "0010_secretaccess"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secret", "0011_secret_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="secret",
+            index=models.Index(fields=["name", "id"], name="secret_secr_name_c656de_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="secret",
+            index=models.Index(fields=["url", "id"], name="secret_secr_url_7e97ed_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="secret",
+            index=models.Index(fields=["username", "id"], name="secret_secr_usernam_5e14ea_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="secret",
+            index=models.Index(
+                fields=["last_updated", "id"], name="secret_secr_last_up_6c7faf_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:05
+
+from django.db import migrations
+import secret.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secret", "0012_secret_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="secret",
+            name="details",
+            field=secret.fields.EncryptedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="secret",
+            name="mfa_string",
+            field=secret.fields.EncryptedCharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name="secret",
+            name="password",
+            field=secret.fields.EncryptedCharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name="secretfile",
+            name="file_data",
+            field=secret.fields.EncryptedBinaryField(null=True),
+        ),
+    ]
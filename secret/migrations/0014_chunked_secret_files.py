@@ -0,0 +1,61 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import secret.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secret", "0013_lazy_encrypted_fields"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SecretFileChunk",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("index", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="secretfile",
+            name="chunk_size",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="secretfile",
+            name="encryption_key",
+            field=secret.fields.EncryptedBinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="secretfile",
+            name="nonce_prefix",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="secretfile",
+            name="size",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="secretfilechunk",
+            name="file",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="secret.secretfile",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="secretfilechunk",
+            unique_together={("file", "index")},
+        ),
+    ]
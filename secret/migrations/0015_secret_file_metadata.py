@@ -0,0 +1,38 @@
+# Generated by Django 4.2.18 on 2026-10-18 06:26
+
+import mimetypes
+
+from django.db import migrations, models
+
+
+def guess_content_types(apps, schema_editor):
+    # from the file names only; sizes and hashes of older files are filled in as
+    # `convert_secret_files` moves them to chunks
+    SecretFile = apps.get_model("secret", "SecretFile")
+
+    for pk, file_name in SecretFile.objects.filter(content_type="").values_list("pk", "file_name"):
+        content_type, _ = mimetypes.guess_type(file_name)
+        SecretFile.objects.filter(pk=pk).update(
+            content_type=content_type or "application/octet-stream"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secret", "0014_chunked_secret_files"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="secretfile",
+            name="content_type",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="secretfile",
+            name="sha256",
+            field=models.CharField(blank=True, max_length=64, verbose_name="SHA-256"),
+        ),
+        migrations.RunPython(guess_content_types, migrations.RunPython.noop),
+    ]
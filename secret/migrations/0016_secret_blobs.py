@@ -0,0 +1,174 @@
+import hashlib
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import Length
+import django.db.models.deletion
+
+import secret.fields
+
+
+# copied from `secret.files` as it was when this migration was written, so that later changes to
+# the chunk layout there do not change how the migration reads existing chunks
+def chunk_nonce(nonce_prefix, index, last):
+    return bytes(nonce_prefix) + index.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+
+
+def chunk_count(size, chunk_size):
+    # an empty file is still stored as one (empty) last chunk
+    return max(-(-size // chunk_size), 1)
+
+
+def _plaintext_sha256(secret_file, chunks):
+    # files stored by the first chunked version of `secret.files` have no hash yet
+    aead = AESGCM(bytes(secret_file.encryption_key))
+    count = chunk_count(secret_file.size, secret_file.chunk_size)
+    sha256 = hashlib.sha256()
+
+    for index, data in chunks.order_by("index").values_list("index", "data").iterator():
+        nonce = chunk_nonce(secret_file.nonce_prefix, index, last=index == count - 1)
+        sha256.update(aead.decrypt(nonce, bytes(data), None))
+
+    return sha256.hexdigest()
+
+
+def move_chunks_to_blobs(apps, schema_editor):
+    """Give each distinct file contents a blob, keeping the first copy's (uncompressed) chunks"""
+    SecretBlob = apps.get_model("secret", "SecretBlob")
+    SecretFile = apps.get_model("secret", "SecretFile")
+    SecretFileChunk = apps.get_model("secret", "SecretFileChunk")
+
+    files = SecretFile.objects.filter(nonce_prefix__isnull=False).defer("file_data").order_by("pk")
+
+    for secret_file in files.iterator():
+        chunks = SecretFileChunk.objects.filter(file=secret_file)
+
+        if not secret_file.sha256:
+            secret_file.sha256 = _plaintext_sha256(secret_file, chunks)
+
+        blob = SecretBlob.objects.filter(sha256=secret_file.sha256).first()
+
+        if blob:
+            blob.ref_count += 1
+            blob.save(update_fields=["ref_count"])
+            chunks.delete()
+        else:
+            blob = SecretBlob.objects.create(
+                sha256=secret_file.sha256,
+                size=secret_file.size,
+                stored_size=chunks.aggregate(stored=Sum(Length("data")))["stored"] or 0,
+                chunk_size=secret_file.chunk_size,
+                compression="",
+                nonce_prefix=secret_file.nonce_prefix,
+                encryption_key=bytes(secret_file.encryption_key),
+                ref_count=1,
+            )
+            chunks.update(blob=blob)
+
+        secret_file.blob = blob
+        secret_file.save(update_fields=["blob", "sha256"])
+
+
+def backfill_legacy_files(apps, schema_editor):
+    """
+    Give files still stored whole in `file_data` the size and hash that downloads' ranges and
+    ETags, and ZIP archives, rely on, until `convert_secret_files` moves them to blobs
+    """
+    SecretFile = apps.get_model("secret", "SecretFile")
+
+    legacy = SecretFile.objects.filter(blob__isnull=True, file_data__isnull=False).filter(
+        models.Q(size=0) | models.Q(sha256="")
+    )
+
+    # one file's contents in memory at a time
+    for pk in legacy.order_by("pk").values_list("pk", flat=True):
+        secret_file = SecretFile.objects.get(pk=pk)
+        data = bytes(secret_file.file_data)
+        secret_file.size = len(data)
+        secret_file.sha256 = hashlib.sha256(data).hexdigest()
+        secret_file.save(update_fields=["size", "sha256"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secret", "0015_secret_file_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SecretBlob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True, verbose_name="SHA-256")),
+                ("size", models.BigIntegerField()),
+                ("stored_size", models.BigIntegerField(default=0)),
+                ("chunk_size", models.PositiveIntegerField()),
+                ("compression", models.CharField(blank=True, max_length=16)),
+                ("nonce_prefix", models.BinaryField()),
+                ("encryption_key", secret.fields.EncryptedBinaryField()),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="secretfilechunk",
+            name="blob",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="secret.secretblob",
+            ),
+        ),
+        migrations.AddField(
+            model_name="secretfile",
+            name="blob",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="files",
+                to="secret.secretblob",
+            ),
+        ),
+        # irreversible: unapplying would need each file's key, nonce and chunks back from its
+        # blob, and files sharing a blob would need copies of its chunks
+        migrations.RunPython(move_chunks_to_blobs),
+        migrations.RunPython(backfill_legacy_files),
+        migrations.AlterUniqueTogether(
+            name="secretfilechunk",
+            unique_together={("blob", "index")},
+        ),
+        migrations.RemoveField(
+            model_name="secretfilechunk",
+            name="file",
+        ),
+        migrations.AlterField(
+            model_name="secretfilechunk",
+            name="blob",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="secret.secretblob",
+            ),
+        ),
+        migrations.RenameModel("SecretFileChunk", "SecretBlobChunk"),
+        migrations.RemoveField(
+            model_name="secretfile",
+            name="chunk_size",
+        ),
+        migrations.RemoveField(
+            model_name="secretfile",
+            name="encryption_key",
+        ),
+        migrations.RemoveField(
+            model_name="secretfile",
+            name="nonce_prefix",
+        ),
+    ]
@@ -3,7 +3,6 @@ import uuid
 from django.db import models
 from django.urls import reverse
 
-from django_cryptography.fields import encrypt
 from guardian.models import UserObjectPermissionBase
 from guardian.models import GroupObjectPermissionBase
 from guardian.shortcuts import (
@@ -16,6 +15,8 @@ from guardian.shortcuts import (
 import pyotp
 
 from user.models import User
+from .fields import EncryptedBinaryField, EncryptedCharField, EncryptedTextField
+from .managers import EncryptedFieldsManager
 
 
 class Secret(models.Model):
@@ -32,10 +33,12 @@ class Secret(models.Model):
 
     url = models.URLField(blank=True)
     username = models.CharField(max_length=255, blank=True)
-    password = encrypt(models.CharField(max_length=255, blank=True))
-    details = encrypt(models.TextField(blank=True))
+    password = EncryptedCharField(max_length=255, blank=True)
+    details = EncryptedTextField(blank=True)
 
-    mfa_string = encrypt(models.CharField(max_length=255, blank=True))
+    mfa_string = EncryptedCharField(max_length=255, blank=True)
+
+    objects = EncryptedFieldsManager()
 
     @property
     def mfa_code(self):
@@ -44,6 +47,13 @@ class Secret(models.Model):
 
     class Meta:
         ordering = ("name",)
+        # keyset pagination of the secret list, one per sortable column
+        indexes = [
+            models.Index(fields=["name", "id"]),
+            models.Index(fields=["url", "id"]),
+            models.Index(fields=["username", "id"]),
+            models.Index(fields=["last_updated", "id"]),
+        ]
 
     def __str__(self):
         return self.name
@@ -97,12 +107,62 @@ class Secret(models.Model):
         return None if not otp else otp.now()
 
 
+class SecretBlob(models.Model):
+    """
+    The encrypted contents of one or more `SecretFile`s with the same plaintext, stored once as
+    compressed, AES-GCM encrypted chunks; see `secret.files`
+    """
+
+    sha256 = models.CharField("SHA-256", max_length=64, unique=True)
+    size = models.BigIntegerField()
+    # the bytes actually stored for the chunks, after compression and encryption
+    stored_size = models.BigIntegerField(default=0)
+
+    chunk_size = models.PositiveIntegerField()
+    # "zlib", or empty for chunks stored before compression was added
+    compression = models.CharField(max_length=16, blank=True)
+    nonce_prefix = models.BinaryField()
+    encryption_key = EncryptedBinaryField()
+
+    # the files pointing at this blob; it is deleted when the last goes
+    ref_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = EncryptedFieldsManager()
+
+
+class SecretBlobChunk(models.Model):
+    """One encrypted chunk of a `SecretBlob`"""
+
+    blob = models.ForeignKey(SecretBlob, related_name="chunks", on_delete=models.CASCADE)
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ("blob", "index")
+
+
 class SecretFile(models.Model):
     secret = models.ForeignKey(Secret, related_name="files", on_delete=models.CASCADE)
     created = models.DateTimeField(auto_now_add=True)
 
     file_name = models.CharField(max_length=255)
-    file_data = encrypt(models.BinaryField(null=True))
+    # the whole file, for files stored before `secret.files` split them into chunks
+    file_data = EncryptedBinaryField(null=True)
+
+    # metadata, so listing and auditing files never needs their contents; empty for files not yet
+    # moved to chunks by `convert_secret_files`
+    content_type = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField(default=0)
+    sha256 = models.CharField("SHA-256", max_length=64, blank=True)
+
+    # null for files still stored in `file_data`. The database's foreign key stops a blob in use
+    # being deleted; PROTECT would have Django select the referencing files, contents and all.
+    blob = models.ForeignKey(
+        SecretBlob, related_name="files", null=True, on_delete=models.DO_NOTHING
+    )
+
+    objects = EncryptedFieldsManager()
 
 
 class SecretUserObjectPermission(UserObjectPermissionBase):
@@ -111,3 +171,28 @@ class SecretUserObjectPermission(UserObjectPermissionBase):
 
 class SecretGroupObjectPermission(GroupObjectPermissionBase):
     content_object = models.ForeignKey(Secret, on_delete=models.CASCADE)
+
+
+class SecretAccess(models.Model):
+    """
+    Denormalised copy of the guardian object permissions: one row per active user and secret
+    they can reach, directly or through a group, holding the highest permission granted.
+
+    Kept in sync by `secret.access`; the guardian tables remain the source of truth.
+    """
+
+    PERMISSION_CHOICES = (
+        ("view_secret", "View"),
+        ("change_secret", "Change"),
+    )
+
+    user = models.ForeignKey("user.User", related_name="secret_access", on_delete=models.CASCADE)
+    secret = models.ForeignKey(Secret, related_name="effective_access", on_delete=models.CASCADE)
+    permission = models.CharField(max_length=20, choices=PERMISSION_CHOICES)
+
+    class Meta:
+        unique_together = ("user", "secret")
+        verbose_name_plural = "secret access"
+
+    def __str__(self):
+        return f"{self.user} | {self.secret} | {self.permission}"
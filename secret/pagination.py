@@ -0,0 +1,175 @@
+"""
+Keyset (cursor) pagination.
+
+Rather than counting the whole queryset and skipping `OFFSET` rows, each page is fetched with a
+`WHERE (key, pk) > (last key, last pk)` condition on the queryset's leading ordering field, with
+the primary key as the tiebreaker. The position is handed to the client as an opaque cursor.
+"""
+
+import base64
+import binascii
+import datetime as dt
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    return value
+
+
+class KeysetPage:
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next:
+            return self.paginator.encode_cursor(self.object_list[-1], previous=False)
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous:
+            return self.paginator.encode_cursor(self.object_list[0], previous=True)
+
+
+class KeysetPaginator:
+    """
+    Paginate `queryset` by its leading ordering field (falling back to the model's
+    `Meta.ordering`), e.g. `-last_updated`, with the primary key breaking ties.
+
+    The total count is only computed when `count=True`; otherwise `count` is None.
+    """
+
+    def __init__(self, queryset, per_page, count=False):
+        self.queryset = queryset
+        self.per_page = per_page
+        self._count = count
+
+        ordering = queryset.query.order_by or queryset.model._meta.ordering or ("pk",)
+        self.ordering = ordering[0]
+        self.key = self.ordering.lstrip("-")
+        self.descending = self.ordering.startswith("-")
+
+        if self.key in ("pk", queryset.model._meta.pk.name):
+            self.key = None
+
+    @cached_property
+    def count(self):
+        if self._count:
+            return self.queryset.count()
+
+    def encode_cursor(self, obj, previous):
+        position = {
+            "o": self.ordering,
+            "pk": str(obj.pk),
+            "p": previous,
+        }
+
+        if self.key:
+            position["v"] = _encode_value(getattr(obj, self.key))
+
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            # a cursor taken under a different ordering does not describe a position here
+            if position["o"] != self.ordering:
+                raise InvalidCursor
+
+            pk = self.queryset.model._meta.pk.to_python(position["pk"])
+            value = self._key_to_python(position["v"]) if self.key else None
+
+            return value, pk, bool(position["p"])
+        except (
+            binascii.Error,
+            KeyError,
+            TypeError,
+            UnicodeDecodeError,
+            ValidationError,
+            ValueError,
+        ):
+            raise InvalidCursor
+
+    def _key_to_python(self, value):
+        try:
+            return self.queryset.model._meta.get_field(self.key).to_python(value)
+        except FieldDoesNotExist:
+            # an annotation, e.g. the search rank
+            return value
+
+    def _order_by(self, reverse):
+        descending = self.descending != reverse
+        direction = "-" if descending else ""
+
+        fields = [f"{direction}{self.key}"] if self.key else []
+        return fields + [f"{direction}pk"]
+
+    def _after(self, value, pk, reverse):
+        """Rows strictly after (value, pk) in the order given by `_order_by(reverse)`"""
+        lookup = "lt" if self.descending != reverse else "gt"
+
+        if not self.key:
+            return Q(**{f"pk__{lookup}": pk})
+
+        after = Q(**{f"{self.key}__{lookup}": value}) | Q(**{self.key: value, f"pk__{lookup}": pk})
+
+        # the same rows, with a plain bound on the key as well, which the OR above hides from the
+        # planner, e.g. from Postgres pruning the audit partitions beyond the cursor
+        return Q(**{f"{self.key}__{lookup}e": value}) & after
+
+    def page(self, cursor=None):
+        """Return the page following (or, for a previous-page cursor, preceding) `cursor`"""
+        position = None
+        limit = self.per_page + 1
+
+        if cursor:
+            try:
+                position = self.decode_cursor(cursor)
+            except InvalidCursor:
+                pass
+
+        if position is None:
+            previous = False
+            queryset = self.queryset
+        else:
+            value, pk, previous = position
+            queryset = self.queryset.filter(self._after(value, pk, previous))
+
+        object_list = list(queryset.order_by(*self._order_by(previous))[:limit])
+        has_more = len(object_list) > self.per_page
+
+        if has_more:
+            object_list.pop()
+
+        if previous:
+            return KeysetPage(self, object_list[::-1], has_next=True, has_previous=has_more)
+
+        return KeysetPage(self, object_list, has_next=has_more, has_previous=position is not None)
@@ -0,0 +1,46 @@
+"""
+Per-request resolution of a user's permissions on a secret.
+
+guardian's `has_perm` and `{% get_obj_perms %}` each build their own `ObjectPermissionChecker`, so a
+secret page checking permissions in its decorator and in a couple of templates queries for them
+several times. `get_secret_perms` runs one query per secret and keeps the result on the request.
+"""
+
+from .models import Secret, SecretGroupObjectPermission, SecretUserObjectPermission
+
+
+def _all_perms():
+    return {f"{action}_{Secret._meta.model_name}" for action in Secret._meta.default_permissions}
+
+
+def _resolve_perms(user, secret):
+    if not user.is_active:
+        return set()
+
+    if user.is_superuser:
+        return _all_perms()
+
+    user_perms = SecretUserObjectPermission.objects.filter(
+        user=user, content_object=secret
+    ).values_list("permission__codename", flat=True)
+    group_perms = SecretGroupObjectPermission.objects.filter(
+        group__user=user, content_object=secret
+    ).values_list("permission__codename", flat=True)
+
+    return set(user_perms.union(group_perms))
+
+
+def get_secret_perms(request, secret):
+    """Return the codenames of the permissions the request's user holds on `secret`"""
+    perms = request.__dict__.setdefault("_secret_perms_cache", {})
+    key = str(secret.pk)
+
+    if key not in perms:
+        perms[key] = _resolve_perms(request.user, secret)
+
+    return perms[key]
+
+
+def has_secret_perm(request, perm, secret):
+    """`perm` may be given with or without its app label, e.g. "secret.change_secret" """
+    return perm.split(".")[-1] in get_secret_perms(request, secret)
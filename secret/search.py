@@ -0,0 +1,45 @@
+"""
+Secret list search.
+
+Matches the search term as a case-insensitive substring of a secret's name, url or username. On
+Postgres those lookups are served by the pg_trgm GIN indexes added in migration 0011, and matches
+are ranked by their best trigram similarity to the term. Other databases (SQLite in local test
+runs) get the same matches without the ranking.
+"""
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Q
+from django.db.models.functions import Greatest
+
+SEARCH_FIELDS = ("name", "url", "username")
+
+RANK_ANNOTATION = "search_rank"
+
+
+def supports_ranking(queryset):
+    return connections[queryset.db].vendor == "postgresql"
+
+
+def search_secrets(queryset, term):
+    """
+    Filter `queryset` to secrets matching `term`. Where the database supports it, results are
+    annotated with `search_rank` and ordered best match first.
+    """
+    term = term.strip()
+
+    if not term:
+        return queryset
+
+    match = Q()
+    for field in SEARCH_FIELDS:
+        match |= Q(**{f"{field}__icontains": term})
+
+    queryset = queryset.filter(match)
+
+    if not supports_ranking(queryset):
+        return queryset
+
+    return queryset.annotate(
+        **{RANK_ANNOTATION: Greatest(*(TrigramSimilarity(field, term) for field in SEARCH_FIELDS))}
+    ).order_by(f"-{RANK_ANNOTATION}", "name")
@@ -0,0 +1,43 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from user.models import User
+from .access import refresh_access
+from .models import SecretGroupObjectPermission, SecretUserObjectPermission
+
+
+@receiver(post_save, sender=SecretUserObjectPermission)
+@receiver(post_delete, sender=SecretUserObjectPermission)
+def user_permission_changed(sender, instance, **kwargs):
+    refresh_access(secret_ids=[instance.content_object_id], user_ids=[instance.user_id])
+
+
+@receiver(post_save, sender=SecretGroupObjectPermission)
+@receiver(post_delete, sender=SecretGroupObjectPermission)
+def group_permission_changed(sender, instance, **kwargs):
+    refresh_access(secret_ids=[instance.content_object_id])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            refresh_access(user_ids=[instance.pk])
+        return
+
+    # group.user_set.clear() does not tell us which users were removed
+    if action == "pre_clear":
+        instance._cleared_user_ids = list(instance.user_set.values_list("pk", flat=True))
+    elif action == "post_clear":
+        refresh_access(user_ids=instance.__dict__.pop("_cleared_user_ids", []))
+    elif action in ("post_add", "post_remove"):
+        refresh_access(user_ids=list(pk_set))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    """Drop the access rows of deactivated users, and restore them on reactivation"""
+    if created or (update_fields is not None and "is_active" not in update_fields):
+        return
+
+    refresh_access(user_ids=[instance.pk])
@@ -8,7 +8,7 @@ register = template.Library()
 FILTER_PARAM = "o"
 
 
-VALID_QS_PARAMS = ["group", "name", "page", "me", "o"]
+VALID_QS_PARAMS = ["group", "name", "page", "cursor", "me", "o", "action", "user"]
 
 
 def extact_qs_params(request):
@@ -29,14 +29,24 @@ def filter_querystring(context, field_name):
 
     qs_params[FILTER_PARAM] = filter
 
+    # a cursor only describes a position under the ordering it was taken with
+    qs_params.pop("cursor", None)
+
     return "?" + urlencode(qs_params)
 
 
 @register.simple_tag(takes_context=True)
-def page_querystring(context, page_number):
+def page_querystring(context, page_number=None, cursor=None):
+    """Link to a page, given either a page number or a keyset pagination cursor"""
     request = context["request"]
     qs_params = extact_qs_params(request)
 
-    qs_params["page"] = str(page_number)
+    qs_params.pop("page", None)
+    qs_params.pop("cursor", None)
+
+    if cursor:
+        qs_params["cursor"] = cursor
+    elif page_number:
+        qs_params["page"] = str(page_number)
 
     return "?" + urlencode(qs_params)
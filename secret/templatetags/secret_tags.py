@@ -0,0 +1,11 @@
+from django import template
+
+from secret.permissions import get_secret_perms as _get_secret_perms
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def get_secret_perms(context, secret):
+    """The request's user's permissions on `secret`, e.g. `{% get_secret_perms object as perms %}`"""
+    return _get_secret_perms(context["request"], secret)
@@ -1,5 +1,9 @@
+import io
+
 import factory
 
+from secret.files import save_file
+
 
 class SecretFactory(factory.django.DjangoModelFactory):
     name = factory.Sequence(lambda n: f"Secret-{n+1}")
@@ -14,7 +18,15 @@ class SecretFactory(factory.django.DjangoModelFactory):
 
 class SecretFileFactory(factory.django.DjangoModelFactory):
     file_name = factory.Sequence(lambda n: f"file-{n+1}")
-    file_data = b"This is a test file"
+    content = b"This is a test file"
 
     class Meta:
         model = "secret.SecretFile"
+
+    @classmethod
+    def _create(cls, model_class, content, **kwargs):
+        # passing `file_data` makes a file stored the way it was before chunking
+        if kwargs.get("file_data") is not None:
+            return super()._create(model_class, **kwargs)
+
+        return save_file(kwargs["secret"], kwargs["file_name"], io.BytesIO(content))
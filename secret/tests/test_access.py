@@ -0,0 +1,150 @@
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from guardian.shortcuts import assign_perm, remove_perm
+
+from secret.access import compute_access
+from secret.models import SecretAccess
+from user.tests.factories import GroupFactory, UserFactory
+from .factories import SecretFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _access(user, secret):
+    return SecretAccess.objects.filter(user=user, secret=secret).values_list(
+        "permission", flat=True
+    ).first()
+
+
+class TestSecretAccess:
+    def test_direct_permission(self):
+        user = UserFactory()
+        secret = SecretFactory()
+
+        secret.set_permission(user, "view_secret")
+        assert _access(user, secret) == "view_secret"
+
+        secret.set_permission(user, "change_secret")
+        assert _access(user, secret) == "change_secret"
+
+        secret.set_permission(user, "view_secret")
+        assert _access(user, secret) == "view_secret"
+
+        secret.remove_permissions(user)
+        assert _access(user, secret) is None
+
+    def test_highest_permission_wins(self):
+        user = UserFactory()
+        group = GroupFactory()
+        user.groups.add(group)
+        secret = SecretFactory()
+
+        secret.set_permission(user, "view_secret")
+        secret.set_permission(group, "change_secret")
+
+        assert _access(user, secret) == "change_secret"
+        assert SecretAccess.objects.filter(user=user).count() == 1
+
+        secret.remove_permissions(group)
+
+        assert _access(user, secret) == "view_secret"
+
+    def test_group_membership(self):
+        user = UserFactory()
+        group = GroupFactory()
+        secret = SecretFactory()
+
+        secret.set_permission(group, "view_secret")
+        assert _access(user, secret) is None
+
+        user.groups.add(group)
+        assert _access(user, secret) == "view_secret"
+
+        user.groups.remove(group)
+        assert _access(user, secret) is None
+
+        group.user_set.add(user)
+        assert _access(user, secret) == "view_secret"
+
+        group.user_set.clear()
+        assert _access(user, secret) is None
+
+    def test_user_deactivation(self):
+        user = UserFactory()
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+        assert _access(user, secret) == "view_secret"
+
+        user.is_active = False
+        user.save()
+        assert _access(user, secret) is None
+
+        user.is_active = True
+        user.save()
+        assert _access(user, secret) == "view_secret"
+
+    def test_inactive_group_member(self):
+        user, inactive = UserFactory(), UserFactory(is_active=False)
+        group = GroupFactory()
+        secret = SecretFactory()
+        assign_perm("view_secret", group, secret)
+
+        group.user_set.add(user, inactive)
+
+        assert compute_access(user_ids=[user.pk, inactive.pk]) == {
+            (user.pk, secret.pk): "view_secret"
+        }
+        assert _access(inactive, secret) is None
+
+    def test_group_deleted(self):
+        user = UserFactory()
+        group = GroupFactory()
+        user.groups.add(group)
+        secret = SecretFactory()
+
+        assign_perm("change_secret", group, secret)
+        assert _access(user, secret) == "change_secret"
+
+        group.delete()
+        assert _access(user, secret) is None
+
+    def test_compute_access_scope(self):
+        user, other_user = UserFactory(), UserFactory()
+        secret, other_secret = SecretFactory(), SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+        assign_perm("view_secret", other_user, other_secret)
+
+        assert compute_access(secret_ids=[secret.pk]) == {(user.pk, secret.pk): "view_secret"}
+        assert compute_access(user_ids=[other_user.pk]) == {
+            (other_user.pk, other_secret.pk): "view_secret"
+        }
+
+
+class TestRebuildSecretAccessCommand:
+    def test_verify_and_rebuild(self):
+        user = UserFactory()
+        secret, other_secret = SecretFactory(), SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+        remove_perm("view_secret", user, secret)
+        call_command("rebuild_secret_access", "--verify")
+
+        # simulate drift, e.g. a bulk import that bypassed the signals
+        assign_perm("change_secret", user, secret)
+        SecretAccess.objects.filter(user=user, secret=secret).delete()
+        SecretAccess.objects.create(user=user, secret=other_secret, permission="view_secret")
+
+        with pytest.raises(CommandError):
+            call_command("rebuild_secret_access", "--verify")
+
+        call_command("rebuild_secret_access")
+
+        assert list(SecretAccess.objects.values_list("user", "secret", "permission")) == [
+            (user.pk, secret.pk, "change_secret")
+        ]
+        call_command("rebuild_secret_access", "--verify")
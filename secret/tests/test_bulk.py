@@ -0,0 +1,73 @@
+import pytest
+
+from secret.bulk import EncryptionPool, ciphertext_expressions
+from secret.fields import Ciphertext
+from secret.keys import decrypt
+from secret.models import Secret
+from .factories import SecretFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _secrets(count):
+    return [
+        Secret(name=f"secret {n}", password=f"password {n}", details=f"details {n}", mfa_string="")
+        for n in range(count)
+    ]
+
+
+def _raw(secret, field):
+    return Secret.objects.with_encrypted().get(pk=secret.pk).__dict__[field]
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_encrypt(workers):
+    secrets = _secrets(10)
+
+    with EncryptionPool(workers) as pool:
+        pool.encrypt(secrets)
+
+    for n, secret in enumerate(secrets):
+        assert isinstance(secret.__dict__["password"], Ciphertext)
+        assert decrypt(secret.__dict__["password"].data) == f"password {n}"
+        assert decrypt(secret.__dict__["details"].data) == f"details {n}"
+        assert decrypt(secret.__dict__["mfa_string"].data) == ""
+
+
+def test_bulk_create_writes_ciphertext():
+    secrets = _secrets(2)
+
+    with EncryptionPool(0) as pool:
+        pool.encrypt(secrets)
+
+    ciphertext = secrets[0].__dict__["password"]
+    Secret.objects.bulk_create(secrets)
+
+    assert _raw(secrets[0], "password") == ciphertext
+    assert Secret.objects.with_encrypted().get(pk=secrets[1].pk).password == "password 1"
+
+
+def test_already_encrypted():
+    secret = Secret.objects.with_encrypted().get(pk=SecretFactory(password="password").pk)
+    stored = secret.__dict__["password"]
+    secret.details = "new details"
+
+    with EncryptionPool(0) as pool:
+        pool.encrypt([secret])
+
+    assert secret.__dict__["password"] is stored
+    assert decrypt(secret.__dict__["details"].data) == "new details"
+
+
+def test_bulk_update():
+    secret = SecretFactory(password="password")
+    secret = Secret(pk=secret.pk, password="new password", details="new details")
+
+    with EncryptionPool(0) as pool:
+        pool.encrypt([secret])
+
+    ciphertext = secret.__dict__["password"]
+    Secret.objects.bulk_update(ciphertext_expressions([secret]), ["password", "details"])
+
+    assert _raw(secret, "password") == ciphertext
+    assert Secret.objects.with_encrypted().get(pk=secret.pk).details == "new details"
@@ -0,0 +1,68 @@
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from secret.fields import Ciphertext, decryption_count, start_decryption_count
+from secret.models import Secret, SecretFile
+from .factories import SecretFactory, SecretFileFactory
+
+pytestmark = pytest.mark.django_db
+
+
+class TestLazyEncryptedFields:
+    def test_encrypted_fields_deferred_by_default(self):
+        SecretFactory()
+
+        secret = Secret.objects.get()
+
+        assert secret.get_deferred_fields() == {"password", "details", "mfa_string"}
+        assert Secret.objects.with_encrypted().get().get_deferred_fields() == set()
+
+    def test_decrypted_on_first_read(self):
+        SecretFactory(password="hunter2")
+        start_decryption_count()
+
+        secret = Secret.objects.with_encrypted().get()
+
+        assert isinstance(secret.__dict__["password"], Ciphertext)
+        assert decryption_count() == 0
+
+        assert secret.password == "hunter2"
+        assert secret.password == "hunter2"
+        assert decryption_count() == 1
+
+    def test_list_does_not_decrypt(self):
+        SecretFactory.create_batch(3)
+        start_decryption_count()
+
+        assert [secret.name for secret in Secret.objects.all()]
+        assert decryption_count() == 0
+
+    def test_save_without_reading(self):
+        SecretFactory(password="hunter2", details="some details")
+        start_decryption_count()
+
+        secret = Secret.objects.with_encrypted().get()
+        secret.name = "renamed"
+        secret.save()
+
+        deferred = Secret.objects.get()
+        deferred.details = "new details"
+        deferred.save()
+
+        assert decryption_count() == 0
+
+        secret = Secret.objects.get()
+        assert secret.name == "renamed"
+        assert secret.password == "hunter2"
+        assert secret.details == "new details"
+
+    def test_secret_file_data(self):
+        SecretFileFactory(secret=SecretFactory(), file_data=b"file contents")
+
+        with CaptureQueriesContext(connection) as queries:
+            file_obj = SecretFile.objects.get()
+
+        assert "file_data" not in queries.captured_queries[0]["sql"]
+        assert bytes(file_obj.file_data) == b"file contents"
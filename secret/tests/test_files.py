@@ -0,0 +1,415 @@
+import hashlib
+import io
+import zipfile
+
+import pytest
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from guardian.shortcuts import assign_perm
+
+from audit.models import Audit
+from secret.files import (
+    FileIntegrityError,
+    RangeNotSatisfiable,
+    collect_garbage,
+    delete_secret_file,
+    iter_file,
+    parse_range,
+    save_file,
+)
+from secret.models import SecretBlob, SecretBlobChunk, SecretFile
+from .factories import SecretFactory, SecretFileFactory
+from .test_views import login_and_verify_user
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(settings):
+    settings.SECRET_FILE_CHUNK_SIZE = 16
+
+
+@pytest.mark.parametrize("size, chunks", [(0, 1), (5, 1), (16, 1), (17, 2), (48, 3), (50, 4)])
+def test_round_trip(size, chunks):
+    content = bytes(range(size))
+
+    secret_file = save_file(SecretFactory(), "file.bin", io.BytesIO(content))
+
+    assert secret_file.size == size
+    assert secret_file.blob.chunks.count() == chunks
+    assert b"".join(iter_file(SecretFile.objects.get(pk=secret_file.pk))) == content
+
+
+def test_metadata():
+    content = b"-----BEGIN CERTIFICATE-----"
+
+    secret_file = save_file(SecretFactory(), "bundle.txt", io.BytesIO(content))
+
+    assert secret_file.size == len(content)
+    assert secret_file.sha256 == hashlib.sha256(content).hexdigest()
+    assert secret_file.content_type == "text/plain"
+
+
+def test_chunks_are_encrypted():
+    content = b"a certificate bundle that spans several chunks"
+
+    secret_file = save_file(SecretFactory(), "bundle.pem", io.BytesIO(content))
+
+    stored = b"".join(bytes(data) for data in secret_file.blob.chunks.values_list("data", flat=True))
+    assert b"certificate" not in stored
+    assert b"chunks" not in stored
+
+
+class TestIntegrity:
+    def _file(self, content=b"x" * 40):
+        return SecretFileFactory(secret=SecretFactory(), content=content)
+
+    def test_truncated(self):
+        secret_file = self._file()
+        secret_file.blob.chunks.filter(index=2).delete()
+
+        with pytest.raises(FileIntegrityError):
+            b"".join(iter_file(secret_file))
+
+    def test_reordered(self):
+        secret_file = self._file()
+        first, second = secret_file.blob.chunks.order_by("index")[:2]
+        first.data, second.data = second.data, first.data
+        SecretBlobChunk.objects.bulk_update([first, second], ["data"])
+
+        with pytest.raises(FileIntegrityError):
+            b"".join(iter_file(secret_file))
+
+    def test_swapped_between_files(self):
+        secret_file, other = self._file(), self._file(b"z" * 40)
+        other_chunk = other.blob.chunks.get(index=0)
+        secret_file.blob.chunks.filter(index=0).update(data=other_chunk.data)
+
+        with pytest.raises(FileIntegrityError):
+            b"".join(iter_file(secret_file))
+
+
+class TestLegacyFiles:
+    def test_read(self):
+        secret_file = SecretFileFactory(secret=SecretFactory(), file_data=b"stored whole" * 3)
+
+        assert b"".join(iter_file(secret_file)) == b"stored whole" * 3
+
+    def test_convert(self):
+        secret_file = SecretFileFactory(secret=SecretFactory(), file_data=b"stored whole" * 3)
+        SecretFileFactory(secret=SecretFactory())
+
+        stdout = io.StringIO()
+        call_command("convert_secret_files", stdout=stdout)
+
+        assert "1 files converted" in stdout.getvalue()
+
+        secret_file = SecretFile.objects.get(pk=secret_file.pk)
+        assert secret_file.size == 36
+        assert secret_file.blob.chunks.count() == 3
+        assert secret_file.file_data is None
+        assert b"".join(iter_file(secret_file)) == b"stored whole" * 3
+
+
+class TestBlobs:
+    def test_same_content_stored_once(self):
+        first = save_file(SecretFactory(), "first.txt", io.BytesIO(b"shared" * 10))
+        second = save_file(SecretFactory(), "second.txt", io.BytesIO(b"shared" * 10))
+
+        assert first.blob_id == second.blob_id
+        assert SecretBlob.objects.get().ref_count == 2
+        assert SecretBlobChunk.objects.count() == 4
+        assert b"".join(iter_file(second)) == b"shared" * 10
+
+    def test_compressed(self, settings):
+        settings.SECRET_FILE_CHUNK_SIZE = 1024
+        secret_file = save_file(SecretFactory(), "file.txt", io.BytesIO(b"a" * 4096))
+
+        assert secret_file.blob.compression == "zlib"
+        assert secret_file.blob.stored_size < secret_file.size
+        assert b"".join(iter_file(secret_file)) == b"a" * 4096
+
+    def test_delete(self):
+        first = save_file(SecretFactory(), "first.txt", io.BytesIO(b"shared" * 10))
+        second = save_file(SecretFactory(), "second.txt", io.BytesIO(b"shared" * 10))
+
+        delete_secret_file(first)
+
+        assert SecretBlob.objects.get().ref_count == 1
+        assert b"".join(iter_file(second)) == b"shared" * 10
+
+        delete_secret_file(second)
+
+        assert not SecretBlob.objects.exists()
+        assert not SecretBlobChunk.objects.exists()
+
+    def test_collect_garbage(self):
+        kept = save_file(SecretFactory(), "kept.txt", io.BytesIO(b"kept"))
+        save_file(SecretFactory(), "orphan.txt", io.BytesIO(b"orphan")).secret.delete()
+        SecretBlob.objects.filter(pk=kept.blob_id).update(ref_count=5)
+
+        assert collect_garbage() == 1
+        assert SecretBlob.objects.get().ref_count == 1
+
+    def test_report(self):
+        save_file(SecretFactory(), "first.txt", io.BytesIO(b"a" * 1000))
+        save_file(SecretFactory(), "second.txt", io.BytesIO(b"a" * 1000))
+        SecretFileFactory(secret=SecretFactory(), file_data=b"stored whole")
+
+        stdout = io.StringIO()
+        call_command("report_file_storage", "--collect-garbage", stdout=stdout)
+        report = stdout.getvalue()
+
+        assert "Deleted 0 unreferenced blobs." in report
+        assert "Saved by deduplication     1000\xa0bytes" in report
+        assert "Files not yet converted    1" in report
+
+
+class TestUploadAndDownload:
+    def test_upload_is_encrypted_in_chunks(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+        assign_perm("change_secret", user, secret)
+        content = b"0123456789" * 10
+
+        fp = io.BytesIO(content)
+        fp.name = "dump.sql"
+        client.post(reverse("secret:file_add", kwargs={"pk": secret.pk}), {"file": fp})
+
+        secret_file = SecretFile.objects.get()
+        assert secret_file.blob.chunks.count() == 7
+        assert b"".join(iter_file(secret_file)) == content
+
+    def test_upload_checks_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+        assign_perm("change_secret", user, secret)
+
+        fp = io.BytesIO(b"data")
+        fp.name = "dump.sql"
+        response = client.post(reverse("secret:file_add", kwargs={"pk": secret.pk}), {"file": fp})
+
+        assert response.status_code == 403
+        assert not SecretFile.objects.exists()
+
+    def test_download_streams(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+        assign_perm("view_secret", user, secret)
+        secret_file = SecretFileFactory(secret=secret, file_name="notes.txt", content=b"y" * 40)
+
+        response = client.get(
+            reverse("secret:file_download", kwargs={"pk": secret.pk, "file_pk": secret_file.pk})
+        )
+
+        assert response.streaming
+        assert response["Content-Length"] == "40"
+        assert response["Content-Type"] == "text/plain"
+        assert list(response.streaming_content) == [b"y" * 16, b"y" * 16, b"y" * 8]
+
+
+class TestContentsNotRead:
+    def _assert_contents_not_read(self, queries):
+        for query in queries.captured_queries:
+            sql = query["sql"]
+            assert "file_data" not in sql
+            assert "encryption_key" not in sql
+            assert not ("SELECT" in sql and "secret_secretblobchunk" in sql)
+
+    def test_list(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+        assign_perm("view_secret", user, secret)
+        SecretFileFactory(secret=secret, file_name="a.txt", content=b"x" * 2048)
+        SecretFileFactory(secret=secret, file_name="b.txt", file_data=b"legacy")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("secret:file_list", kwargs={"pk": secret.pk}))
+
+        assert [f.file_name for f in response.context["files"]] == ["a.txt", "b.txt"]
+        assert "2.0\xa0KB" in response.content.decode()
+        self._assert_contents_not_read(queries)
+
+    def test_delete(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+        assign_perm("change_secret", user, secret)
+        secret_file = SecretFileFactory(secret=secret, content=b"x" * 100)
+
+        with CaptureQueriesContext(connection) as queries:
+            client.post(
+                reverse("secret:file_delete", kwargs={"pk": secret.pk, "file_pk": secret_file.pk})
+            )
+
+        assert not SecretFile.objects.exists()
+        assert not SecretBlobChunk.objects.exists()
+        self._assert_contents_not_read(queries)
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", (0, 10)),
+        ("bytes=10-", (10, 100)),
+        ("bytes=90-200", (90, 100)),
+        ("bytes=-10", (90, 100)),
+        ("bytes=-200", (0, 100)),
+        ("bytes=5-1", None),
+        ("bytes=0-1,5-9", None),
+        ("bytes=-", None),
+        ("items=0-9", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 100)
+
+
+@pytest.mark.parametrize("start, end", [(0, 50), (3, 20), (16, 32), (15, 17), (40, 50), (49, 50)])
+def test_iter_file_range(start, end):
+    content = bytes(range(50))
+    secret_file = save_file(SecretFactory(), "file.bin", io.BytesIO(content))
+
+    assert b"".join(iter_file(secret_file, start, end)) == content[start:end]
+
+
+class TestRangeDownload:
+    @pytest.fixture
+    def download(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+        assign_perm("view_secret", user, secret)
+        self.content = bytes(range(50))
+        self.file = SecretFileFactory(secret=secret, file_name="dump.bin", content=self.content)
+        self.etag = f'"{self.file.sha256}"'
+
+        url = reverse("secret:file_download", kwargs={"pk": secret.pk, "file_pk": self.file.pk})
+
+        return lambda **headers: client.get(url, **headers)
+
+    def test_full(self, download):
+        response = download()
+
+        assert response.status_code == 200
+        assert response["ETag"] == self.etag
+        assert response["Accept-Ranges"] == "bytes"
+        assert b"".join(response.streaming_content) == self.content
+
+    def test_partial(self, download):
+        response = download(HTTP_RANGE="bytes=20-35")
+
+        assert response.status_code == 206
+        assert response["Content-Range"] == "bytes 20-35/50"
+        assert response["Content-Length"] == "16"
+        assert b"".join(response.streaming_content) == self.content[20:36]
+
+    def test_only_covering_chunks_are_read(self, download):
+        self.file.blob.chunks.exclude(index=2).delete()
+
+        response = download(HTTP_RANGE="bytes=33-40")
+
+        assert b"".join(response.streaming_content) == self.content[33:41]
+
+    def test_if_range(self, download):
+        response = download(HTTP_RANGE="bytes=20-", HTTP_IF_RANGE=self.etag)
+
+        assert response.status_code == 206
+
+        response = download(HTTP_RANGE="bytes=20-", HTTP_IF_RANGE='"stale"')
+
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == self.content
+
+    def test_not_satisfiable(self, download):
+        response = download(HTTP_RANGE="bytes=50-")
+
+        assert response.status_code == 416
+        assert response["Content-Range"] == "bytes */50"
+
+    def test_audited_once_per_download(self, download, settings):
+        # a cache that remembers, in place of the tests' dummy one
+        settings.CACHES = {
+            **settings.CACHES,
+            "audit": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "audit"},
+        }
+        caches["audit"].clear()
+
+        # however the ranges start, e.g. a resumed download or a suffix range
+        for header in ("bytes=30-", "bytes=-10", "bytes=0-9", "bytes=10-29"):
+            download(HTTP_RANGE=header)
+
+        assert Audit.objects.filter(action="download_file").count() == 1
+
+        download()
+
+        assert Audit.objects.filter(action="download_file").count() == 2
+
+
+class TestDownloadAll:
+    @pytest.fixture
+    def secret(self, client):
+        self.user = login_and_verify_user(client)
+        secret = SecretFactory(name="Database dumps")
+        assign_perm("view_secret", self.user, secret)
+        return secret
+
+    def _download(self, client, secret):
+        return client.get(reverse("secret:file_download_all", kwargs={"pk": secret.pk}))
+
+    def test_download(self, client, secret):
+        SecretFileFactory(secret=secret, file_name="dump.bin", content=bytes(range(50)))
+        SecretFileFactory(secret=secret, file_name="dump.bin", content=b"second")
+        SecretFileFactory(secret=secret, file_name="notes.txt", file_data=b"stored whole")
+
+        response = self._download(client, secret)
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/zip"
+        assert 'filename="database-dumps-files.zip"' in response["Content-Disposition"]
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+        assert archive.namelist() == ["dump.bin", "dump (2).bin", "notes.txt"]
+        assert archive.read("dump.bin") == bytes(range(50))
+        assert archive.read("dump (2).bin") == b"second"
+        assert archive.read("notes.txt") == b"stored whole"
+        assert archive.testzip() is None
+
+    def test_audited_in_one_write(self, client, secret):
+        SecretFileFactory(secret=secret, file_name="a.txt")
+        SecretFileFactory(secret=secret, file_name="b.txt")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self._download(client, secret)
+
+        inserts = [q for q in queries if q["sql"].startswith('INSERT INTO "audit_audit"')]
+        assert len(inserts) == 1
+        assert sorted(
+            Audit.objects.filter(user=self.user, secret=secret, action="download_file").values_list(
+                "description", flat=True
+            )
+        ) == ["a.txt", "b.txt"]
+
+        b"".join(response.streaming_content)
+
+    def test_no_files(self, client, secret):
+        assert self._download(client, secret).status_code == 404
+
+    def test_needs_permission(self, client):
+        login_and_verify_user(client)
+        secret = SecretFactory()
+        SecretFileFactory(secret=secret)
+
+        assert self._download(client, secret).status_code == 403
+        assert not Audit.objects.exists()
@@ -1,5 +1,7 @@
 import pytest
 
+from django.db import connection
+
 from guardian.shortcuts import assign_perm
 
 from secret.filters import SecretFilter
@@ -58,6 +60,42 @@ class TestSecretFilter:
         assert filter.qs.count() == 1
         assert filter.qs.first() == secret1
 
+    @pytest.mark.parametrize(
+        "search_term", ["aws", "AWS", "username-aws", "console.aws.example"],
+    )
+    def test_search_matches_name_username_and_url(self, rf, search_term):
+        user = UserFactory(is_superuser=True)
+        secret = SecretFactory(
+            name="aws", username="username-aws", url="https://console.aws.example/"
+        )
+        SecretFactory(name="gcp", username="username-gcp", url="https://console.gcp.example/")
+
+        request = rf.get("/some/url")
+        request.user = user
+
+        filter = SecretFilter(
+            request=request, queryset=Secret.objects.all(), data={"name": search_term}
+        )
+
+        assert list(filter.qs) == [secret]
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql", reason="ranking needs pg_trgm",
+    )
+    def test_search_ranks_closest_match_first(self, rf):
+        user = UserFactory(is_superuser=True)
+        partial_match = SecretFactory(name="a-jenkins-admin-account")
+        exact_match = SecretFactory(name="jenkins")
+
+        request = rf.get("/some/url")
+        request.user = user
+
+        filter = SecretFilter(
+            request=request, queryset=Secret.objects.all(), data={"name": "jenkins"}
+        )
+
+        assert list(filter.qs) == [exact_match, partial_match]
+
     def test_user_gets_results_with_change_permission(self, rf):
         user = UserFactory()
         secret = SecretFactory(name="aws-1")
@@ -113,3 +151,36 @@ class TestSecretFilter:
         filter = SecretFilter(request=request, queryset=Secret.objects.all())
 
         assert filter.qs.count() == 5
+
+    def test_group_permission_gives_results(self, rf):
+        group = GroupFactory()
+        user = UserFactory()
+        user.groups.add(group)
+        secret = SecretFactory(name="aws-1")
+        SecretFactory(name="aws-2")
+
+        assign_perm("view_secret", group, secret)
+        assign_perm("view_secret", user, secret)
+
+        request = rf.get("/some/url")
+        request.user = user
+
+        filter = SecretFilter(request=request, queryset=Secret.objects.all())
+
+        assert list(filter.qs) == [secret]
+
+    def test_inactive_user_gets_no_results(self, rf):
+        user = UserFactory()
+        secret = SecretFactory(name="aws-1")
+
+        assign_perm("view_secret", user, secret)
+
+        user.is_active = False
+        user.save()
+
+        request = rf.get("/some/url")
+        request.user = user
+
+        filter = SecretFilter(request=request, queryset=Secret.objects.all())
+
+        assert filter.qs.count() == 0
@@ -0,0 +1,351 @@
+import io
+import json
+
+import pytest
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+from guardian.shortcuts import get_group_perms, get_user_perms
+
+from audit.models import Audit
+from secret.imports import InvalidExport, SecretImporter, guess_format, parse
+from secret.models import Secret, SecretAccess
+from user.tests.factories import GroupFactory, UserFactory, otp_verify_user
+
+pytestmark = pytest.mark.django_db
+
+TOTP_SECRET = "JBSWY3DPEHPK3PXP"
+
+CSV = (
+    "name,url,username,password,notes,totp,type,folder\n"
+    f"db,https://db/,admin,s3cret,the notes,{TOTP_SECRET},login,ops\n"
+    ",https://wiki/,wiki-user,pw,,,login,\n"
+    ",,,nameless,,,login,\n"
+    "bad totp,,user,pw,,not base32!,login,\n"
+).encode()
+
+KEEPASS = f"""<?xml version="1.0" encoding="utf-8"?>
+<KeePassFile>
+  <Meta>
+    <RecycleBinUUID>bin</RecycleBinUUID>
+    <Binaries><Binary ID="0">AAAA</Binary></Binaries>
+  </Meta>
+  <Root>
+    <Group>
+      <UUID>root</UUID>
+      <Name>Root</Name>
+      <Entry>
+        <UUID>router</UUID>
+        <String><Key>Title</Key><Value>router</Value></String>
+        <String><Key>UserName</Key><Value>admin</Value></String>
+        <String><Key>Password</Key><Value>hunter2</Value></String>
+        <String><Key>URL</Key><Value>http://192.168.0.1/</Value></String>
+        <String><Key>Notes</Key><Value>in the cupboard</Value></String>
+        <String><Key>PIN</Key><Value>1234</Value></String>
+        <History>
+          <Entry><String><Key>Title</Key><Value>old router</Value></String></Entry>
+        </History>
+      </Entry>
+      <Group>
+        <UUID>bin</UUID>
+        <Name>Recycle Bin</Name>
+        <Entry><String><Key>Title</Key><Value>deleted</Value></String></Entry>
+      </Group>
+      <Group>
+        <UUID>email</UUID>
+        <Name>Email</Name>
+        <Entry>
+          <String><Key>Title</Key><Value>mail</Value></String>
+          <String><Key>TimeOtp-Secret-Base32</Key><Value>{TOTP_SECRET}</Value></String>
+          <String><Key>TimeOtp-Period</Key><Value>60</Value></String>
+        </Entry>
+      </Group>
+    </Group>
+  </Root>
+</KeePassFile>
+""".encode()
+
+SEPARATOR = "***5642bee8-a5ff-11dc-8314-0800200c9a66***"
+ONE_PIF = "\n".join(
+    [
+        json.dumps(
+            {
+                "title": "vpn",
+                "location": "https://vpn/",
+                "typeName": "webforms.WebForm",
+                "secureContents": {
+                    "fields": [
+                        {"designation": "username", "value": "vpn-user"},
+                        {"designation": "password", "value": "vpn-pass"},
+                    ],
+                    "notesPlain": "notes",
+                    "sections": [
+                        {
+                            "fields": [
+                                {"n": "TOTP_1", "t": "one-time password", "v": TOTP_SECRET},
+                                {"n": "pin", "t": "PIN", "v": "0000"},
+                            ]
+                        }
+                    ],
+                },
+            }
+        ),
+        SEPARATOR,
+        json.dumps({"title": "gone", "trashed": True, "secureContents": {}}),
+        SEPARATOR,
+        json.dumps({"title": "Folder", "typeName": "system.folder.Regular"}),
+        SEPARATOR,
+    ]
+).encode()
+
+
+def _entries(export_format, data):
+    return list(parse(export_format, io.BytesIO(data)))
+
+
+class TestParse:
+    def test_csv(self):
+        db, wiki, nameless, bad_totp = _entries("csv", CSV)
+
+        assert db == {
+            "name": "db",
+            "url": "https://db/",
+            "username": "admin",
+            "password": "s3cret",
+            "details": "the notes\n\nfolder: ops",
+            "mfa_string": TOTP_SECRET,
+        }
+        assert wiki["name"] == ""
+        assert nameless["password"] == "nameless"
+
+    def test_keepass(self):
+        router, mail = _entries("keepass", KEEPASS)
+
+        assert router == {
+            "name": "router",
+            "url": "http://192.168.0.1/",
+            "username": "admin",
+            "password": "hunter2",
+            "details": "in the cupboard\n\nPIN: 1234",
+            "mfa_string": "",
+        }
+        assert mail["mfa_string"].startswith("otpauth://totp/mail?secret=" + TOTP_SECRET)
+        assert "period=60" in mail["mfa_string"]
+
+    def test_1pif(self):
+        (vpn,) = _entries("1pif", ONE_PIF)
+
+        assert vpn == {
+            "name": "vpn",
+            "url": "https://vpn/",
+            "username": "vpn-user",
+            "password": "vpn-pass",
+            "details": "notes\n\nPIN: 0000",
+            "mfa_string": TOTP_SECRET,
+        }
+
+    @pytest.mark.parametrize(
+        "export_format, data",
+        [
+            ("keepass", b"<KeePassFile><Root>"),
+            # entities, e.g. for an entity expansion attack, are turned away
+            ("keepass", b'<!DOCTYPE x [<!ENTITY a "b">]><KeePassFile>&a;</KeePassFile>'),
+            ("1pif", b"{not json"),
+            ("csv", b"\xff\xfe"),
+        ],
+    )
+    def test_invalid(self, export_format, data):
+        with pytest.raises(InvalidExport):
+            _entries(export_format, data)
+
+    def test_guess_format(self):
+        assert guess_format("export.CSV") == "csv"
+        assert guess_format("Database.xml") == "keepass"
+        assert guess_format("data.1pif") == "1pif"
+        assert guess_format("export") is None
+
+
+class TestSecretImporter:
+    def test_import(self):
+        user = UserFactory()
+        ops, devs = GroupFactory(name="ops"), GroupFactory(name="devs")
+        member = UserFactory(create_groups=False)
+        member.groups.add(devs)
+
+        importer = SecretImporter(
+            user, "export.csv", change_groups=[ops], view_groups=[devs, ops], batch_size=1
+        ).run(parse("csv", io.BytesIO(CSV)))
+
+        assert (importer.imported, importer.batches) == (2, 2)
+        assert importer.errors == [
+            (3, "", "it has no name, URL or username"),
+            (4, "bad totp", "its TOTP value is not a valid otpauth:// URI or base32 secret"),
+        ]
+
+        db = Secret.objects.with_encrypted().get(name="db")
+        wiki = Secret.objects.get(name="https://wiki/")
+
+        assert (db.password, db.created_by) == ("s3cret", user)
+        assert db.get_otp().secret == TOTP_SECRET
+        assert set(get_user_perms(user, db)) == {"view_secret", "change_secret"}
+        assert set(get_group_perms(ops, wiki)) == {"view_secret", "change_secret"}
+        assert set(get_group_perms(devs, wiki)) == {"view_secret"}
+        assert SecretAccess.objects.get(user=member, secret=db).permission == "view_secret"
+
+        # one event per batch
+        assert list(Audit.objects.order_by("pk").values_list("action", "description")) == [
+            (
+                "imported",
+                "Imported 1 secrets from export.csv, batch 1, shared with ops (change), devs (view)",
+            ),
+            (
+                "imported",
+                "Imported 1 secrets from export.csv, batch 2, shared with ops (change), devs (view)",
+            ),
+        ]
+
+    def test_dry_run(self):
+        importer = SecretImporter(UserFactory(), "Database.xml", dry_run=True).run(
+            parse("keepass", io.BytesIO(KEEPASS))
+        )
+
+        assert importer.imported == 2
+        assert not Secret.objects.exists()
+        assert not Audit.objects.exists()
+
+    def test_workers(self):
+        SecretImporter(UserFactory(), "data.1pif", workers=2).run(
+            parse("1pif", io.BytesIO(ONE_PIF))
+        )
+
+        assert Secret.objects.with_encrypted().get(name="vpn").password == "vpn-pass"
+
+
+class TestImportCommand:
+    def test_import(self, tmp_path):
+        user = UserFactory()
+        GroupFactory(name="ops")
+        path = tmp_path / "export.csv"
+        path.write_bytes(CSV)
+
+        stdout = io.StringIO()
+        call_command(
+            "import_secrets", str(path), f"--user={user.email}", "--view-group=ops", stdout=stdout
+        )
+
+        output = stdout.getvalue()
+        assert "Entry 3 () skipped: it has no name, URL or username" in output
+        assert "Done. 2 secrets were imported in 1 batches, 2 skipped." in output
+        assert Secret.objects.count() == 2
+
+    def test_unknown_group(self, tmp_path):
+        user = UserFactory()
+        path = tmp_path / "export.csv"
+        path.write_bytes(CSV)
+
+        with pytest.raises(CommandError, match="No group called ops"):
+            call_command("import_secrets", str(path), f"--user={user.email}", "--view-group=ops")
+
+    def test_unknown_format(self, tmp_path):
+        user = UserFactory()
+        path = tmp_path / "export.txt"
+        path.write_bytes(CSV)
+
+        with pytest.raises(CommandError, match="Pass --format"):
+            call_command("import_secrets", str(path), f"--user={user.email}")
+
+
+class TestImportAdmin:
+    @pytest.fixture
+    def admin_client(self, client):
+        user = UserFactory(is_staff=True, is_superuser=True, two_factor_enabled=True)
+        client.force_login(user)
+        otp_verify_user(user, client)
+        return client
+
+    def test_linked_from_index(self, admin_client):
+        response = admin_client.get(reverse("admin:index"))
+
+        assert reverse("admin:secret_import") in response.content.decode()
+
+    def test_import(self, admin_client):
+        ops = GroupFactory(name="ops")
+
+        response = admin_client.post(
+            reverse("admin:secret_import"),
+            {"file": SimpleUploadedFile("export.csv", CSV), "change_groups": [ops.pk]},
+            follow=True,
+        )
+
+        content = response.content.decode()
+        assert "2 secrets were imported, 2 skipped" in content
+        assert "It has no name, URL or username" in content
+        assert set(get_group_perms(ops, Secret.objects.get(name="db"))) == {
+            "view_secret",
+            "change_secret",
+        }
+
+    def test_dry_run(self, admin_client):
+        response = admin_client.post(
+            reverse("admin:secret_import"),
+            {"file": SimpleUploadedFile("Database.xml", KEEPASS), "dry_run": "on"},
+        )
+
+        assert "2 secrets would be imported, 0 skipped" in response.content.decode()
+        assert not Secret.objects.exists()
+
+    def test_invalid_file(self, admin_client):
+        response = admin_client.post(
+            reverse("admin:secret_import"),
+            {"file": SimpleUploadedFile("data.1pif", b"{not json"), "format": "1pif"},
+        )
+
+        assert "could not be read after 0 entries" in response.content.decode()
+
+    def test_format_needed(self, admin_client):
+        response = admin_client.post(
+            reverse("admin:secret_import"), {"file": SimpleUploadedFile("export.txt", CSV)}
+        )
+
+        assert "Choose the format of the export" in response.content.decode()
+        assert not Secret.objects.exists()
+
+    def test_kept_in_memory(self, admin_client, settings, monkeypatch):
+        # over which Django's own handlers would write the upload to a temporary file
+        settings.FILE_UPLOAD_MAX_MEMORY_SIZE = 10
+
+        def written_to_disk(*args, **kwargs):
+            raise AssertionError("The export was written to disk")
+
+        monkeypatch.setattr(
+            "django.core.files.uploadedfile.TemporaryUploadedFile.__init__", written_to_disk
+        )
+
+        admin_client.post(
+            reverse("admin:secret_import"), {"file": SimpleUploadedFile("export.csv", CSV)}
+        )
+
+        assert Secret.objects.count() == 2
+
+    def test_too_large(self, admin_client, monkeypatch):
+        monkeypatch.setattr("secret.admin.MAX_IMPORT_UPLOAD_SIZE", len(CSV) - 1)
+
+        response = admin_client.post(
+            reverse("admin:secret_import"), {"file": SimpleUploadedFile("export.csv", CSV)}
+        )
+
+        content = response.content.decode()
+        assert "Import it with the import_secrets management command instead" in content
+        assert "This field is required" not in content
+        assert not Secret.objects.exists()
+
+    def test_superusers_only(self, client):
+        user = UserFactory(is_staff=True, two_factor_enabled=True)
+        client.force_login(user)
+        otp_verify_user(user, client)
+
+        response = client.get(reverse("admin:secret_import"))
+
+        assert response.status_code == 403
@@ -0,0 +1,264 @@
+import io
+import json
+import pickle
+
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django_cryptography.core.signing import FernetSigner
+from django_cryptography.utils.crypto import FernetBytes, InvalidToken
+
+from secret.fields import Ciphertext
+from secret.keys import configured_keys, decrypt, derive_key, encrypt, reencrypt_values
+from secret.management.commands.reencrypt import checkpoint_target
+from secret.models import Secret, SecretBlob, SecretFile
+from .factories import SecretFactory, SecretFileFactory
+
+pytestmark = pytest.mark.django_db
+
+OLD_KEY = {"key": "an-old-key", "salt": "an-old-salt"}
+
+
+def _encrypt_with_old_key(value):
+    fernet = FernetBytes(derive_key(OLD_KEY["key"], OLD_KEY["salt"]), FernetSigner())
+    return Ciphertext(fernet.encrypt(pickle.dumps(value)))
+
+
+@pytest.fixture
+def old_keys(settings):
+    settings.CRYPTOGRAPHY_OLD_KEYS = [OLD_KEY]
+
+
+def _secret_under_old_key(password):
+    secret = SecretFactory()
+    Secret.objects.filter(pk=secret.pk).update(password=_encrypt_with_old_key(password))
+    return secret
+
+
+def _raw_password(secret):
+    return Secret.objects.with_encrypted().get(pk=secret.pk).__dict__["password"]
+
+
+def test_derive_key_matches_settings(settings):
+    assert derive_key("a-crypto-key", "a-crypto-salt") == settings.CRYPTOGRAPHY_KEY
+
+
+def test_old_key_decrypts(old_keys):
+    secret = _secret_under_old_key("old password")
+
+    assert Secret.objects.with_encrypted().get(pk=secret.pk).password == "old password"
+
+
+def test_old_key_not_configured():
+    secret = _secret_under_old_key("old password")
+
+    # signed with the same SECRET_KEY, so it is the padding that gives the wrong key away
+    with pytest.raises(InvalidToken):
+        Secret.objects.with_encrypted().get(pk=secret.pk).password
+
+
+def test_wrong_type_not_decrypted(old_keys):
+    # as when a wrong key passes the signature and padding checks and yields garbage that unpickles
+    data = _encrypt_with_old_key(None).data
+
+    with pytest.raises(InvalidToken):
+        decrypt(data)
+
+    # and so is not rewritten under the current key
+    with pytest.raises(InvalidToken):
+        reencrypt_values([data], [False])
+
+    assert decrypt(_encrypt_with_old_key(b"bytes").data, binary=True) == b"bytes"
+
+
+def test_saved_under_current_key(old_keys, settings):
+    secret = _secret_under_old_key("old password")
+    secret = Secret.objects.with_encrypted().get(pk=secret.pk)
+    secret.password = secret.password
+    secret.save()
+
+    settings.CRYPTOGRAPHY_OLD_KEYS = []
+
+    assert Secret.objects.with_encrypted().get(pk=secret.pk).password == "old password"
+
+
+class TestCodecs:
+    @pytest.mark.parametrize("codec", ["fernet", "aes-gcm"])
+    @pytest.mark.parametrize(
+        "value, binary", [("pässword", False), ("", False), (b"\x00\xff", True)]
+    )
+    def test_round_trip(self, codec, value, binary):
+        assert decrypt(encrypt(value, binary=binary, codec=codec), binary=binary) == value
+
+    def test_aes_gcm_format(self):
+        data = encrypt("password", codec="aes-gcm")
+
+        assert data[:1] == b"\x01"
+        # version, key id, nonce and tag
+        assert len(data) == len("password") + 1 + 4 + 12 + 16
+
+    def test_tampered(self):
+        data = bytearray(encrypt("password", codec="aes-gcm"))
+        data[-1] ^= 1
+
+        with pytest.raises(InvalidToken):
+            decrypt(bytes(data))
+
+    def test_unknown_format(self):
+        with pytest.raises(InvalidToken, match="Unknown ciphertext format"):
+            decrypt(b"\x02" + b"x" * 40)
+
+    def test_old_key(self, settings):
+        settings.CRYPTOGRAPHY_KEY = derive_key(OLD_KEY["key"], OLD_KEY["salt"])
+        data = encrypt("password", codec="aes-gcm")
+
+        settings.CRYPTOGRAPHY_KEY = derive_key("a-crypto-key", "a-crypto-salt")
+
+        with pytest.raises(InvalidToken, match="not configured"):
+            decrypt(data)
+
+        settings.CRYPTOGRAPHY_OLD_KEYS = [OLD_KEY]
+
+        assert decrypt(data) == "password"
+
+    def test_fields_written_in_configured_format(self, settings):
+        secret = SecretFactory(password="password")
+        assert bytes(_raw_password(secret).data[:1]) == b"\x01"
+
+        settings.SECRET_FIELD_CODEC = "fernet"
+        secret = SecretFactory(password="password")
+        assert bytes(_raw_password(secret).data[:1]) == b"\x80"
+
+    def test_old_format_moves_on_save(self):
+        secret = SecretFactory()
+        Secret.objects.filter(pk=secret.pk).update(
+            password=Ciphertext(encrypt("password", codec="fernet"))
+        )
+
+        # saving an unread value leaves it as it is
+        Secret.objects.with_encrypted().get(pk=secret.pk).save()
+        assert bytes(_raw_password(secret).data[:1]) == b"\x80"
+
+        secret = Secret.objects.with_encrypted().get(pk=secret.pk)
+        assert secret.password == "password"
+        secret.save()
+
+        assert bytes(_raw_password(secret).data[:1]) == b"\x01"
+        assert Secret.objects.with_encrypted().get(pk=secret.pk).password == "password"
+
+
+class TestReencrypt:
+    @pytest.fixture
+    def checkpoint(self, tmp_path):
+        return str(tmp_path / "checkpoint.json")
+
+    def _reencrypt(self, checkpoint, *args):
+        stdout = io.StringIO()
+        call_command("reencrypt", "--workers=0", f"--checkpoint={checkpoint}", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_reencrypt(self, old_keys, settings, checkpoint):
+        old = [_secret_under_old_key(f"password {n}") for n in range(3)]
+        current = SecretFactory(password="current")
+        unchanged = _raw_password(current)
+        blob_id = SecretFileFactory(secret=current, content=b"contents").blob_id
+        SecretBlob.objects.filter(pk=blob_id).update(
+            encryption_key=_encrypt_with_old_key(b"k" * 32)
+        )
+
+        output = self._reencrypt(checkpoint, "--batch-size=2")
+
+        assert "secret.Secret: done, 4 rows checked, 3 rewritten" in output
+        assert "secret.SecretBlob: done, 1 rows checked, 1 rewritten" in output
+        assert _raw_password(current) == unchanged
+
+        settings.CRYPTOGRAPHY_OLD_KEYS = []
+
+        for n, secret in enumerate(old):
+            assert Secret.objects.with_encrypted().get(pk=secret.pk).password == f"password {n}"
+        assert SecretBlob.objects.with_encrypted().get(pk=blob_id).encryption_key == b"k" * 32
+
+    def test_checkpoint_removed(self, old_keys, checkpoint, tmp_path):
+        _secret_under_old_key("old password")
+
+        self._reencrypt(checkpoint)
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_resume(self, old_keys, settings, checkpoint):
+        first, second = sorted(
+            (_secret_under_old_key("old password") for _ in range(2)), key=lambda s: s.pk
+        )
+        first_raw = _raw_password(first)
+
+        with open(checkpoint, "w") as f:
+            json.dump(
+                {
+                    "target": checkpoint_target(configured_keys(), settings.SECRET_FIELD_CODEC),
+                    "secret.Secret": {"last_pk": str(first.pk), "rows": 1, "rewritten": 1},
+                },
+                f,
+            )
+
+        output = self._reencrypt(checkpoint, "--model=secret.Secret")
+
+        assert "Resuming" in output
+        assert "secret.Secret: done, 2 rows checked, 2 rewritten" in output
+        assert _raw_password(first) == first_raw
+
+        settings.CRYPTOGRAPHY_OLD_KEYS = []
+
+        assert Secret.objects.with_encrypted().get(pk=second.pk).password == "old password"
+
+    def test_checkpoint_from_another_key_ignored(self, old_keys, settings, checkpoint):
+        secret = _secret_under_old_key("old password")
+        self._reencrypt(checkpoint, "--model=secret.Secret")
+
+        # the next rotation puts the secret under a retired key again
+        settings.CRYPTOGRAPHY_KEY = derive_key("a-new-key", "a-crypto-salt")
+        settings.CRYPTOGRAPHY_OLD_KEYS = [{"key": "a-crypto-key", "salt": "a-crypto-salt"}]
+
+        output = self._reencrypt(checkpoint)
+
+        assert "Ignoring" in output
+        assert "secret.Secret: done, 1 rows checked, 1 rewritten" in output
+
+        settings.CRYPTOGRAPHY_OLD_KEYS = []
+
+        assert Secret.objects.with_encrypted().get(pk=secret.pk).password == "old password"
+
+    def test_unknown_model(self, checkpoint):
+        with pytest.raises(CommandError, match="No encrypted fields on user.User"):
+            self._reencrypt(checkpoint, "--model=user.User")
+
+    def test_process_pool(self, old_keys, settings, checkpoint):
+        secrets = [_secret_under_old_key(f"password {n}") for n in range(4)]
+
+        stdout = io.StringIO()
+        call_command("reencrypt", "--workers=2", f"--checkpoint={checkpoint}", stdout=stdout)
+
+        assert "secret.Secret: done, 4 rows checked, 4 rewritten" in stdout.getvalue()
+
+        settings.CRYPTOGRAPHY_OLD_KEYS = []
+
+        for n, secret in enumerate(secrets):
+            assert Secret.objects.with_encrypted().get(pk=secret.pk).password == f"password {n}"
+
+    def test_old_format(self, checkpoint):
+        secret = SecretFactory()
+        Secret.objects.filter(pk=secret.pk).update(
+            password=Ciphertext(encrypt("password", codec="fernet"))
+        )
+        secret_file = SecretFileFactory(secret=SecretFactory(), file_data=b"stored whole")
+        SecretFile.objects.filter(pk=secret_file.pk).update(
+            file_data=Ciphertext(encrypt(b"stored whole", binary=True, codec="fernet"))
+        )
+
+        output = self._reencrypt(checkpoint)
+
+        assert "secret.Secret: done, 2 rows checked, 1 rewritten" in output
+        assert "secret.SecretFile: done, 1 rows checked, 1 rewritten" in output
+        assert bytes(_raw_password(secret).data[:1]) == b"\x01"
+        assert Secret.objects.with_encrypted().get(pk=secret.pk).password == "password"
+        assert SecretFile.objects.with_encrypted().get().file_data == b"stored whole"
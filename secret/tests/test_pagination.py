@@ -0,0 +1,88 @@
+import pytest
+
+from secret.models import Secret
+from secret.pagination import InvalidCursor, KeysetPaginator
+from .factories import SecretFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _names(page):
+    return [secret.name for secret in page]
+
+
+class TestKeysetPaginator:
+    def test_forward_and_back(self):
+        for name in ["a", "b", "c", "d", "e"]:
+            SecretFactory(name=name)
+
+        paginator = KeysetPaginator(Secret.objects.all(), 2)
+
+        first = paginator.page()
+        assert _names(first) == ["a", "b"]
+        assert first.has_next() and not first.has_previous()
+        assert first.previous_cursor is None
+
+        second = paginator.page(first.next_cursor)
+        assert _names(second) == ["c", "d"]
+        assert second.has_next() and second.has_previous()
+
+        third = paginator.page(second.next_cursor)
+        assert _names(third) == ["e"]
+        assert not third.has_next() and third.has_previous()
+        assert third.next_cursor is None
+
+        assert _names(paginator.page(third.previous_cursor)) == ["c", "d"]
+
+        back = paginator.page(second.previous_cursor)
+        assert _names(back) == ["a", "b"]
+        assert back.has_next() and not back.has_previous()
+
+    def test_ties_broken_by_pk(self):
+        pks = sorted(SecretFactory(name="same").pk for _ in range(3))
+
+        paginator = KeysetPaginator(Secret.objects.all(), 2)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+
+        assert [s.pk for s in first] + [s.pk for s in second] == pks
+
+    def test_descending_ordering(self):
+        for name in ["a", "b", "c"]:
+            SecretFactory(name=name)
+
+        paginator = KeysetPaginator(Secret.objects.order_by("-name"), 2)
+        first = paginator.page()
+        assert _names(first) == ["c", "b"]
+        assert _names(paginator.page(first.next_cursor)) == ["a"]
+
+    def test_datetime_key(self):
+        SecretFactory.create_batch(3)
+
+        paginator = KeysetPaginator(Secret.objects.order_by("last_updated"), 2)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+
+        seen = [s.pk for s in first] + [s.pk for s in second]
+        assert sorted(seen) == sorted(Secret.objects.values_list("pk", flat=True))
+
+    def test_invalid_cursor(self):
+        SecretFactory(name="a")
+        SecretFactory(name="b")
+
+        paginator = KeysetPaginator(Secret.objects.all(), 1)
+        cursor = paginator.page().next_cursor
+
+        with pytest.raises(InvalidCursor):
+            paginator.decode_cursor("not-a-cursor")
+
+        with pytest.raises(InvalidCursor):
+            KeysetPaginator(Secret.objects.order_by("url"), 1).decode_cursor(cursor)
+
+        assert _names(paginator.page("not-a-cursor")) == ["a"]
+
+    def test_count(self):
+        SecretFactory.create_batch(3)
+
+        assert KeysetPaginator(Secret.objects.all(), 2).count is None
+        assert KeysetPaginator(Secret.objects.all(), 2, count=True).count == 3
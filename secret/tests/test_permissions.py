@@ -0,0 +1,73 @@
+import pytest
+
+from django.template import Context, Template
+
+from guardian.shortcuts import assign_perm
+
+from secret.permissions import get_secret_perms, has_secret_perm
+from user.tests.factories import GroupFactory, UserFactory
+from .factories import SecretFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _request(rf, user):
+    request = rf.get("/some/url")
+    request.user = user
+    return request
+
+
+class TestSecretPerms:
+    def test_direct_and_group_perms(self, rf, django_assert_num_queries):
+        user = UserFactory()
+        group = GroupFactory()
+        user.groups.add(group)
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+        assign_perm("change_secret", group, secret)
+
+        request = _request(rf, user)
+
+        with django_assert_num_queries(1):
+            assert get_secret_perms(request, secret) == {"view_secret", "change_secret"}
+            assert has_secret_perm(request, "secret.change_secret", secret)
+            assert has_secret_perm(request, "view_secret", secret)
+            assert not has_secret_perm(request, "secret.delete_secret", secret)
+
+    def test_other_secret(self, rf):
+        user = UserFactory()
+        secret, other_secret = SecretFactory(), SecretFactory()
+
+        assign_perm("view_secret", user, other_secret)
+
+        assert get_secret_perms(_request(rf, user), secret) == set()
+
+    def test_superuser(self, rf, django_assert_num_queries):
+        user = UserFactory(is_superuser=True)
+        secret = SecretFactory()
+
+        with django_assert_num_queries(0):
+            assert has_secret_perm(_request(rf, user), "secret.change_secret", secret)
+
+    def test_inactive_user(self, rf):
+        user = UserFactory(is_active=False)
+        secret = SecretFactory()
+
+        assign_perm("change_secret", user, secret)
+
+        assert get_secret_perms(_request(rf, user), secret) == set()
+
+    def test_template_tag(self, rf):
+        user = UserFactory()
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+
+        template = Template(
+            "{% load secret_tags %}{% get_secret_perms object as perms %}"
+            '{% if "view_secret" in perms %}view{% endif %}'
+            '{% if "change_secret" in perms %}change{% endif %}'
+        )
+
+        assert template.render(Context({"request": _request(rf, user), "object": secret})) == "view"
@@ -1,14 +1,19 @@
+import datetime as dt
 import pytest
 from io import BytesIO
 import re
 from urllib.parse import quote_plus
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from guardian.shortcuts import assign_perm, get_perms
 
-from audit.models import Actions, Audit
+from audit.models import Actions, Audit, create_audit_event
+from secret.fields import decryption_count
+from secret.files import iter_file
 from secret.models import Secret, SecretFile
 from secret.tests.factories import SecretFactory, SecretFileFactory
 from user.tests.factories import UserFactory, otp_verify_user, GroupFactory
@@ -575,6 +580,120 @@ class TestSecretAuditView:
         assert response.status_code == 200
         assert response.template_name == ["secret/secret_audit.html"]
 
+    def test_pagination(self, client, settings):
+        settings.SECRET_AUDIT_ITEMS_PER_PAGE = 2
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+
+        for minutes in range(5):
+            Audit.objects.create(
+                user=user,
+                secret=secret,
+                action=Actions.view_secret.name,
+                description=f"event {minutes}",
+                timestamp=timezone.now() - dt.timedelta(minutes=minutes),
+            )
+
+        url = reverse("secret:audit", kwargs={"pk": secret.pk})
+        descriptions = []
+        cursor = None
+
+        while True:
+            response = client.get(url, {"cursor": cursor} if cursor else {})
+            page = response.context["page_obj"]
+            descriptions += [audit.description for audit in page]
+
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+
+        assert descriptions == [f"event {minutes}" for minutes in range(5)]
+
+    def test_filters(self, client):
+        user = login_and_verify_user(client)
+        other_user = UserFactory()
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+
+        # through create_audit_event, which keeps the rollups the user choices come from
+        create_audit_event(user, Actions.view_secret, secret=secret)
+        create_audit_event(user, Actions.update_secret, secret=secret)
+        create_audit_event(other_user, Actions.view_secret, secret=secret)
+
+        url = reverse("secret:audit", kwargs={"pk": secret.pk})
+
+        response = client.get(url)
+        assert set(response.context["audit_filter"].filters["user"].queryset) == {
+            user,
+            other_user,
+        }
+
+        response = client.get(url, {"action": Actions.view_secret.name})
+        assert {audit.user for audit in response.context["audit_info"]} == {user, other_user}
+
+        response = client.get(url, {"action": Actions.view_secret.name, "user": other_user.pk})
+        assert [audit.user for audit in response.context["audit_info"]] == [other_user]
+
+    def test_bounded_by_first_event(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+        create_audit_event(user, Actions.view_secret, secret=secret)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("secret:audit", kwargs={"pk": secret.pk}))
+
+        assert len(response.context["audit_info"]) == 1
+
+        # the page is read from the secret's first event on, which on Postgres leaves out the
+        # partitions from before it
+        first_query, page_query = [
+            query["sql"] for query in queries if 'FROM "audit_audit"' in query["sql"]
+        ]
+        assert "MIN(" in first_query
+        assert '"audit_audit"."timestamp" >=' in page_query
+
+    def test_events_not_rolled_up(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+        # e.g. history from before the secret was created that `rollup_audit` has yet to backfill
+        Audit.objects.create(
+            user=user,
+            secret=secret,
+            action=Actions.view_secret.name,
+            timestamp=secret.created - dt.timedelta(days=400),
+        )
+        create_audit_event(user, Actions.view_secret, secret=secret)
+
+        response = client.get(reverse("secret:audit", kwargs={"pk": secret.pk}))
+
+        assert len(response.context["audit_info"]) == 2
+
+    def test_constant_queries(self, client, django_assert_max_num_queries):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+
+        for _ in range(30):
+            Audit.objects.create(user=UserFactory(), secret=secret, action=Actions.view_secret.name)
+
+        url = reverse("secret:audit", kwargs={"pk": secret.pk})
+
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+
+        Audit.objects.create(user=UserFactory(), secret=secret, action=Actions.view_secret.name)
+
+        with django_assert_max_num_queries(len(queries)):
+            client.get(url)
+
 
 class TestMFAClientSetup:
     def test_page_requires_auth(self, client):
@@ -871,7 +990,8 @@ class TestFileAdd:
         file_ = SecretFile.objects.first()
 
         assert file_.file_name == file_name
-        assert file_.file_data == file_content
+        assert file_.size == len(file_content)
+        assert b"".join(iter_file(file_)) == file_content
 
     def test_audit(self, client):
         user = login_and_verify_user(client)
@@ -1033,7 +1153,7 @@ class TestFileDownload:
 
         assert response.status_code == 200
         assert response["Content-Disposition"] == f'attachment; filename="{file_.file_name}"'
-        assert file_.file_data == [item for item in response][0]
+        assert b"".join(response.streaming_content) == b"This is a test file"
 
     def test_audit(self, client):
         user = login_and_verify_user(client)
@@ -1050,3 +1170,62 @@ class TestFileDownload:
         audit = secret.audit_set.first()
         assert audit.user == user
         assert audit.description == file_.file_name
+
+
+class TestSecretLoadedOncePerRequest:
+    def _secret_queries(self, queries):
+        return [q for q in queries.captured_queries if 'FROM "secret_secret"' in q["sql"]]
+
+    @pytest.mark.parametrize(
+        "method, url_name, data",
+        [
+            ("get", "secret:detail", None),
+            ("post", "secret:detail", {"name": "hello world"}),
+            ("get", "secret:permissions", None),
+            ("get", "secret:audit", None),
+            ("get", "secret:mfa", None),
+            ("get", "secret:file_list", None),
+            ("get", "secret:file_add", None),
+        ],
+    )
+    def test_secret_fetched_once(self, client, method, url_name, data):
+        user = login_and_verify_user(client)
+        secret = SecretFactory(mfa_string="")
+
+        assign_perm("change_secret", user, secret)
+        assign_perm("view_secret", user, secret)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(reverse(url_name, kwargs={"pk": secret.pk}), data)
+
+        assert response.status_code in (200, 302)
+        assert len(self._secret_queries(queries)) == 1
+
+    def test_fields_decrypted_once(self, client):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+
+        assign_perm("view_secret", user, secret)
+
+        client.get(reverse("secret:detail", kwargs={"pk": secret.pk}))
+
+        # password, details and mfa_string, each once
+        assert decryption_count() == 3
+
+    @pytest.mark.parametrize("url_name", ["secret:detail", "secret:file_list", "secret:audit"])
+    def test_permissions_fetched_once(self, client, url_name):
+        user = login_and_verify_user(client)
+        secret = SecretFactory()
+
+        assign_perm("change_secret", user, secret)
+        assign_perm("view_secret", user, secret)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse(url_name, kwargs={"pk": secret.pk}))
+
+        assert response.status_code == 200
+        assert "Delete" in response.content.decode("utf-8")
+        perm_queries = [
+            q for q in queries.captured_queries if "secret_secretuserobjectpermission" in q["sql"]
+        ]
+        assert len(perm_queries) == 1
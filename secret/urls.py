@@ -38,5 +38,6 @@ urlpatterns = [
     path("secret/<str:pk>/files/", views.SecretFileListView.as_view(), name="file_list"),
     path("secret/<str:pk>/files/add/", views.SecretFileUploadView.as_view(), name="file_add"),
     path("secret/<str:pk>/files/delete/<str:file_pk>/", views.SecretFileDeleteView.as_view(), name="file_delete"),
+    path("secret/<str:pk>/files/download/", views.SecretFileDownloadAllView.as_view(), name="file_download_all"),
     path("secret/<str:pk>/files/download/<str:file_pk>/", views.SecretFileDownloadView.as_view(), name="file_download"),
 ]
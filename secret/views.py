@@ -1,11 +1,11 @@
 import logging
-import io
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.models import Group
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import FileResponse, Http404
+from django.db.models import Min
+from django.http import FileResponse, Http404, HttpResponse
 from django.views.generic import DeleteView, FormView
 from django.views.generic.base import ContextMixin, TemplateView, View
 from django.views.generic.detail import DetailView, SingleObjectMixin
@@ -14,6 +14,9 @@ from django.urls import reverse, reverse_lazy
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.decorators import method_decorator
+from django.utils.http import content_disposition_header
+from django.utils.text import slugify
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.debug import sensitive_post_parameters
 
 from django_filters.views import FilterView
@@ -23,11 +26,22 @@ from guardian.shortcuts import (
     get_user_perms,
     get_users_with_perms,
 )
-from guardian.decorators import permission_required_or_403
 from django_otp.decorators import otp_required
 
-from audit.models import Actions, Audit, create_audit_event
+from audit.filters import AuditFilter
+from audit.models import Actions, Audit, create_audit_event, create_audit_events
 from user.models import User
+from .decorators import get_secret, permission_required_or_403
+from .files import (
+    EncryptingUploadHandler,
+    RangeNotSatisfiable,
+    delete_secret_file,
+    guess_content_type,
+    iter_file,
+    iter_zip,
+    parse_range,
+    save_uploaded_file,
+)
 from .filters import SecretFilter
 from .forms import (
     EDIT_SECRET_PERMISSION,
@@ -41,16 +55,33 @@ from .forms import (
     SecretUserPermissionsForm,
 )
 from .models import Secret, SecretFile
+from .pagination import KeysetPaginator
 
 
 logger = logging.getLogger(__name__)
 
 
+class SecretObjectMixin:
+    """Take the view's secret from the request's cache rather than querying for it again"""
+
+    def get_object(self, queryset=None):
+        return get_secret(self.request, self.kwargs[self.pk_url_kwarg])
+
+
 class SecretListView(FilterView):
     paginate_by = settings.SECRET_PAGINATION_ITEMS_PER_PAGE
     filterset_class = SecretFilter
     template_name = "secret/secret_list.html"
 
+    def paginate_queryset(self, queryset, page_size):
+        if settings.SECRET_PAGINATION_MODE != "keyset":
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size, count=settings.SECRET_PAGINATION_SHOW_COUNT)
+        page = paginator.page(self.request.GET.get("cursor"))
+
+        return paginator, page, page.object_list, page.has_other_pages()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
@@ -62,6 +93,7 @@ class SecretListView(FilterView):
             {
                 "filter_group": filter_group,
                 "search_term": self.filterset.data.get("name", None),
+                "keyset_pagination": settings.SECRET_PAGINATION_MODE == "keyset",
             }
         )
 
@@ -91,10 +123,10 @@ class SecretCreateView(CreateView):
 @method_decorator(sensitive_post_parameters("password", "details"), name="dispatch")
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.change_secret"),
     name="dispatch",
 )
-class SecretDeleteView(DeleteView):
+class SecretDeleteView(SecretObjectMixin, DeleteView):
     model = Secret
     success_url = reverse_lazy("secret:list")
 
@@ -135,17 +167,24 @@ class SecretDeleteView(DeleteView):
 @method_decorator(sensitive_post_parameters("password", "details"), name="dispatch")
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.change_secret"),
     name="post",
 )
 @method_decorator(
-    permission_required_or_403("secret.view_secret", (Secret, "pk", "pk")), name="get"
+    permission_required_or_403("secret.view_secret"), name="get"
 )
-class SecretDetailView(UpdateView):
+class SecretDetailView(SecretObjectMixin, UpdateView):
     model = Secret
-    queryset = Secret.objects.filter(deleted=False)
     form_class = SecretUpdateForm
 
+    def get_object(self, queryset=None):
+        secret = super().get_object(queryset)
+
+        if secret.deleted:
+            raise Http404("Secret does not exist")
+
+        return secret
+
     def get(self, request, *args, **kwargs):
         create_audit_event(
             self.request.user,
@@ -173,10 +212,10 @@ class SecretDetailView(UpdateView):
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.view_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.view_secret"),
     name="dispatch",
 )
-class SecretAuditView(DetailView):
+class SecretAuditView(SecretObjectMixin, DetailView):
     template_name = "secret/secret_audit.html"
     model = Secret
     object = None
@@ -185,9 +224,26 @@ class SecretAuditView(DetailView):
 
         context = super().get_context_data(**kwargs)
 
-        context["audit_info"] = Audit.objects.filter(secret__pk=self.kwargs["pk"]).order_by(
-            "-timestamp"
+        queryset = Audit.objects.filter(secret=self.object)
+        # the secret's first event, one (secret, -timestamp) index lookup per partition, bounds the
+        # timestamp, so that on Postgres the page is read only from the partitions from then on.
+        # It is taken from the audit table itself, as the rollups may not go back that far.
+        since = queryset.aggregate(first=Min("timestamp"))["first"]
+
+        if since:
+            queryset = queryset.filter(timestamp__gte=since)
+
+        audit_filter = AuditFilter(
+            self.request.GET,
+            queryset=queryset.select_related("user").order_by("-timestamp"),
+            secret=self.object,
         )
+
+        paginator = KeysetPaginator(audit_filter.qs, settings.SECRET_AUDIT_ITEMS_PER_PAGE)
+        page = paginator.page(self.request.GET.get("cursor"))
+
+        context["audit_filter"] = audit_filter
+        context["audit_info"] = context["page_obj"] = page
         context["tab"] = "audit"
         context["pk"] = self.kwargs["pk"]
 
@@ -196,13 +252,13 @@ class SecretAuditView(DetailView):
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.change_secret"),
     name="post",
 )
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")), name="get"
+    permission_required_or_403("secret.change_secret"), name="get"
 )
-class SecretPermissionsDeleteView(DetailView):
+class SecretPermissionsDeleteView(SecretObjectMixin, DetailView):
     model = Secret
     template_name = "secret/confirm-delete.html"
     object = None
@@ -279,11 +335,11 @@ class SecretPermissionsDeleteView(DetailView):
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.change_secret"),
     name="post",
 )
 @method_decorator(
-    permission_required_or_403("secret.view_secret", (Secret, "pk", "pk")), name="get"
+    permission_required_or_403("secret.view_secret"), name="get"
 )
 class SecretPermissionsView(FormView):
     template_name = "secret/permissions.html"
@@ -300,7 +356,7 @@ class SecretPermissionsView(FormView):
             return SecretUserPermissionsForm
 
     def form_valid(self, form):
-        secret = Secret.objects.get(pk=self.kwargs["pk"])
+        secret = get_secret(self.request, self.kwargs["pk"])
 
         http_response = super().form_valid(form)
 
@@ -335,9 +391,7 @@ class SecretPermissionsView(FormView):
 
         pk = context["pk"] = self.kwargs["pk"]
         context["tab"] = "permissions"
-        context["object"] = Secret.objects.get(pk=self.kwargs["pk"])
-
-        secret = Secret.objects.get(pk=pk)
+        secret = context["object"] = get_secret(self.request, pk)
 
         users = get_users_with_perms(
             secret,
@@ -378,10 +432,10 @@ class SecretPermissionsView(FormView):
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.change_secret"),
     name="dispatch",
 )
-class SecretMFASetupView(SingleObjectMixin, FormView):
+class SecretMFASetupView(SecretObjectMixin, SingleObjectMixin, FormView):
     template_name = "secret/mfa_setup.html"
     form_class = MFAClientSetupForm
     model = Secret
@@ -418,10 +472,10 @@ class SecretMFASetupView(SingleObjectMixin, FormView):
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.view_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.view_secret"),
     name="dispatch",
 )
-class SecretMFAView(SingleObjectMixin, TemplateView):
+class SecretMFAView(SecretObjectMixin, SingleObjectMixin, TemplateView):
     template_name = "secret/mfa.html"
     model = Secret
 
@@ -445,10 +499,10 @@ class SecretMFAView(SingleObjectMixin, TemplateView):
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")),
+    permission_required_or_403("secret.change_secret"),
     name="dispatch",
 )
-class SecretMFADeleteView(DeleteView):
+class SecretMFADeleteView(SecretObjectMixin, DeleteView):
     model = Secret
     template_name = "secret/mfa_delete.html"
 
@@ -481,9 +535,9 @@ class SecretMFADeleteView(DeleteView):
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.view_secret", (Secret, "pk", "pk")), name="dispatch",
+    permission_required_or_403("secret.view_secret"), name="dispatch",
 )
-class SecretFileListView(SingleObjectMixin, TemplateView):
+class SecretFileListView(SecretObjectMixin, SingleObjectMixin, TemplateView):
     template_name = "secret/file_list.html"
     model = Secret
 
@@ -494,6 +548,8 @@ class SecretFileListView(SingleObjectMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["tab"] = "files"
+        # metadata only: the encrypted columns are deferred and the chunks are not touched
+        context["files"] = self.object.files.order_by("created", "pk")
 
         return context
 
@@ -501,23 +557,27 @@ class SecretFileListView(SingleObjectMixin, TemplateView):
 @method_decorator(sensitive_post_parameters("file"), name="dispatch")
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")), name="dispatch",
+    permission_required_or_403("secret.change_secret"), name="dispatch",
 )
-class SecretFileUploadView(CreateView):
+class SecretFileUploadView(SecretObjectMixin, CreateView):
     form_class = SecretFileUploadForm
     template_name = "secret/file_upload.html"
     model = Secret
 
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        # the upload is encrypted as it is read, so the handler has to be in place before the CSRF
+        # check reads the request body
+        request.upload_handlers = [EncryptingUploadHandler(request)]
+
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
+
     def form_valid(self, form):
         messages.info(self.request, "File uploaded")
 
         uploaded_file = self.request.FILES["file"]
 
-        file_obj = SecretFile.objects.create(
-            secret=self.get_object(),
-            file_name=uploaded_file.name,
-            file_data=uploaded_file.read(),
-        )
+        save_uploaded_file(self.get_object(), uploaded_file)
 
         create_audit_event(self.request.user, Actions.upload_file, secret=self.get_object(), description=uploaded_file.name)
 
@@ -546,12 +606,18 @@ class SecretFileUploadView(CreateView):
 
 class FileObjectMixin:
     file_obj = None
+    with_file_data = False
 
     def _get_file_object(self):
 
         if not self.file_obj:
+            files = self.get_object().files
+
+            if self.with_file_data:
+                files = files.with_encrypted()
+
             try:
-                self.file_obj = self.get_object().files.get(pk=self.kwargs["file_pk"])
+                self.file_obj = files.get(pk=self.kwargs["file_pk"])
             except SecretFile.DoesNotExist:
                 raise Http404("File does not exist")
 
@@ -560,9 +626,9 @@ class FileObjectMixin:
 
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.change_secret", (Secret, "pk", "pk")), name="dispatch",
+    permission_required_or_403("secret.change_secret"), name="dispatch",
 )
-class SecretFileDeleteView(FileObjectMixin, DeleteView):
+class SecretFileDeleteView(SecretObjectMixin, FileObjectMixin, DeleteView):
     model = Secret
     template_name = "secret/file_delete.html"
 
@@ -590,7 +656,7 @@ class SecretFileDeleteView(FileObjectMixin, DeleteView):
         file_obj = self._get_file_object()
         create_audit_event(self.request.user, Actions.delete_file, secret=self.object, description=file_obj.file_name)
 
-        file_obj.delete()
+        delete_secret_file(file_obj)
 
         messages.info(request, "File deleted")
 
@@ -603,16 +669,98 @@ class SecretFileDeleteView(FileObjectMixin, DeleteView):
 @method_decorator(sensitive_post_parameters("file"), name="dispatch")
 @method_decorator(otp_required, name="dispatch")
 @method_decorator(
-    permission_required_or_403("secret.view_secret", (Secret, "pk", "pk")), name="dispatch",
+    permission_required_or_403("secret.view_secret"), name="dispatch",
 )
-class SecretFileDownloadView(FileObjectMixin, SingleObjectMixin, View):
+class SecretFileDownloadView(SecretObjectMixin, FileObjectMixin, SingleObjectMixin, View):
     model = Secret
+    with_file_data = True
+
+    def get_byte_range(self, file_obj, etag):
+        """
+        The range asked for by a `Range` header, or None to send the whole file. A range is only
+        honoured for files with a hash, and when any `If-Range` still matches the file's ETag.
+        """
+        if not etag or "HTTP_RANGE" not in self.request.META:
+            return None
+
+        if self.request.META.get("HTTP_IF_RANGE", etag) != etag:
+            return None
+
+        return parse_range(self.request.META["HTTP_RANGE"], file_obj.size)
 
     def get(self, request, *args, **kwargs):
         secret = self.get_object()
 
         file_obj = self._get_file_object()
+        etag = f'"{file_obj.sha256}"' if file_obj.sha256 else None
+
+        try:
+            byte_range = self.get_byte_range(file_obj, etag)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{file_obj.size}"
+            return response
 
-        create_audit_event(self.request.user, Actions.download_file, secret=secret, description=file_obj.file_name)
+        # the requests for the ranges of a resumed or split download are audited as one download
+        # of this version of the file; a request for the whole file is always audited
+        create_audit_event(
+            self.request.user,
+            Actions.download_file,
+            secret=secret,
+            description=file_obj.file_name,
+            report_once=byte_range is not None,
+            report_once_key=f"file:{file_obj.pk}:{file_obj.sha256}",
+        )
+
+        content_type = file_obj.content_type or guess_content_type(file_obj.file_name)
+
+        if byte_range:
+            start, end = byte_range
+            response = FileResponse(iter_file(file_obj, start, end), content_type=content_type, status=206)
+            response["Content-Range"] = f"bytes {start}-{end - 1}/{file_obj.size}"
+            response["Content-Length"] = end - start
+        else:
+            response = FileResponse(iter_file(file_obj), content_type=content_type)
+
+            if file_obj.blob_id is not None:
+                response["Content-Length"] = file_obj.size
+
+        response["Content-Disposition"] = content_disposition_header(True, file_obj.file_name)
+
+        if etag:
+            response["ETag"] = etag
+            response["Accept-Ranges"] = "bytes"
+
+        return response
+
+
+@method_decorator(otp_required, name="dispatch")
+@method_decorator(
+    permission_required_or_403("secret.view_secret"), name="dispatch",
+)
+class SecretFileDownloadAllView(SecretObjectMixin, SingleObjectMixin, View):
+    """Every file on a secret as one streamed ZIP archive, audited as a download of each"""
+
+    model = Secret
+
+    def get(self, request, *args, **kwargs):
+        secret = self.get_object()
+        # metadata only; `iter_zip` reads each file's contents as it reaches it
+        files = list(secret.files.order_by("created", "pk"))
+
+        if not files:
+            raise Http404("No files to download")
+
+        create_audit_events(
+            self.request.user,
+            Actions.download_file,
+            [file_obj.file_name for file_obj in files],
+            secret=secret,
+        )
+
+        response = FileResponse(iter_zip(files), content_type="application/zip")
+        response["Content-Disposition"] = content_disposition_header(
+            True, f"{slugify(secret.name) or 'secret'}-files.zip"
+        )
 
-        return FileResponse(io.BytesIO(file_obj.file_data), filename=file_obj.file_name, as_attachment=True)
+        return response